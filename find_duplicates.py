@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Скрипт поиска дубликатов - находит почти одинаковые вопросы во всех темах
+(перефразированные формулировки с теми же вариантами ответа и т.п.)
+
+    python find_duplicates.py [--threshold 0.6]
+"""
+
+import os
+import sys
+import argparse
+
+# Добавляем путь для импорта
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from near_duplicates import find_all_duplicates, SIMILARITY_THRESHOLD
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск почти одинаковых вопросов во всех темах")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD,
+                        help=f"минимальное сходство 0..1 (по умолчанию {SIMILARITY_THRESHOLD})")
+    args = parser.parse_args()
+    
+    print("🔍 Поиск похожих вопросов...")
+    pairs = find_all_duplicates(args.threshold)
+    
+    for first, second in pairs:
+        print(f"\n⚠️ Сходство {first['similarity']:.0%}:")
+        for item in (first, second):
+            print(f"   • {item['theme_name']} #{item['question_id']}: {item['question'][:100]}")
+    
+    if pairs:
+        print(f"\n📊 Найдено пар похожих вопросов: {len(pairs)}")
+    else:
+        print("✅ Похожих вопросов не найдено")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
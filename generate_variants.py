@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Скрипт подготовки вариантов - строит пул из K вариантов теста по теме заранее,
+до экзамена группой; при старте теста приложение выдает готовые варианты по кругу
+Пул действует, пока тема не изменилась (иначе приложение вернется к обычной выборке)
+
+    python generate_variants.py fap297 --variants 120 --questions 20 [--category GNSS]
+"""
+
+import os
+import sys
+import argparse
+from collections import Counter
+
+# Добавляем путь для импорта
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from exam_variants import generate_variants, save_pool
+
+def main():
+    parser = argparse.ArgumentParser(description="Подготовка пула вариантов теста")
+    parser.add_argument("theme_id", help="id темы (имя файла в themes/ без .json)")
+    parser.add_argument("--variants", type=int, default=100, help="количество вариантов (по умолчанию 100)")
+    parser.add_argument("--questions", type=int, default=10, help="вопросов в варианте (по умолчанию 10)")
+    parser.add_argument("--category", help="только одна категория (по умолчанию все)")
+    parser.add_argument("--seed", type=int, help="зерно для воспроизводимого пула")
+    args = parser.parse_args()
+    
+    print(f"🚀 Построение {args.variants} вариантов по {args.questions} вопросов для темы {args.theme_id}...")
+    pool = generate_variants(args.theme_id, args.variants, args.questions, args.category, args.seed)
+    if not pool['num_questions']:
+        print("❌ В теме (категории) нет вопросов")
+        sys.exit(1)
+    
+    usage = Counter(question_id for variant in pool['variants'] for question_id in variant['question_ids'])
+    print(f"📊 Вопросов задействовано: {len(usage)}, "
+          f"попаданий в варианты на вопрос: {min(usage.values())}-{max(usage.values())}")
+    print(f"✅ Пул сохранен: {save_pool(pool)}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Скрипт проверки бланков ответов без запуска приложения
+Бланки - JSONL-файл, по одному бланку на строку:
+    {"sheet_id": "Иванов_И", "answers": [{"question_id": 1, "answer": "1000 метров"}, ...]}
+Ответы - в том же виде, что и в приложении (строка, список, словарь соответствий,
+{"items": [...], "user_order": [...]} для ordering)
+Бланки проверяются пулом процессов через calculate_partial_score, результаты -
+JSONL-файл в том же порядке
+
+    python grade_sheets.py fap297 sheets.jsonl [-o results.jsonl] [--workers 4]
+"""
+
+import os
+import sys
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Добавляем путь для импорта
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from theme_loader import load_theme
+from question_model import compile_question
+from scoring import calculate_partial_score
+
+# Бланков в одной задаче пула - чтобы не передавать их между процессами по одному
+CHUNK_SIZE = 200
+
+# Вопросы темы в процессе пула (передаются один раз при запуске процесса)
+_questions_by_id = {}
+
+def _init_worker(questions):
+    """Инициализация процесса пула: компиляция вопросов темы"""
+    global _questions_by_id
+    _questions_by_id = {q['id']: compile_question(q) for q in questions}
+
+def grade_sheet(sheet):
+    """
+    Проверить один бланк
+    Вопросы, которых нет в теме, получают 0 баллов и перечисляются в unknown_questions
+    """
+    scores = []
+    unknown = []
+    for item in sheet.get('answers', []):
+        question = _questions_by_id.get(item.get('question_id'))
+        if question is None:
+            unknown.append(item.get('question_id'))
+            continue
+        scores.append({
+            "question_id": question.id,
+            "score": calculate_partial_score(question, item.get('answer'))
+        })
+    
+    total_score = sum(entry['score'] for entry in scores)
+    # Ответ на неизвестный вопрос (опечатка в id, вопрос удален из темы) - 0 баллов, но в максимуме учитывается,
+    # иначе процент бланка завышается
+    max_score = len(scores) + len(unknown)
+    result = {
+        "sheet_id": sheet.get('sheet_id'),
+        "total_score": round(total_score, 2),
+        "max_score": max_score,
+        "percentage": round(total_score / max_score * 100, 1) if max_score else 0,
+        "scores": scores
+    }
+    if unknown:
+        result["unknown_questions"] = unknown
+    return result
+
+def grade_chunk(lines):
+    """Задача пула: [(номер строки, строка JSONL), ...] -> результаты"""
+    results = []
+    for line_number, line in lines:
+        try:
+            sheet = json.loads(line)
+            sheet.setdefault('sheet_id', line_number)
+            results.append(grade_sheet(sheet))
+        except Exception as e:
+            results.append({"sheet_id": line_number, "error": str(e)})
+    return results
+
+def read_chunks(sheets_path):
+    """Бланки пачками по CHUNK_SIZE, пустые строки пропускаются"""
+    chunk = []
+    with open(sheets_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            chunk.append((line_number, line))
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def grade_file(questions, sheets_path, results_path, workers):
+    """
+    Проверить файл бланков
+    В пуле одновременно не больше workers * 2 пачек, поэтому файл любого размера
+    не читается в память целиком; результаты пишутся в порядке бланков
+    """
+    graded = errors = 0
+    with open(results_path, 'w', encoding='utf-8') as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(questions,)) as pool:
+        pending = deque()
+        
+        def write_ready(limit):
+            nonlocal graded, errors
+            while len(pending) > limit:
+                for result in pending.popleft().result():
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    graded += 1
+                    errors += 'error' in result
+        
+        for chunk in read_chunks(sheets_path):
+            pending.append(pool.submit(grade_chunk, chunk))
+            write_ready(workers * 2)
+        write_ready(0)
+    
+    return graded, errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка бланков ответов по теме")
+    parser.add_argument("theme_id", help="id темы (имя файла в themes/ без .json)")
+    parser.add_argument("sheets", help="JSONL-файл с бланками")
+    parser.add_argument("-o", "--output", help="файл результатов (по умолчанию <бланки>.results.jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов в пуле")
+    args = parser.parse_args()
+    
+    theme_data = load_theme(args.theme_id)
+    if theme_data is None:
+        print(f"❌ Тема {args.theme_id} не найдена")
+        sys.exit(1)
+    
+    results_path = args.output or os.path.splitext(args.sheets)[0] + ".results.jsonl"
+    print(f"🚀 Проверка бланков: {args.sheets} (процессов: {args.workers})...")
+    graded, errors = grade_file(theme_data.get('questions', []), args.sheets, results_path, max(1, args.workers))
+    
+    print(f"✅ Проверено бланков: {graded}, с ошибками: {errors}")
+    print(f"📁 Результаты: {results_path}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,15 +1,27 @@
 # /home/maksim/Документы/DMA/fap_test_system/main.py
 import streamlit as st
-import random
 import sys
 import os
 import time
+import random
 from datetime import datetime
 from fpdf import FPDF
 
 # Добавляем путь для импорта
 sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
-from theme_loader import scan_themes, get_categories_for_theme
+from theme_loader import scan_theme_manifest, get_questions_by_ids, start_theme_watcher
+from adaptive_sampling import sample_question_ids, record_score, user_key
+from exam_attempt import ExamAttempt, decode_answer, NOT_SELECTED
+from exam_plan import build_exam_plan, new_seed
+from exam_variants import next_variant, get_pool_info
+from scoring import calculate_partial_score
+from protocols import (
+    build_protocol_data, write_main_protocol, write_detailed_statistics, save_attempt_record
+)
+from run_metrics import timed, script_run, start_metrics_server
+
+# Пункт выбора категории для теста по квотам (несколько категорий с заданным числом вопросов)
+QUOTAS_OPTION = "Квоты по категориям"
 
 # Настройка страницы
 st.set_page_config(
@@ -19,9 +31,14 @@ st.set_page_config(
 )
 
 # Загрузка тем
-@st.cache_data
+# Возвращает только метаданные тем из манифеста - вопросы загружаются через load_theme
+# для выбранной темы. Кэш сверяет mtime файлов, поэтому правки из редактора
+# вопросов подхватываются без перезапуска сервера.
+# При FAP_THEME_WATCH=1 вместо сверки mtime изменения приходят от наблюдателя
+@timed()
 def load_themes():
-    return scan_themes()
+    start_theme_watcher()
+    return scan_theme_manifest()
 
 def initialize_session_state():
     """Инициализация состояния сессии"""
@@ -29,16 +46,11 @@ def initialize_session_state():
         'test_started': False,
         'test_finished': False,
         'current_question': 0,
-        'score': 0,
-        'user_answers': {},
         'show_results': False,
-        'selected_questions': [],
+        'attempt': None,
         'selected_theme': None,
-        'test_config': {'category': 'Все категории', 'num_questions': 5},
+        'test_config': {'category': 'Все категории', 'num_questions': 5, 'mode': 'random', 'quotas': None},
         'question_start_time': None,
-        'question_times': [],
-        'answers_checked': {},
-        'question_scores': {},
         'user_info': None,
         'user_logged_in': False
     }
@@ -47,104 +59,46 @@ def initialize_session_state():
         if key not in st.session_state:
             st.session_state[key] = value
 
-def format_time(seconds):
-    """Форматирование времени в читаемый вид (минуты:секунды)"""
-    seconds_rounded = round(seconds)
-    minutes = seconds_rounded // 60
-    seconds_display = seconds_rounded % 60
-    return f"{minutes:02d}:{seconds_display:02d}"
+def get_selected_questions():
+    """
+    Вопросы текущего теста из общего для процесса банка скомпилированных вопросов
+    В сессии хранятся только id - сами вопросы не копируются в каждую сессию
+    """
+    theme = st.session_state.selected_theme
+    attempt = st.session_state.attempt
+    if not theme or not attempt:
+        return []
+    return get_questions_by_ids(theme['id'], list(attempt.question_ids))
 
-def calculate_partial_score(question, user_answer):
-    """Расчет частичных баллов для разных типов вопросов"""
-    
-    if question["type"] == "single_choice":
-        return 1.0 if user_answer == question["correct"] else 0.0
-    
-    elif question["type"] == "multiple_choice":
-        user_set = set(user_answer or [])
-        correct_set = set(question["correct"])
-        
-        if not user_set:
-            return 0.0
-            
-        correct_answers = len(user_set & correct_set)
-        wrong_answers = len(user_set - correct_set)
-        total_possible = len(correct_set)
-        
-        score = max(0, (correct_answers - wrong_answers)) / total_possible
-        return round(score, 2)
-    
-    elif question["type"] == "matching":
-        if not user_answer:
-            return 0.0
-            
-        correct_count = 0
-        total_pairs = len(question['correct_mapping'])
-        
-        for left_item, correct_right in question['correct_mapping'].items():
-            if user_answer.get(left_item) == correct_right:
-                correct_count += 1
-        
-        return round(correct_count / total_pairs, 2)
-    
-    elif question["type"] == "dropdown":
-        return 1.0 if user_answer == question["correct"] else 0.0
-    
-    elif question["type"] == "double_dropdown":
-        if not user_answer:
-            return 0.0
-            
-        correct_count = 0
-        total_subquestions = len(question["subquestions"])
-        
-        for subq in question["subquestions"]:
-            if user_answer.get(subq["key"]) == subq["correct"]:
-                correct_count += 1
-        
-        return round(correct_count / total_subquestions, 2)
-    
-    elif question["type"] == "ordering":
-        if not user_answer:
-            return 0.0
-            
-        data = user_answer
-        user_sequence = []
-        for idx, item in enumerate(data["items"]):
-            user_sequence.append((data["user_order"][idx], item))
-        
-        user_sequence.sort()
-        user_order = [item for _, item in user_sequence]
-        correct_order = question["correct_order"]
-        
-        if len(user_order) != len(correct_order):
-            return 0.0
-            
-        correct_positions = 0
-        for i in range(len(user_order)):
-            if user_order[i] == correct_order[i]:
-                correct_positions += 1
-        
-        return round(correct_positions / len(correct_order), 2)
-    
-    return 0.0
+def get_user_answer(question, q_index):
+    """Ответ на вопрос в исходном виде - расшифровка из записи попытки"""
+    attempt = st.session_state.attempt
+    layout = attempt.get_layout(q_index, len(question['items'])) if question['type'] == "ordering" else None
+    return decode_answer(question, attempt.answers[q_index], layout)
 
-def check_answer(question, answer_key):
+def restore_widget_state(key, value):
+    """
+    Значение виджета ответа из записи попытки: Streamlit забывает состояние виджетов,
+    которые не отрисовывались (пока был открыт другой вопрос), и без этого ответ сбросился бы
+    """
+    if key not in st.session_state and value is not None:
+        st.session_state[key] = value
+
+@timed()
+def check_answer(question, q_index):
     """Проверка ответа с системой частичных баллов"""
-    user_answer = st.session_state.user_answers.get(answer_key)
+    user_answer = get_user_answer(question, q_index)
     if user_answer is None:
         st.warning("⚠️ Сначала выберите ответ!")
         return False
     
     score = calculate_partial_score(question, user_answer)
     
-    # Сохраняем балл за вопрос
-    st.session_state.question_scores[answer_key] = score
-    
-    # Обновляем общий счет
-    st.session_state.score += score
+    # Сохраняем балл за вопрос и отмечаем что ответ проверен (общий счет - сумма баллов)
+    st.session_state.attempt.mark_checked(q_index, score)
     
-    # Отмечаем что ответ проверен
-    st.session_state.answers_checked[answer_key] = True
+    # История баллов для адаптивного отбора (веса вопросов обновляются сразу)
+    record_score(st.session_state.selected_theme['id'], question.id, score, user_key(st.session_state.user_info))
     
     # Визуальная обратная связь
     if score == 1.0:
@@ -162,18 +116,6 @@ def check_answer(question, answer_key):
     
     return True
 
-def get_answer_key(question):
-    """Получение ключа ответа"""
-    type_map = {
-        "single_choice": "single",
-        "multiple_choice": "multiple", 
-        "dropdown": "dropdown",
-        "double_dropdown": "double",
-        "ordering": "ordering",
-        "matching": "matching"
-    }
-    return f"q_{question['id']}_{type_map[question['type']]}"
-
 def render_login_form():
     """Форма ввода данных пользователя"""
     st.header("👤 Введите ваши данные")
@@ -222,65 +164,131 @@ def render_question_selection():
         format_func=lambda x: theme_options[x]
     )
     
-    st.session_state.selected_theme = themes[selected_theme_id]
+    theme_info = themes[selected_theme_id]
     
     # Выбор категории
-    categories = ["Все категории"] + get_categories_for_theme(themes, selected_theme_id)
+    categories = ["Все категории"] + sorted(theme_info['categories']) + [QUOTAS_OPTION]
     selected_category = st.selectbox(
         "Выберите категорию вопросов:",
         categories
     )
     
-    # Получаем вопросы для выбранной категории
-    theme_questions = st.session_state.selected_theme["questions"]
-    if selected_category != "Все категории":
-        theme_questions = [q for q in theme_questions if q.get('category') == selected_category]
+    # Квоты: сколько вопросов из каждой категории (как в билетах аттестации)
+    quotas = None
+    if selected_category == QUOTAS_OPTION:
+        st.write("**Количество вопросов по категориям:**")
+        quotas = {}
+        for category_name in sorted(theme_info['categories']):
+            category_size = theme_info['categories'][category_name]
+            quotas[category_name] = st.number_input(
+                f"{category_name} (доступно {category_size})",
+                min_value=0,
+                max_value=category_size,
+                value=0,
+                step=1,
+                key=f"quota_{selected_theme_id}_{category_name}"
+            )
+        quotas = {category_name: count for category_name, count in quotas.items() if count}
+    
+    # Количество вопросов в выбранной категории (без перебора самих вопросов)
+    if quotas is not None:
+        available_questions = sum(quotas.values())
+    elif selected_category == "Все категории":
+        available_questions = theme_info['question_count']
+    else:
+        available_questions = theme_info['categories'].get(selected_category, 0)
     
     # Настройка количества вопросов
-    if len(theme_questions) == 0:
+    if quotas is not None:
+        if available_questions == 0:
+            st.warning("⚠️ Укажите количество вопросов хотя бы для одной категории")
+        else:
+            st.write(f"**Всего вопросов в тесте: {available_questions}**")
+        num_questions = available_questions
+    elif available_questions == 0:
         st.warning("⚠️ В выбранной категории нет вопросов")
         num_questions = 0
-    elif len(theme_questions) == 1:
+    elif available_questions == 1:
         st.write(f"**Будет задан 1 вопрос**")
         num_questions = 1
     else:
         num_questions = st.slider(
             "Количество вопросов в тесте:",
             min_value=1,
-            max_value=len(theme_questions),
-            value=min(10, len(theme_questions))
+            max_value=available_questions,
+            value=min(10, available_questions)
         )
     
+    # Режим отбора: случайный или адаптивный (чаще сложные вопросы и вопросы, где тестируемый ошибался)
+    selection_modes = {'random': "🎲 Случайный", 'adaptive': "🎯 Адаптивный"}
+    selection_mode = st.radio(
+        "Отбор вопросов:",
+        options=list(selection_modes.keys()),
+        format_func=lambda x: selection_modes[x],
+        horizontal=True
+    )
+    
+    # Готовый пул вариантов (generate_variants.py) для тех же настроек - старт без выборки
+    pool_info = get_pool_info(selected_theme_id)
+    category = None if selected_category in ("Все категории", QUOTAS_OPTION) else selected_category
+    if (selection_mode == 'random' and quotas is None and pool_info and pool_info['category'] == category
+            and pool_info['num_questions'] == num_questions):
+        st.info(f"📦 Вариант будет выдан из готового пула ({pool_info['variants']} вариантов, {pool_info['generated_at']})")
+    
     st.session_state.test_config = {
         'category': selected_category,
-        'num_questions': num_questions
+        'num_questions': num_questions,
+        'mode': selection_mode,
+        'quotas': quotas
     }
     
     # Кнопка начала теста
-    if len(theme_questions) > 0:
+    if available_questions > 0:
         if st.button("🚀 Начать тест", type="primary", use_container_width=True):
-            # Выбираем случайные вопросы
-            if len(theme_questions) == 1:
-                selected_questions = theme_questions
-            else:
-                selected_questions = random.sample(theme_questions, num_questions)
+            # В сессии храним только метаданные темы - вопросы читаются по id
+            st.session_state.selected_theme = {
+                'id': selected_theme_id,
+                'name': theme_info['name'],
+                'description': theme_info['description']
+            }
             
-            # Перемешиваем порядок вопросов
-            random.shuffle(selected_questions)
+            # Выбираем вопросы: готовый вариант из пула, случайно или с весами по сложности
+            # и промахам тестируемого. Случайный выбор и порядок вариантов задает план попытки с seed (см. exam_plan)
+            variant = None
+            if selection_mode == 'random' and quotas is None:
+                variant = next_variant(selected_theme_id, num_questions, category)
+            if variant is not None:
+                seed, question_ids = variant
+                plan = build_exam_plan(selected_theme_id, seed=seed, question_ids=question_ids)
+            else:
+                # Адаптивный отбор идет тем же генератором, что и план: попытка воспроизводится по seed
+                seed = new_seed()
+                rng = random.Random(seed)
+                if selection_mode == 'adaptive' and quotas:
+                    question_ids = [
+                        question_id
+                        for category_name, count in quotas.items()
+                        for question_id in sample_question_ids(selected_theme_id, count, category_name,
+                                                               user_key(st.session_state.user_info), rng)
+                    ]
+                elif selection_mode == 'adaptive':
+                    question_ids = sample_question_ids(selected_theme_id, num_questions, category,
+                                                       user_key(st.session_state.user_info), rng)
+                else:
+                    question_ids = None
+                plan = build_exam_plan(selected_theme_id, num_questions, category, seed=seed,
+                                       question_ids=question_ids, shuffle_questions=True, quotas=quotas)
             
-            st.session_state.selected_questions = selected_questions
+            # Ответы, баллы и время попытки - в одной компактной записи (см. exam_attempt)
+            st.session_state.attempt = ExamAttempt.from_plan(plan)
             st.session_state.test_started = True
             st.session_state.current_question = 0
-            st.session_state.score = 0
-            st.session_state.user_answers = {}
-            st.session_state.answers_checked = {}
-            st.session_state.question_times = [0] * len(selected_questions)
-            st.session_state.question_scores = {}
             st.session_state.question_start_time = time.time()
             
             # СОХРАНЯЕМ ТЕКУЩИЙ ТЕСТ ДЛЯ ВОЗМОЖНОГО ПОВТОРЕНИЯ
             # Это перезаписывает предыдущий сохраненный тест
-            st.session_state.last_test_questions = selected_questions.copy()
+            # Храним только id вопросов и seed - при повторе план строится заново с тем же порядком вариантов
+            st.session_state.last_test_plan = {'question_ids': list(plan.question_ids), 'seed': plan.seed}
             st.session_state.last_test_theme = st.session_state.selected_theme
             
             st.rerun()
@@ -297,225 +305,210 @@ def update_question_time():
         
         # Обновляем время в массиве
         q_index = st.session_state.current_question
-        if q_index < len(st.session_state.question_times):
-            st.session_state.question_times[q_index] = elapsed
+        attempt = st.session_state.attempt
+        if attempt is not None and q_index < len(attempt):
+            attempt.times[q_index] = elapsed
 
+@timed()
 def render_single_choice_question(question, q_index):
     """Вопрос с одним правильным ответом"""
     st.subheader(f"❓ Вопрос {q_index + 1}")
     st.write(f"**{question['question']}**")
     
-    answer_key = f"q_{question['id']}_single"
+    attempt = st.session_state.attempt
     
-    # Инициализация ответа
-    if answer_key not in st.session_state.user_answers:
-        st.session_state.user_answers[answer_key] = None
-    
-    options = question["options"]
+    # Варианты передаем индексами - ответ сразу хранится небольшим целым числом;
+    # порядок показа - перестановка из плана попытки, одна и та же на каждом rerun
+    options = question.options
+    layout = attempt.get_layout(q_index, len(options))
     
     # Если ответ уже проверен - показываем результат
-    if st.session_state.answers_checked.get(answer_key, False):
-        selected = st.radio(
+    if attempt.is_checked(q_index):
+        st.radio(
             "Выберите один правильный ответ:",
-            options,
-            index=options.index(st.session_state.user_answers[answer_key]) if st.session_state.user_answers[answer_key] in options else 0,
+            layout,
+            format_func=options.__getitem__,
+            index=layout.index(attempt.answers[q_index]) if attempt.answers[q_index] is not None else 0,
             key=f"locked_{question['id']}",
             disabled=True
         )
         # Показываем результат проверки
-        score = st.session_state.question_scores.get(answer_key, 0)
+        score = attempt.scores[q_index]
         if score == 1.0:
             st.success("✅ Правильно!")
         else:
             st.error(f"❌ Неправильно! Правильный ответ: {question['correct']}")
         st.info(f"**Объяснение:** {question['explanation']}")
     else:
-        selected = st.radio(
+        restore_widget_state(f"single_{question['id']}", attempt.answers[q_index])
+        attempt.answers[q_index] = st.radio(
             "Выберите один правильный ответ:",
-            options,
+            layout,
+            format_func=options.__getitem__,
             key=f"single_{question['id']}"
         )
-        st.session_state.user_answers[answer_key] = selected
     
-    render_navigation_buttons(question, q_index, answer_key)
+    render_navigation_buttons(question, q_index)
 
+@timed()
 def render_multiple_choice_question(question, q_index):
     """Вопрос с несколькими правильными ответами"""
     st.subheader(f"❓ Вопрос {q_index + 1}")
     st.write(f"**{question['question']}**")
     st.write("*Выберите все правильные ответы:*")
     
-    answer_key = f"q_{question['id']}_multiple"
-    
-    # Инициализация ответа
-    if answer_key not in st.session_state.user_answers:
-        st.session_state.user_answers[answer_key] = []
-    
-    options = question["options"]
+    attempt = st.session_state.attempt
+    options = question.options
+    layout = attempt.get_layout(q_index, len(options))
     
     # Если ответ уже проверен - показываем результат
-    if st.session_state.answers_checked.get(answer_key, False):
-        selected_options = st.session_state.user_answers[answer_key]
+    if attempt.is_checked(q_index):
+        selected_mask = attempt.answers[q_index] or 0
         
-        for i, option in enumerate(options):
-            is_checked = option in selected_options
-            st.checkbox(option, value=is_checked, disabled=True, key=f"locked_multi_{question['id']}_{i}")
+        for i in layout:
+            is_checked = bool(selected_mask >> i & 1)
+            st.checkbox(options[i], value=is_checked, disabled=True, key=f"locked_multi_{question['id']}_{i}")
         
         # Показываем результат проверки
-        score = st.session_state.question_scores.get(answer_key, 0)
+        score = attempt.scores[q_index]
         if score == 1.0:
             st.success("✅ Все ответы правильные!")
         else:
             st.error("❌ Не все ответы правильные!")
         st.info(f"**Объяснение:** {question['explanation']}")
     else:
-        selected_options = []
-        for i, option in enumerate(options):
-            if st.checkbox(option, key=f"multi_{question['id']}_{i}"):
-                selected_options.append(option)
+        # Выбранные варианты - битовая маска по индексам в question.options (не по порядку показа)
+        selected_mask = 0
+        for i in layout:
+            if attempt.answers[q_index] is not None:
+                restore_widget_state(f"multi_{question['id']}_{i}", bool(attempt.answers[q_index] >> i & 1))
+            if st.checkbox(options[i], key=f"multi_{question['id']}_{i}"):
+                selected_mask |= 1 << i
         
-        st.session_state.user_answers[answer_key] = selected_options
+        attempt.answers[q_index] = selected_mask
     
-    render_navigation_buttons(question, q_index, answer_key)
+    render_navigation_buttons(question, q_index)
 
+@timed()
 def render_dropdown_question(question, q_index):
     """Вопрос с выпадающим списком"""
     st.subheader(f"❓ Вопрос {q_index + 1}")
     st.write(f"**{question['question']}**")
     
-    answer_key = f"q_{question['id']}_dropdown"
+    attempt = st.session_state.attempt
     
-    if answer_key not in st.session_state.user_answers:
-        st.session_state.user_answers[answer_key] = None
+    options = (NOT_SELECTED,) + attempt.get_layout(q_index, len(question.options))
     
-    options = ["Выберите ответ..."] + question["options"]
+    def format_option(index):
+        return "Выберите ответ..." if index == NOT_SELECTED else question.options[index]
     
     # Если ответ уже проверен - показываем результат
-    if st.session_state.answers_checked.get(answer_key, False):
-        selected = st.selectbox(
+    if attempt.is_checked(q_index):
+        user_answer = attempt.answers[q_index]
+        st.selectbox(
             "Выберите правильный ответ:",
             options,
-            index=options.index(st.session_state.user_answers[answer_key]) if st.session_state.user_answers[answer_key] in options else 0,
+            format_func=format_option,
+            index=options.index(user_answer) if user_answer is not None else 0,
             key=f"locked_drop_{question['id']}",
             disabled=True
         )
         # Показываем результат проверки
-        score = st.session_state.question_scores.get(answer_key, 0)
+        score = attempt.scores[q_index]
         if score == 1.0:
             st.success("✅ Правильно!")
         else:
             st.error(f"❌ Неправильно! Правильный ответ: {question['correct']}")
         st.info(f"**Объяснение:** {question['explanation']}")
     else:
+        restore_widget_state(f"drop_{question['id']}", attempt.answers[q_index])
         selected = st.selectbox(
             "Выберите правильный ответ:",
             options,
+            format_func=format_option,
             key=f"drop_{question['id']}"
         )
         
-        if selected != "Выберите ответ...":
-            st.session_state.user_answers[answer_key] = selected
+        if selected != NOT_SELECTED:
+            attempt.answers[q_index] = selected
     
-    render_navigation_buttons(question, q_index, answer_key)
+    render_navigation_buttons(question, q_index)
+@timed()
 def render_matching_question(question, q_index):
     """Версия matching вопроса с единообразным отображением результатов"""
-    answer_key = f"q_{question['id']}_matching"
-    
-    # Инициализация
-    if answer_key not in st.session_state.user_answers:
-        st.session_state.user_answers[answer_key] = {}
+    attempt = st.session_state.attempt
+    left_column = question['left_column']
+    right_column = question['right_column']
     
-    # Перемешиваем правый столбец
-    right_options = question['right_column'].copy()
-    random.shuffle(right_options)
+    # Правый столбец перемешивается один раз за попытку - варианты не прыгают между rerun
+    layout = attempt.get_layout(q_index, len(right_column))
+    options = (NOT_SELECTED,) + layout
     
     st.subheader(f"🔗 Вопрос {q_index + 1}")
     st.write(f"**{question['question']}**")
     
-    answer_key = f"q_{question['id']}_matching"
+    # Ответ - индекс в right_column для каждого элемента левого столбца
+    answer = list(attempt.answers[q_index] or [NOT_SELECTED] * len(left_column))
     
-    # Инициализация ответов пользователя
-    if answer_key not in st.session_state.user_answers:
-        st.session_state.user_answers[answer_key] = {}
-    
-    # Перемешиваем правый столбец для вариантов ответа
-    right_options = question['right_column'].copy()
-    random.shuffle(right_options)
+    def format_option(index):
+        return "Выберите..." if index == NOT_SELECTED else right_column[index]
     
     st.write("---")
     
     # Отображение пар для сопоставления
     all_answered = True
-    any_changes = False
-    is_checked = st.session_state.answers_checked.get(answer_key, False)
+    is_checked = attempt.is_checked(q_index)
     
-    for i, left_item in enumerate(question['left_column']):
+    for i, left_item in enumerate(left_column):
         col1, col2 = st.columns([2, 3])
         
         with col1:
             st.write(f"**{left_item}**")
         
         with col2:
-            current_value = st.session_state.user_answers[answer_key].get(left_item, "Выберите...")
-            
-            # Уникальный ключ для selectbox
-            select_key = f"match_{question['id']}_{i}_{q_index}"
-            if select_key not in st.session_state:
-                st.session_state[select_key] = current_value
-            
             # Если ответ уже проверен - показываем заблокированное поле
             if is_checked:
                 st.selectbox(
                     f"Соответствие для {left_item}:",
-                    options=["Выберите..."] + right_options,
-                    index=right_options.index(current_value) + 1 if current_value in right_options else 0,
-                    key=f"locked_{select_key}",
+                    options=options,
+                    format_func=format_option,
+                    index=options.index(answer[i]),
+                    key=f"locked_matching_{question['id']}_{i}",
                     disabled=True,
                     label_visibility="collapsed"
                 )
                 
                 # Показываем результат проверки как в single_choice
-                user_answer = st.session_state.user_answers[answer_key].get(left_item, "Выберите...")
-                correct_answer = question['correct_mapping'][left_item]
+                correct_answer = question.correct_mapping[left_item]
                 
-                if user_answer == correct_answer:
+                if format_option(answer[i]) == correct_answer:
                     st.success("✅ Правильно!")
                 else:
                     st.error(f"❌ Неправильно! Правильный ответ: {correct_answer}")
-                    
+            
             else:
-                # Активное поле для выбора
-                selected = st.selectbox(
+                # Активное поле для выбора: значение виджета - сразу индекс варианта
+                restore_widget_state(f"matching_{question['id']}_{i}", answer[i])
+                answer[i] = st.selectbox(
                     f"Выберите соответствие для {left_item}:",
-                    options=["Выберите..."] + right_options,
-                    index=right_options.index(st.session_state[select_key]) + 1 if st.session_state[select_key] in right_options else 0,
-                    key=select_key,
+                    options=options,
+                    format_func=format_option,
+                    key=f"matching_{question['id']}_{i}",
                     label_visibility="collapsed"
                 )
-                
-                # Обновляем session_state для selectbox
-                if selected != st.session_state[select_key]:
-                    st.session_state[select_key] = selected
-                    any_changes = True
-                
-                # Обновляем ответы пользователя
-                if selected != current_value:
-                    st.session_state.user_answers[answer_key][left_item] = selected
-                    any_changes = True
             
             # Проверяем, выбран ли ответ
-            if st.session_state.user_answers[answer_key].get(left_item, "Выберите...") == "Выберите...":
+            if answer[i] == NOT_SELECTED:
                 all_answered = False
         
         st.write("---")
     
-    # Принудительный rerun при изменениях
-    if any_changes:
-        st.rerun()
+    if not is_checked:
+        attempt.answers[q_index] = tuple(answer)
     
     # Если ответ проверен - показываем объяснение (как в single_choice)
     if is_checked:
-        score = st.session_state.question_scores.get(answer_key, 0)
+        score = attempt.scores[q_index]
         
         # Визуальная обратная связь как в single_choice
         if score == 1.0:
@@ -531,126 +524,161 @@ def render_matching_question(question, q_index):
         
         st.info(f"**Объяснение:** {question['explanation']}")
     
-    render_navigation_buttons(question, q_index, answer_key, all_answered)
+    render_navigation_buttons(question, q_index, all_answered)
 
+@timed()
 def render_double_dropdown_question(question, q_index):
     """Вопрос с несколькими выпадающими списками"""
     st.subheader(f"❓ Вопрос {q_index + 1}")
     st.write(f"**{question['question']}**")
     
-    answer_key = f"q_{question['id']}_double"
+    attempt = st.session_state.attempt
+    subquestions = question["subquestions"]
     
-    if answer_key not in st.session_state.user_answers:
-        st.session_state.user_answers[answer_key] = {}
-        for subq in question["subquestions"]:
-            st.session_state.user_answers[answer_key][subq["key"]] = None
+    # Ответ - индекс выбранного варианта для каждого подвопроса
+    answer = list(attempt.answers[q_index] or [NOT_SELECTED] * len(subquestions))
     
     st.write("---")
     
     all_answered = True
-    is_checked = st.session_state.answers_checked.get(answer_key, False)
+    is_checked = attempt.is_checked(q_index)
     
-    for subq in question["subquestions"]:
+    for j, subq in enumerate(subquestions):
         st.write(f"**{subq['text']}**")
         
-        options = ["Выберите ответ..."] + subq["options"]
+        options = [NOT_SELECTED] + list(range(len(subq["options"])))
+        
+        def format_option(index, subq_options=subq["options"]):
+            return "Выберите ответ..." if index == NOT_SELECTED else subq_options[index]
         
         if is_checked:
             # Показываем заблокированные с результатом
-            selected = st.selectbox(
+            st.selectbox(
                 "",
                 options,
-                index=options.index(st.session_state.user_answers[answer_key][subq["key"]]) if st.session_state.user_answers[answer_key][subq["key"]] in options else 0,
+                format_func=format_option,
+                index=answer[j] + 1,
                 key=f"locked_double_{question['id']}_{subq['key']}",
                 disabled=True,
                 label_visibility="collapsed"
             )
             # Показываем правильность для каждого подвопроса
-            user_ans = st.session_state.user_answers[answer_key][subq["key"]]
+            user_ans = subq["options"][answer[j]] if answer[j] != NOT_SELECTED else None
             if user_ans == subq["correct"]:
                 st.success(f"✅ Правильно: {user_ans}")
             else:
                 st.error(f"❌ Неправильно! Ваш ответ: {user_ans}, Правильный: {subq['correct']}")
         else:
             # Активные выпадающие списки
-            selected = st.selectbox(
+            restore_widget_state(f"double_{question['id']}_{subq['key']}", answer[j])
+            answer[j] = st.selectbox(
                 "",
                 options,
+                format_func=format_option,
                 key=f"double_{question['id']}_{subq['key']}",
                 label_visibility="collapsed"
             )
             
-            if selected != "Выберите ответ...":
-                st.session_state.user_answers[answer_key][subq["key"]] = selected
-            else:
+            if answer[j] == NOT_SELECTED:
                 all_answered = False
         
         st.write("")
     
+    if not is_checked:
+        attempt.answers[q_index] = tuple(answer)
+    
     st.write("---")
     
     if is_checked:
         st.info(f"**Объяснение:** {question['explanation']}")
     
-    render_navigation_buttons(question, q_index, answer_key, all_answered if not is_checked else True)
+    render_navigation_buttons(question, q_index, all_answered if not is_checked else True)
 
+@timed()
 def render_ordering_question(question, q_index):
     """Вопрос на упорядочивание"""
     st.subheader(f"❓ Вопрос {q_index + 1}")
     st.write(f"**{question['question']}**")
     st.write("*Пронумеруйте этапы от 1 (первый) до 4 (последний)*")
     
-    answer_key = f"q_{question['id']}_ordering"
+    attempt = st.session_state.attempt
+    items = question["items"]
     
-    if answer_key not in st.session_state.user_answers:
-        shuffled_items = question["items"].copy()
-        random.shuffle(shuffled_items)
-        st.session_state.user_answers[answer_key] = {
-            "items": shuffled_items,
-            "user_order": [i+1 for i in range(len(shuffled_items))]
-        }
+    # Элементы показываются в перемешанном один раз за попытку порядке
+    layout = attempt.get_layout(q_index, len(items))
+    if attempt.answers[q_index] is None:
+        attempt.answers[q_index] = tuple(i + 1 for i in range(len(items)))
     
-    data = st.session_state.user_answers[answer_key]
-    is_checked = st.session_state.answers_checked.get(answer_key, False)
+    user_order = list(attempt.answers[q_index])
+    is_checked = attempt.is_checked(q_index)
     
     st.write("---")
-    for i, item in enumerate(data["items"]):
+    for i, item_index in enumerate(layout):
         col1, col2 = st.columns([3, 1])
         with col1:
-            st.write(f"**{item}**")
+            st.write(f"**{items[item_index]}**")
         with col2:
             if is_checked:
                 st.number_input(
                     f"Порядок",
-                    value=data["user_order"][i],
+                    value=user_order[i],
                     key=f"locked_order_{question['id']}_{i}",
                     disabled=True
                 )
             else:
-                order = st.number_input(
+                user_order[i] = st.number_input(
                     f"Порядок",
                     min_value=1,
-                    max_value=len(data["items"]),
-                    value=data["user_order"][i],
+                    max_value=len(items),
+                    value=user_order[i],
                     key=f"order_{question['id']}_{i}"
                 )
-                data["user_order"][i] = order
+    
+    attempt.answers[q_index] = tuple(user_order)
     
     st.write("---")
     
     if is_checked:
         # Показываем результат проверки
-        score = st.session_state.question_scores.get(answer_key, 0)
+        score = attempt.scores[q_index]
         if score == 1.0:
             st.success("✅ Порядок правильный!")
         else:
             st.error("❌ Порядок неправильный!")
         st.info(f"**Объяснение:** {question['explanation']}")
     
-    render_navigation_buttons(question, q_index, answer_key)
+    render_navigation_buttons(question, q_index)
 
-def render_navigation_buttons(question, q_index, answer_key, all_answered=True):
+@st.fragment
+def render_question_fragment(question, q_index):
+    """
+    Вопрос и кнопки навигации - фрагмент: выбор ответа перезапускает только его,
+    без заголовка, прогресса и учета времени в main()
+    Переход к другому вопросу перезапускает страницу целиком (st.rerun())
+    """
+    with script_run("fragment", st.session_state):
+        _render_question(question, q_index)
+
+def _render_question(question, q_index):
+    """Отрисовка вопроса функцией для его типа"""
+    render_functions = {
+        "single_choice": render_single_choice_question,
+        "multiple_choice": render_multiple_choice_question,
+        "dropdown": render_dropdown_question,
+        "double_dropdown": render_double_dropdown_question,
+        "ordering": render_ordering_question,
+        "matching": render_matching_question
+    }
+    
+    render_func = render_functions.get(question["type"])
+    if render_func:
+        render_func(question, q_index)
+    else:
+        st.error(f"Неизвестный тип вопроса: {question['type']}")
+
+def render_navigation_buttons(question, q_index, all_answered=True):
     """Кнопки навигации с проверкой ответов"""
+    attempt = st.session_state.attempt
     col1, col2, col3 = st.columns([1, 1, 1])
     
     with col1:
@@ -663,26 +691,27 @@ def render_navigation_buttons(question, q_index, answer_key, all_answered=True):
                 st.rerun()
     
     with col2:
-        is_checked = st.session_state.answers_checked.get(answer_key, False)
+        is_checked = attempt.is_checked(q_index)
         
         if not is_checked:
             check_enabled = all_answered
             if question["type"] in ["single_choice", "multiple_choice", "dropdown"]:
-                check_enabled = st.session_state.user_answers.get(answer_key) is not None
+                check_enabled = attempt.answers[q_index] is not None
                 if question["type"] == "multiple_choice":
-                    check_enabled = len(st.session_state.user_answers.get(answer_key, [])) > 0
+                    check_enabled = bool(attempt.answers[q_index])
             
             if check_enabled:
                 if st.button("✅ Проверить ответ", type="primary", key=f"check_{question['id']}"):
-                    if check_answer(question, answer_key):
-                        st.rerun()
+                    # Результат проверки показывается в самом вопросе - перезапускаем только фрагмент
+                    if check_answer(question, q_index):
+                        st.rerun(scope="fragment")
             else:
                 st.button("✅ Проверить ответ", disabled=True, key=f"check_disabled_{question['id']}")
         else:
             st.button("✅ Ответ проверен", disabled=True, key=f"checked_{question['id']}")
     
     with col3:
-        if q_index < len(st.session_state.selected_questions) - 1:
+        if q_index < len(attempt) - 1:
             if st.button("Далее →", key=f"next_{question['id']}"):
                 # Сохраняем время
                 update_question_time()
@@ -716,218 +745,75 @@ def create_user_folder(user_info):
         os.makedirs(user_folder, exist_ok=True)
         
         return user_folder
-        
+    
     except Exception as e:
         st.error(f"❌ Ошибка создания папки пользователя: {e}")
         return None
 
+@timed()
 def generate_main_protocol(protocol_data, user_folder):
     """Генерация основного протокола тестирования"""
     try:
-        user = protocol_data['user_info']
-        results = protocol_data['results']
-        
-        text = f"""
-ПРОТОКОЛ ТЕСТИРОВАНИЯ
-=====================
-
-Дата генерации: {protocol_data['protocol_info']['generated_at']}
-
-ДАННЫЕ ТЕСТИРУЕМОГО:
--------------------
-ФИО: {user['last_name']} {user['first_name']} {user['middle_name']}
-Должность: {user['position']}
-Дата тестирования: {user['login_time']}
-
-ИНФОРМАЦИЯ О ТЕСТЕ:
-------------------
-Тема: {protocol_data['test_info']['theme']}
-Категория: {protocol_data['test_info']['category']}
-Количество вопросов: {protocol_data['test_info']['total_questions']}
-
-РЕЗУЛЬТАТЫ ТЕСТИРОВАНИЯ:
------------------------
-Набрано баллов: {results['total_score']} из {results['max_score']}
-Процент выполнения: {results['percentage']}%
-Общее время: {results['total_time_formatted']}
-Среднее время на вопрос: {results['average_time_formatted']}
-
-ОЦЕНКА:
-------
-{"ОТЛИЧНО - Тест пройден успешно!" if results['percentage'] >= 80 else 
- "ХОРОШО - Тест пройден, рекомендуется повторение материала." if results['percentage'] >= 60 else 
- "НЕУДОВЛЕТВОРИТЕЛЬНО - Требуется дополнительное обучение."}
-
-=====================
-Детальная статистика по вопросам сохранена в отдельном файле.
-"""
-        
-        # Сохраняем основной протокол
-        filename = f"Протокол_тестирования_{user['last_name']}_{user['first_name']}.txt"
-        filepath = os.path.join(user_folder, filename)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(text)
-        
-        return filepath
-        
+        return write_main_protocol(protocol_data, user_folder)
+    
     except Exception as e:
         st.error(f"❌ Ошибка генерации основного протокола: {e}")
         return None
 
+@timed()
 def generate_detailed_statistics(protocol_data, user_folder):
     """Генерация детальной статистики по вопросам с полной информацией"""
     try:
-        user = protocol_data['user_info']
-        
-        text = f"""
-ДЕТАЛЬНАЯ СТАТИСТИКА ПО ВОПРОСАМ
-================================
-
-ФИО: {user['last_name']} {user['first_name']} {user['middle_name']}
-Тема тестирования: {protocol_data['test_info']['theme']}
-Дата тестирования: {user['login_time']}
-
-СТАТИСТИКА ПО ВОПРОСАМ:
-======================
-"""
-        
-        for i, detail in enumerate(protocol_data['detailed_results']):
-            question = st.session_state.selected_questions[i]
-            user_answer = st.session_state.user_answers.get(get_answer_key(question))
-            
-            text += f"""
-Вопрос {detail['question_number']}:
-╔═══════════════════════════════════════════════════════════════════
-║ Баллы: {detail['score']:.2f}/1.00
-║ Время: {detail['time_formatted']}
-╟───────────────────────────────────────────────────────────────────
-║ ВОПРОС: {question['question']}
-╟───────────────────────────────────────────────────────────────────
-"""
-            
-            # Обработка разных типов вопросов
-            if question['type'] == 'single_choice':
-                text += f"║ ВАРИАНТЫ: {', '.join(question['options'])}\n"
-                text += f"║ ВАШ ОТВЕТ: {user_answer}\n"
-                text += f"║ ПРАВИЛЬНЫЙ ОТВЕТ: {question['correct']}\n"
-                text += f"║ СТАТУС: {'✅ ВЕРНО' if user_answer == question['correct'] else '❌ НЕВЕРНО'}\n"
-                
-            elif question['type'] == 'multiple_choice':
-                text += f"║ ВАРИАНТЫ: {', '.join(question['options'])}\n"
-                text += f"║ ВАШИ ОТВЕТЫ: {', '.join(user_answer) if user_answer else 'Нет ответа'}\n"
-                text += f"║ ПРАВИЛЬНЫЕ ОТВЕТЫ: {', '.join(question['correct'])}\n"
-                user_set = set(user_answer or [])
-                correct_set = set(question['correct'])
-                if user_set == correct_set:
-                    text += "║ СТАТУС: ✅ ВСЕ ОТВЕТЫ ВЕРНЫ\n"
-                else:
-                    text += "║ СТАТУС: ⚠️ ЧАСТИЧНО ВЕРНО\n"
-                    
-            elif question['type'] == 'matching':
-                text += "║ СООТВЕТСТВИЯ:\n"
-                for left_item in question['left_column']:
-                    user_ans = user_answer.get(left_item, 'Не ответил')
-                    correct_ans = question['correct_mapping'][left_item]
-                    is_correct = user_ans == correct_ans
-                    status = '✅ ВЕРНО' if is_correct else '❌ НЕВЕРНО'
-                    text += f"║   • {left_item}: {user_ans} → {correct_ans} ({status})\n"
-                    
-            elif question['type'] == 'dropdown':
-                text += f"║ ВАРИАНТЫ: {', '.join(question['options'])}\n"
-                text += f"║ ВАШ ОТВЕТ: {user_answer}\n"
-                text += f"║ ПРАВИЛЬНЫЙ ОТВЕТ: {question['correct']}\n"
-                text += f"║ СТАТУС: {'✅ ВЕРНО' if user_answer == question['correct'] else '❌ НЕВЕРНО'}\n"
-                
-            elif question['type'] == 'double_dropdown':
-                text += "║ ПОДВОПРОСЫ:\n"
-                for subq in question['subquestions']:
-                    user_ans = user_answer.get(subq['key'], 'Не ответил')
-                    is_correct = user_ans == subq['correct']
-                    status = '✅ ВЕРНО' if is_correct else '❌ НЕВЕРНО'
-                    text += f"║   • {subq['text']}: {user_ans} → {subq['correct']} ({status})\n"
-                    
-            elif question['type'] == 'ordering':
-                # Восстанавливаем порядок пользователя
-                data = user_answer
-                user_sequence = []
-                for idx, item in enumerate(data["items"]):
-                    user_sequence.append((data["user_order"][idx], item))
-                user_sequence.sort()
-                user_order = [item for _, item in user_sequence]
-                
-                text += f"║ ЭЛЕМЕНТЫ: {', '.join(question['items'])}\n"
-                text += f"║ ВАШ ПОРЯДОК: {', '.join(user_order)}\n"
-                text += f"║ ПРАВИЛЬНЫЙ ПОРЯДОК: {', '.join(question['correct_order'])}\n"
-                text += f"║ СТАТУС: {'✅ ВЕРНО' if user_order == question['correct_order'] else '❌ НЕВЕРНО'}\n"
-            
-            text += "╚═══════════════════════════════════════════════════════════════════\n"
-        
-        text += "\n" + "="*70
-        text += "\nСтатистика сгенерирована автоматически системой тестирования ФАП"
-        
-        # Сохраняем детальную статистику
-        filename = f"Детальная_статистика_{user['last_name']}_{user['first_name']}.txt"
-        filepath = os.path.join(user_folder, filename)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(text)
-        
-        return filepath
-        
+        questions = get_selected_questions()
+        attempt = st.session_state.attempt
+        user_answers = [get_user_answer(question, i) for i, question in enumerate(questions)]
+        shown = [attempt.get_shown(i, question) for i, question in enumerate(questions)]
+        return write_detailed_statistics(protocol_data, questions, user_answers, user_folder, shown)
+    
     except Exception as e:
         st.error(f"❌ Ошибка генерации детальной статистики: {e}")
         return None
 
+@timed()
+def save_attempt(protocol_data, user_folder):
+    """Сохранение ответов попытки рядом с протоколами - для пересчета баллов (regrade_attempts.py)"""
+    try:
+        attempt = st.session_state.attempt
+        questions = get_selected_questions()
+        return save_attempt_record(
+            user_folder, protocol_data, attempt.question_ids,
+            [get_user_answer(question, i) for i, question in enumerate(questions)],
+            [attempt.is_checked(i) for i in range(len(attempt))],
+            attempt.scores, attempt.times,
+            [attempt.get_shown(i, question) for i, question in enumerate(questions)]
+        )
+    
+    except Exception as e:
+        st.error(f"❌ Ошибка сохранения попытки: {e}")
+        return None
+
+def format_test_category(test_config):
+    """Категория теста для протокола; для теста по квотам - категории с количеством вопросов"""
+    quotas = test_config.get('quotas')
+    if not quotas:
+        return test_config['category']
+    return "По квотам: " + ", ".join(f"{category} - {count}" for category, count in quotas.items())
+
+@timed()
 def generate_protocol_data():
     """Генерация данных для протокола"""
-    user_info = st.session_state.user_info
-    total_questions = len(st.session_state.selected_questions)
-    total_score = st.session_state.score
-    max_possible_score = total_questions
-    total_time = sum(st.session_state.question_times)
-    percentage = (total_score / max_possible_score) * 100
-    
-    protocol = {
-        "protocol_info": {
-            "title": "Протокол тестирования",
-            "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        },
-        "user_info": user_info,
-        "test_info": {
-            "theme": st.session_state.selected_theme['name'],
-            "total_questions": total_questions,
-            "category": st.session_state.test_config['category']
-        },
-        "results": {
-            "total_score": round(total_score, 2),
-            "max_score": max_possible_score,
-            "percentage": round(percentage, 1),
-            "total_time_seconds": round(total_time),
-            "total_time_formatted": format_time(total_time),
-            "average_time_seconds": round(total_time / total_questions) if total_questions > 0 else 0,
-            "average_time_formatted": format_time(total_time / total_questions) if total_questions > 0 else "00:00"
-        },
-        "detailed_results": []
-    }
-    
-    # Добавляем детальную информацию по каждому вопросу
-    for i, question in enumerate(st.session_state.selected_questions):
-        answer_key = get_answer_key(question)
-        question_time = st.session_state.question_times[i] if i < len(st.session_state.question_times) else 0
-        question_score = st.session_state.question_scores.get(answer_key, 0)
-        
-        protocol["detailed_results"].append({
-            "question_number": i + 1,
-            "question_text": question['question'],
-            "score": round(question_score, 2),
-            "time_seconds": round(question_time),
-            "time_formatted": format_time(question_time),
-            "category": question.get('category', 'Не указана')
-        })
-    
-    return protocol
+    attempt = st.session_state.attempt
+    return build_protocol_data(
+        st.session_state.user_info,
+        st.session_state.selected_theme,
+        format_test_category(st.session_state.test_config),
+        get_selected_questions(),
+        attempt.scores,
+        attempt.times,
+        plan={'seed': attempt.seed, 'theme_version': attempt.theme_version}
+    )
 
+@timed()
 def render_results():
     """Отображение результатов с раздельными протоколами"""
     st.balloons()
@@ -940,6 +826,7 @@ def render_results():
         if user_folder:
             main_protocol_file = generate_main_protocol(protocol_data, user_folder)
             detailed_stats_file = generate_detailed_statistics(protocol_data, user_folder)
+            save_attempt(protocol_data, user_folder)
             
             # Сохраняем информацию о созданных протоколах
             st.session_state.protocols_created = True
@@ -1029,8 +916,9 @@ def render_results():
     st.write("---")
     st.write("## 📝 Краткий обзор статистики:")
     
+    questions = get_selected_questions()
     for i, detail in enumerate(protocol_data['detailed_results'][:3]):  # Показываем первые 3 вопроса
-        question = st.session_state.selected_questions[i]
+        question = questions[i]
         with st.expander(f"Вопрос {detail['question_number']}: {detail['score']:.2f} балла - {detail['time_formatted']}", expanded=False):
             st.write(f"**Вопрос:** {question['question']}")
             st.write(f"**Время:** {detail['time_formatted']}")
@@ -1095,10 +983,10 @@ def main():
         st.write("### 📚 Доступные темы:")
         
         themes = load_themes()
-        for theme_id, theme_data in themes.items():
-            with st.expander(f"📖 {theme_data['name']} - {theme_data.get('description', '')}"):
-                st.write(f"**Всего вопросов:** {len(theme_data.get('questions', []))}")
-                categories = get_categories_for_theme(themes, theme_id)
+        for theme_id, theme_info in themes.items():
+            with st.expander(f"📖 {theme_info['name']} - {theme_info.get('description', '')}"):
+                st.write(f"**Всего вопросов:** {theme_info['question_count']}")
+                categories = sorted(theme_info['categories'])
                 if categories:
                     st.write("**Категории:**", ", ".join(categories))
     
@@ -1106,8 +994,14 @@ def main():
         # Обновляем время текущего вопроса
         update_question_time()
         
+        # Вопросы теста по id из общего банка
+        questions = get_selected_questions()
+        if len(questions) != len(st.session_state.attempt):
+            st.error("❌ Часть вопросов теста удалена из темы. Начните тест заново.")
+            st.session_state.test_started = False
+            return
+        
         # Отображение прогресса
-        questions = st.session_state.selected_questions
         progress = (st.session_state.current_question + 1) / len(questions)
         st.progress(progress)
         
@@ -1117,22 +1011,7 @@ def main():
         
         # Отображение текущего вопроса
         current_q = st.session_state.current_question
-        question = questions[current_q]
-        
-        render_functions = {
-            "single_choice": render_single_choice_question,
-            "multiple_choice": render_multiple_choice_question,
-            "dropdown": render_dropdown_question,
-            "double_dropdown": render_double_dropdown_question,
-            "ordering": render_ordering_question,
-            "matching": render_matching_question
-        }
-        
-        render_func = render_functions.get(question["type"])
-        if render_func:
-            render_func(question, current_q)
-        else:
-            st.error(f"Неизвестный тип вопроса: {question['type']}")
+        render_question_fragment(questions[current_q], current_q)
     
     elif st.session_state.show_results:
         # Отображение результатов
@@ -1144,20 +1023,18 @@ def main():
             # КНОПКА "ПРОЙТИ ТЕСТ ЕЩЕ РАЗ" - использует сохраненный последний тест
             if st.button("🔄 Пройти тест еще раз", type="primary", use_container_width=True, key="one_more_test_button"):
                 # Проверяем, есть ли сохраненный тест для повторения
-                if 'last_test_questions' in st.session_state and 'last_test_theme' in st.session_state:
-                    
+                if 'last_test_plan' in st.session_state and 'last_test_theme' in st.session_state:
                     # Сбрасываем только состояния теста
                     st.session_state.test_started = True
                     st.session_state.test_finished = False
                     st.session_state.current_question = 0
-                    st.session_state.score = 0
-                    st.session_state.user_answers = {}
                     st.session_state.show_results = False
-                    st.session_state.selected_questions = st.session_state.last_test_questions.copy()
+                    st.session_state.attempt = ExamAttempt.from_plan(build_exam_plan(
+                        st.session_state.last_test_theme['id'],
+                        seed=st.session_state.last_test_plan['seed'],
+                        question_ids=st.session_state.last_test_plan['question_ids']
+                    ))
                     st.session_state.selected_theme = st.session_state.last_test_theme
-                    st.session_state.answers_checked = {}
-                    st.session_state.question_times = [0] * len(st.session_state.last_test_questions)
-                    st.session_state.question_scores = {}
                     st.session_state.question_start_time = time.time()
                     
                     # Сбрасываем флаг создания протоколов для генерации новых
@@ -1171,7 +1048,7 @@ def main():
                     st.rerun()
                 else:
                     st.error("❌ Нет сохраненного теста для повторения")
-                
+        
         with col2:
             if st.button("🚪 Выйти из системы", use_container_width=True):
                 # Полный сброс
@@ -1181,4 +1058,7 @@ def main():
                 st.rerun()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Замеры прогона (FAP_METRICS=1, см. run_metrics): время отмеченных функций и размер состояния сессии
+    start_metrics_server()
+    with script_run("app", st.session_state):
+        main()
\ No newline at end of file
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Скрипт миграции - переносит темы из папки themes/ в базу SQLite
+После переноса запускайте приложение с FAP_THEME_STORAGE=sqlite
+"""
+
+import os
+import sys
+
+# Добавляем путь для импорта
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from theme_loader import migrate_json_to_sqlite
+
+if __name__ == "__main__":
+    print("🚀 Перенос тем в SQLite...")
+    migrate_json_to_sqlite()
+    print("📁 Запустите: FAP_THEME_STORAGE=sqlite streamlit run main.py")
@@ -8,7 +8,18 @@ from datetime import datetime
 
 # Добавляем путь для импорта
 sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
-from theme_loader import scan_themes, save_theme
+from theme_loader import (
+    scan_theme_manifest, load_theme, get_theme_index, add_question, delete_question, start_theme_watcher
+)
+from near_duplicates import find_near_duplicates
+from search_index import search_questions
+
+# Вопросов на странице списка существующих вопросов
+QUESTIONS_PER_PAGE = int(os.environ.get("FAP_EDITOR_PAGE_SIZE", "20"))
+
+# Значения фильтра списка вопросов "без фильтра" и "вопросы без категории"
+ALL_FILTER = "Все"
+NO_CATEGORY_FILTER = "Без категории"
 
 # Настройка страницы
 st.set_page_config(
@@ -47,13 +58,14 @@ def show_theme_selector():
     """Выбор темы для редактирования"""
     st.header("📚 Выбор темы")
     
-    themes = scan_themes()
+    start_theme_watcher()
+    themes = scan_theme_manifest()
     if not themes:
         st.error("❌ Темы не найдены! Сначала создайте тему.")
         return None
     
-    theme_options = {theme_id: f"{data['name']} ({len(data.get('questions', []))} вопросов)" 
-                    for theme_id, data in themes.items()}
+    theme_options = {theme_id: f"{info['name']} ({info['question_count']} вопросов)" 
+                    for theme_id, info in themes.items()}
     
     selected_theme = st.selectbox(
         "Выберите тему для редактирования:",
@@ -61,7 +73,7 @@ def show_theme_selector():
         format_func=lambda x: theme_options[x]
     )
     
-    return themes[selected_theme] if selected_theme else None
+    return load_theme(selected_theme) if selected_theme else None
 
 def manage_options():
     """Управление вариантами ответов с удобными текстовыми полями"""
@@ -501,6 +513,31 @@ def safe_clear_form():
     
     st.success("✅ Форма очищена! Можете вводить новый вопрос.")
 
+def next_question_id(theme):
+    """Следующий свободный id вопроса - после удалений len()+1 дал бы дубликат"""
+    return max((q.get('id', 0) for q in theme.get('questions', [])), default=0) + 1
+
+def confirm_near_duplicates(new_question):
+    """
+    Предупредить о похожих вопросах в банке
+    True - похожих нет или автор уже видел предупреждение для этого же вопроса
+    """
+    duplicates = find_near_duplicates(new_question)
+    if not duplicates:
+        return True
+    
+    fingerprint = json.dumps({k: v for k, v in new_question.items() if k != 'id'}, ensure_ascii=False, sort_keys=True)
+    if st.session_state.get('duplicate_confirmed') == fingerprint:
+        return True
+    
+    st.warning("⚠️ Похожие вопросы уже есть в банке:")
+    for duplicate in duplicates[:5]:
+        st.write(f"- **{duplicate['theme_name']}** #{duplicate['question_id']} "
+                 f"(сходство {duplicate['similarity']:.0%}): {duplicate['question']}")
+    st.info("Нажмите «💾 Сохранить вопрос» еще раз, чтобы все равно добавить вопрос")
+    st.session_state.duplicate_confirmed = fingerprint
+    return False
+
 def process_question_submission(theme, question_text, question_type, category, explanation):
     """Обработка сохранения вопроса"""
     # Валидация основных полей
@@ -524,7 +561,7 @@ def process_question_submission(theme, question_text, question_type, category, e
             correct_mapping[pair['left']] = pair['right']
         
         new_question = {
-            "id": len(theme.get('questions', [])) + 1,
+            "id": next_question_id(theme),
             "type": question_type,
             "question": question_text,
             "left_column": left_column,
@@ -547,7 +584,7 @@ def process_question_submission(theme, question_text, question_type, category, e
         
         # Создаем вопрос double_dropdown
         new_question = {
-            "id": len(theme.get('questions', [])) + 1,
+            "id": next_question_id(theme),
             "type": question_type,
             "question": question_text,
             "subquestions": st.session_state.subquestions.copy(),
@@ -562,7 +599,7 @@ def process_question_submission(theme, question_text, question_type, category, e
             return False
         
         new_question = {
-            "id": len(theme.get('questions', [])) + 1,
+            "id": next_question_id(theme),
             "type": question_type,
             "question": question_text,
             "items": valid_items,
@@ -593,7 +630,7 @@ def process_question_submission(theme, question_text, question_type, category, e
             correct_answer = correct_options
         
         new_question = {
-            "id": len(theme.get('questions', [])) + 1,
+            "id": next_question_id(theme),
             "type": question_type,
             "question": question_text,
             "options": [opt['text'] for opt in valid_options],
@@ -602,13 +639,14 @@ def process_question_submission(theme, question_text, question_type, category, e
             "category": category
         }
     
-    # Добавляем в тему
-    if 'questions' not in theme:
-        theme['questions'] = []
-    theme['questions'].append(new_question)
+    # Проверка на почти одинаковые вопросы во всех темах (MinHash/LSH, см. near_duplicates)
+    # Повторное нажатие "Сохранить" для того же вопроса сохраняет его несмотря на предупреждение
+    if not confirm_near_duplicates(new_question):
+        return False
     
-    # Сохраняем
-    if save_theme(theme['id'], theme):
+    # Добавляем в тему и сохраняем (в режиме журнала - одной записью, без перезаписи файла)
+    if add_question(theme['id'], new_question):
+        st.session_state.pop('duplicate_confirmed', None)
         st.success(f"✅ Вопрос добавлен в тему '{theme['name']}'!")
         safe_clear_form()
         return True
@@ -616,6 +654,23 @@ def process_question_submission(theme, question_text, question_type, category, e
         st.error("❌ Ошибка сохранения вопроса!")
         return False
 
+def show_question_search():
+    """Поиск вопросов во всех темах (триграммный индекс, см. search_index)"""
+    query = st.text_input("🔍 Поиск вопросов во всех темах:", key="question_search",
+                          placeholder="Слова из вопроса, вариантов, объяснения или категории")
+    if not query.strip():
+        return
+    
+    results = search_questions(query)
+    if not results:
+        st.info("Ничего не найдено")
+        return
+    
+    st.write(f"**Найдено:** {len(results)}")
+    for result in results:
+        st.write(f"- **{result['theme_name']}** #{result['question_id']} "
+                 f"({result['category'] or 'без категории'}, {result['type']}): {result['question']}")
+
 def show_existing_questions(theme):
     """Показ существующих вопросов"""
     if not theme.get('questions'):
@@ -624,7 +679,48 @@ def show_existing_questions(theme):
     
     st.header("📋 Существующие вопросы")
     
-    for i, question in enumerate(theme['questions']):
+    # Фильтры и постраничный вывод: за один прогон скрипта рисуется не больше
+    # QUESTIONS_PER_PAGE вопросов, сколько бы их ни было в теме. Варианты фильтров
+    # и позиции вопросов берутся из индекса темы (get_theme_index), без прохода по вопросам
+    index = get_theme_index(theme['id'])
+    uncategorized = index['total'] - sum(index['category_counts'].values())
+    
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        categories = sorted(index['category_counts']) + ([NO_CATEGORY_FILTER] if uncategorized else [])
+        category_filter = st.selectbox("Категория:", [ALL_FILTER] + categories,
+                                       key=f"list_category_{theme['id']}")
+    with col2:
+        types = sorted(index['type_counts'], key=str)
+        type_filter = st.selectbox("Тип вопроса:", [ALL_FILTER] + types,
+                                   key=f"list_type_{theme['id']}")
+    
+    if category_filter == ALL_FILTER:
+        positions = range(index['total'])
+    elif category_filter == NO_CATEGORY_FILTER:
+        categorized = {position for category_positions in index['by_category'].values() for position in category_positions}
+        positions = [position for position in range(index['total']) if position not in categorized]
+    else:
+        positions = index['by_category'].get(category_filter, [])
+    if type_filter != ALL_FILTER:
+        type_positions = set(index['by_type'].get(type_filter, []))
+        positions = [position for position in positions if position in type_positions]
+    if not positions:
+        st.info("📝 Нет вопросов с такими фильтрами")
+        return
+    
+    total_pages = (len(positions) + QUESTIONS_PER_PAGE - 1) // QUESTIONS_PER_PAGE
+    with col3:
+        # Ключ зависит от фильтров - при их смене список начинается с первой страницы
+        page = st.number_input("Страница:", min_value=1, max_value=total_pages, value=1, step=1,
+                               key=f"list_page_{theme['id']}_{category_filter}_{type_filter}")
+    
+    start = (page - 1) * QUESTIONS_PER_PAGE
+    page_questions = [theme['questions'][position] for position in positions[start:start + QUESTIONS_PER_PAGE]]
+    st.caption(f"Вопросы {start + 1}-{start + len(page_questions)} из {len(positions)} "
+               f"(страница {page} из {total_pages})")
+    
+    for question in page_questions:
         with st.expander(f"❓ {question['question'][:50]}...", expanded=False):
             col1, col2 = st.columns([3, 1])
             
@@ -658,9 +754,8 @@ def show_existing_questions(theme):
                 st.write(f"**Объяснение:** {question.get('explanation', 'Нет')}")
             
             with col2:
-                if st.button("🗑️ Удалить", key=f"delete_{i}", use_container_width=True):
-                    theme['questions'].pop(i)
-                    if save_theme(theme['id'], theme):
+                if st.button("🗑️ Удалить", key=f"delete_{question['id']}", use_container_width=True):
+                    if delete_question(theme['id'], question['id']):
                         st.success("✅ Вопрос удален!")
                         st.rerun()
                     break
@@ -686,6 +781,9 @@ def main():
     # Форма добавления вопроса
     show_question_form(theme)
     
+    # Поиск по всем темам
+    show_question_search()
+    
     # Существующие вопросы
     show_existing_questions(theme)
 
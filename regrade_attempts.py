@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Скрипт пересчета баллов - заново оценивает сохраненные попытки (protocols/*/attempt.json)
+по текущим правильным ответам тем и перезаписывает протоколы, где баллы изменились
+Ответы на один вопрос из всех попыток считаются одним пакетом (scoring.score_batch,
+с NumPy - векторно)
+"""
+
+import os
+import sys
+import glob
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+# Добавляем путь для импорта
+sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
+from theme_loader import load_theme
+from question_model import compile_question
+from scoring import score_batch, np
+from protocols import (
+    ATTEMPT_FILE, build_protocol_data, write_main_protocol, write_detailed_statistics,
+    save_attempt_record, load_attempt_record
+)
+
+def load_attempts(protocols_dir):
+    """Попытки по темам: {theme_id: [(папка, запись), ...]}"""
+    attempts = defaultdict(list)
+    for filepath in sorted(glob.glob(os.path.join(protocols_dir, "*", ATTEMPT_FILE))):
+        record = load_attempt_record(filepath)
+        if record is not None:
+            attempts[record['theme_id']].append((os.path.dirname(filepath), record))
+    return attempts
+
+def regrade_theme(theme_id, attempts):
+    """
+    Пересчитать попытки одной темы
+    Возвращает список (папка, запись, вопросы, новые баллы) для попыток с изменившимися баллами
+    """
+    theme_data = load_theme(theme_id)
+    if theme_data is None:
+        print(f"⚠️ Тема {theme_id} не найдена - пропущено попыток: {len(attempts)}")
+        return []
+    
+    questions_by_id = {q['id']: compile_question(q) for q in theme_data.get('questions', [])}
+    
+    # Ответы на каждый вопрос из всех попыток - для пакетного подсчета
+    batches = defaultdict(list)
+    usable = []
+    for folder, record in attempts:
+        missing = [qid for qid in record['question_ids'] if qid not in questions_by_id]
+        if missing:
+            print(f"⚠️ {os.path.basename(folder)}: вопросы {missing} удалены из темы - попытка пропущена")
+            continue
+        
+        attempt_index = len(usable)
+        usable.append((folder, record, list(record['scores'])))
+        for position, (question_id, answer) in enumerate(zip(record['question_ids'], record['answers'])):
+            # Непроверенные ответы в баллы не шли - остаются с нулем
+            if record['checked'][position]:
+                batches[question_id].append((attempt_index, position, answer))
+    
+    for question_id, entries in batches.items():
+        scores = score_batch(questions_by_id[question_id], [answer for _, _, answer in entries])
+        for (attempt_index, position, _), score in zip(entries, scores):
+            usable[attempt_index][2][position] = score
+    
+    changed = []
+    for folder, record, scores in usable:
+        if scores != record['scores']:
+            questions = [questions_by_id[qid] for qid in record['question_ids']]
+            changed.append((folder, record, questions, scores))
+    return changed
+
+def rewrite_protocols(folder, record, questions, scores):
+    """Перезаписать протоколы и attempt.json с новыми баллами"""
+    old_data = record['protocol_data']
+    test_info = old_data['test_info']
+    protocol_data = build_protocol_data(
+        old_data['user_info'],
+        {'id': test_info['theme_id'], 'name': test_info['theme']},
+        test_info['category'],
+        questions,
+        scores,
+        record['times'],
+        generated_at=old_data['protocol_info']['generated_at'],
+        plan=test_info.get('plan')
+    )
+    protocol_data['protocol_info']['regraded_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    write_main_protocol(protocol_data, folder)
+    # Порядок показа вариантов сохраняется из записи - он не зависит от пересчета
+    shown = record.get('shown')
+    write_detailed_statistics(protocol_data, questions, record['answers'], folder, shown)
+    save_attempt_record(
+        folder, protocol_data, record['question_ids'], record['answers'],
+        record['checked'], scores, record['times'], shown
+    )
+    return old_data['results']['total_score'], protocol_data['results']['total_score']
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет баллов сохраненных попыток")
+    parser.add_argument("--protocols-dir", default=os.path.join(os.path.dirname(__file__), "protocols"),
+                        help="папка с протоколами (по умолчанию protocols/)")
+    parser.add_argument("--dry-run", action="store_true", help="только показать изменения")
+    args = parser.parse_args()
+    
+    print(f"🚀 Пересчет баллов ({'NumPy' if np is not None else 'без NumPy'})...")
+    attempts = load_attempts(args.protocols_dir)
+    total = sum(len(items) for items in attempts.values())
+    print(f"📁 Найдено попыток: {total}, тем: {len(attempts)}")
+    
+    regraded = 0
+    for theme_id, theme_attempts in attempts.items():
+        for folder, record, questions, scores in regrade_theme(theme_id, theme_attempts):
+            name = os.path.basename(folder)
+            if args.dry_run:
+                print(f"👀 {name}: {record['protocol_data']['results']['total_score']} -> {round(sum(scores), 2)}")
+            else:
+                try:
+                    old_score, new_score = rewrite_protocols(folder, record, questions, scores)
+                    print(f"🔄 {name}: {old_score} -> {new_score}")
+                except Exception as e:
+                    print(f"❌ Ошибка перезаписи протоколов {name}: {e}")
+                    continue
+            regraded += 1
+    
+    print(f"✅ Баллы изменились в попытках: {regraded} из {total}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
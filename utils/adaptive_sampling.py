@@ -0,0 +1,331 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/adaptive_sampling.py
+"""
+Адаптивный отбор вопросов
+Вес вопроса растет с его сложностью (средний балл всех тестируемых) и с промахами
+конкретного тестируемого. Веса лежат в дереве Фенвика, поэтому и выбор вопроса,
+и обновление веса после check_answer - O(log n) даже для банка в десятки тысяч вопросов
+История баллов - themes/.<theme_id>.stats, по одной JSON-записи на строку
+"""
+import os
+import json
+import random
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+import theme_journal
+from file_utils import atomic_write, file_lock
+from theme_loader import get_themes_dir, get_theme_version, get_question_ids
+
+# Во сколько раз (1 + MISS_BOOST * недобор балла) растет вес вопроса, на котором тестируемый ошибся
+MISS_BOOST = float(os.environ.get("FAP_ADAPTIVE_MISS_BOOST", "2"))
+
+# После стольких записей файл истории сворачивается в итоговые записи по вопросам
+STATS_COMPACT_RECORDS = int(os.environ.get("FAP_ADAPTIVE_COMPACT", "10000"))
+
+class FenwickTree:
+    """
+    Дерево Фенвика над весами: вес позиции меняется и позиция выбирается
+    пропорционально весу за O(log n)
+    """
+    
+    __slots__ = ('_weights', '_tree', '_updates')
+    
+    def __init__(self, weights: List[float]):
+        self._weights = list(weights)
+        self._rebuild()
+    
+    def _rebuild(self) -> None:
+        """Построение за O(n); заодно сбрасывает накопленную ошибку округления"""
+        size = len(self._weights)
+        tree = [0.0] * (size + 1)
+        for i, weight in enumerate(self._weights, 1):
+            tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._updates = 0
+    
+    def __len__(self) -> int:
+        return len(self._weights)
+    
+    def get(self, position: int) -> float:
+        return self._weights[position]
+    
+    def set(self, position: int, weight: float) -> None:
+        delta = weight - self._weights[position]
+        self._weights[position] = weight
+        i = position + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+        
+        self._updates += 1
+        if self._updates > max(1024, len(self._weights)):
+            self._rebuild()
+    
+    def total(self) -> float:
+        i = len(self._weights)
+        total = 0.0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+    
+    def find(self, value: float) -> int:
+        """Позиция, на которую приходится value в [0, total) при раскладке весов подряд"""
+        position = 0
+        step = 1 << (len(self._weights).bit_length())
+        while step:
+            following = position + step
+            if following <= len(self._weights) and self._tree[following] <= value:
+                value -= self._tree[following]
+                position = following
+            step >>= 1
+        return min(position, len(self._weights) - 1)
+    
+    def sample(self, count: int, rng=random) -> List[int]:
+        """
+        Выбор count разных позиций пропорционально весам (без возвращения)
+        Выбранные позиции на время выбора обнуляются, затем веса восстанавливаются
+        """
+        chosen: List[Tuple[int, float]] = []
+        try:
+            while len(chosen) < count:
+                total = self.total()
+                if total <= 0:
+                    break
+                position = self.find(rng.random() * total)
+                if self._weights[position] <= 0:
+                    # Граница из-за округления - берем ближайшую позицию с весом
+                    position = next((p for p in range(len(self._weights)) if self._weights[p] > 0), None)
+                    if position is None:
+                        break
+                chosen.append((position, self._weights[position]))
+                self.set(position, 0.0)
+        finally:
+            for position, weight in reversed(chosen):
+                self.set(position, weight)
+        return [position for position, _ in chosen]
+
+def question_weight(count: int, score_sum: float) -> float:
+    """
+    Базовый вес по сложности: 0.5 (всегда отвечают верно) ... 1.5 (всегда неверно)
+    Средний балл сглажен, поэтому новый вопрос получает средний вес 1.0
+    """
+    return 1.5 - (score_sum + 1) / (count + 2)
+
+def user_key(user_info: Optional[Dict]) -> str:
+    """Ключ тестируемого в истории - ФИО"""
+    if not user_info:
+        return ""
+    return " ".join(user_info.get(part, '') for part in ('last_name', 'first_name', 'middle_name')).strip()
+
+class ThemeStats:
+    """История баллов одной темы: сложность вопросов и промахи тестируемых"""
+    
+    def __init__(self, theme_id: str):
+        self.path = os.path.join(get_themes_dir(), f".{theme_id}.stats")
+        self.totals: Dict[Any, List[float]] = {}
+        self.misses: Dict[str, Dict[Any, float]] = {}
+        self.records = 0
+        # (inode, смещение) прочитанной части файла: дочитывается только хвост
+        self._position: Tuple[Optional[int], int] = (None, 0)
+        self.refresh()
+    
+    def _replay(self, records: List[Dict[str, Any]]) -> None:
+        self.totals.clear()
+        self.misses.clear()
+        for record in records:
+            self.apply(record)
+        self.records = len(records)
+    
+    def apply(self, record: Dict[str, Any]) -> None:
+        """Применить запись истории к состоянию в памяти"""
+        if record['op'] == 'score':
+            total = self.totals.setdefault(record['id'], [0, 0.0])
+            total[0] += 1
+            total[1] += record['score']
+            self._set_miss(record.get('user'), record['id'], 1.0 - record['score'])
+        elif record['op'] == 'total':
+            self.totals[record['id']] = [record['count'], record['sum']]
+        elif record['op'] == 'miss':
+            self._set_miss(record['user'], record['id'], record['miss'])
+    
+    def _set_miss(self, user: Optional[str], question_id: Any, miss: float) -> None:
+        if not user:
+            return
+        if miss > 0:
+            self.misses.setdefault(user, {})[question_id] = miss
+        else:
+            self.misses.get(user, {}).pop(question_id, None)
+    
+    def weight(self, question_id: Any) -> float:
+        count, score_sum = self.totals.get(question_id, (0, 0.0))
+        return question_weight(count, score_sum)
+    
+    def _locked(self):
+        """Блокировка файла истории между процессами"""
+        return file_lock(self.path + ".lock")
+    
+    def refresh(self) -> Optional[List[Any]]:
+        """
+        Дочитать записи, дописанные в историю после прошлого чтения (в том числе другими процессами)
+        Возвращает id вопросов из новых записей; None - файл заменен сжатием и перечитан целиком
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+        
+        with f:
+            stat = os.fstat(f.fileno())
+            inode, offset = self._position
+            if stat.st_ino == inode and stat.st_size == offset:
+                return []
+            reread = stat.st_ino != inode or stat.st_size < offset
+            if not reread:
+                f.seek(offset)
+            records = theme_journal.read_new_records(f)
+            self._position = (stat.st_ino, f.tell())
+        
+        if reread:
+            self._replay(records)
+            return None
+        for record in records:
+            self.apply(record)
+        self.records += len(records)
+        return [record['id'] for record in records if 'id' in record]
+    
+    def append(self, record: Dict[str, Any]) -> None:
+        """Дописать запись без fsync: потеря последних баллов при сбое только чуть сдвинет веса"""
+        with self._locked():
+            theme_journal.append_record(self.path, record, sync=False)
+    
+    def compact(self) -> None:
+        """
+        Свернуть историю в итоговые записи: по одной на вопрос и на промах тестируемого
+        Файл перечитывается под блокировкой, поэтому записи других процессов не теряются
+        """
+        with self._locked():
+            self._position = (None, 0)
+            self.refresh()
+            lines = [
+                json.dumps({'op': 'total', 'id': question_id, 'count': count, 'sum': score_sum}, ensure_ascii=False)
+                for question_id, (count, score_sum) in self.totals.items()
+            ]
+            lines += [
+                json.dumps({'op': 'miss', 'user': user, 'id': question_id, 'miss': miss}, ensure_ascii=False)
+                for user, user_misses in self.misses.items() for question_id, miss in user_misses.items()
+            ]
+            atomic_write(self.path, "".join(line + "\n" for line in lines).encode('utf-8'))
+            self.records = len(lines)
+            stat = os.stat(self.path)
+            self._position = (stat.st_ino, stat.st_size)
+
+# Состояние на уровне процесса (общее для всех сессий Streamlit):
+# истории тем и деревья весов theme_id, category -> {"version", "ids", "positions", "tree"}
+_stats: Dict[str, ThemeStats] = {}
+_trees: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+def _get_stats(theme_id: str) -> ThemeStats:
+    if theme_id not in _stats:
+        _stats[theme_id] = ThemeStats(theme_id)
+    return _stats[theme_id]
+
+def _invalidate_trees(theme_id: str) -> None:
+    for (tree_theme_id, _), entry in _trees.items():
+        if tree_theme_id == theme_id:
+            entry['version'] = None
+
+def _refresh_stats(theme_id: str) -> ThemeStats:
+    """
+    История темы с дочитанными записями других процессов (вызывать под _lock)
+    Веса вопросов из новых записей сразу переносятся в деревья темы
+    """
+    stats = _get_stats(theme_id)
+    try:
+        changed = stats.refresh()
+    except OSError as e:
+        print(f"⚠️ Не удалось прочитать историю баллов темы {theme_id}: {e}")
+        return stats
+    
+    if changed is None:
+        _invalidate_trees(theme_id)
+        return stats
+    for question_id in set(changed):
+        weight = stats.weight(question_id)
+        for (tree_theme_id, _), entry in _trees.items():
+            position = entry['positions'].get(question_id)
+            if tree_theme_id == theme_id and position is not None:
+                entry['tree'].set(position, weight)
+    return stats
+
+def _get_tree(theme_id: str, category: Optional[str]) -> Dict[str, Any]:
+    """Дерево весов вопросов темы/категории; перестраивается, только если изменилась тема"""
+    version = get_theme_version(theme_id)
+    entry = _trees.get((theme_id, category))
+    if entry is None or entry['version'] != version:
+        stats = _get_stats(theme_id)
+        ids = get_question_ids(theme_id, category)
+        entry = {
+            'version': version,
+            'ids': ids,
+            'positions': {question_id: position for position, question_id in enumerate(ids)},
+            'tree': FenwickTree([stats.weight(question_id) for question_id in ids])
+        }
+        _trees[(theme_id, category)] = entry
+    return entry
+
+def sample_question_ids(theme_id: str, num_questions: int, category: Optional[str] = None,
+                        user: str = "", rng=random) -> List[Any]:
+    """
+    Адаптивная выборка id вопросов (category=None - из всех категорий)
+    Промахи тестируемого временно увеличивают веса его вопросов на время выбора
+    rng - генератор плана попытки (random.Random(seed)), чтобы выборку можно было повторить
+    """
+    with _lock:
+        stats = _refresh_stats(theme_id)
+        entry = _get_tree(theme_id, category)
+        tree, positions = entry['tree'], entry['positions']
+        
+        boosted = []
+        for question_id, miss in stats.misses.get(user, {}).items():
+            position = positions.get(question_id)
+            if position is not None:
+                boosted.append((position, tree.get(position)))
+                tree.set(position, tree.get(position) * (1 + MISS_BOOST * miss))
+        
+        try:
+            chosen = tree.sample(num_questions, rng)
+        finally:
+            for position, weight in boosted:
+                tree.set(position, weight)
+        
+        return [entry['ids'][position] for position in chosen]
+
+def record_score(theme_id: str, question_id: Any, score: float, user: str = "") -> None:
+    """
+    Учесть балл за проверенный ответ: запись в историю и новый вес вопроса в деревьях темы
+    Запись читается обратно вместе с записями других процессов, дописанными с прошлого раза
+    """
+    record = {'op': 'score', 'id': question_id, 'score': score, 'user': user}
+    
+    with _lock:
+        stats = _get_stats(theme_id)
+        try:
+            stats.append(record)
+        except OSError as e:
+            print(f"⚠️ Не удалось записать историю баллов темы {theme_id}: {e}")
+            # Балл учитывается хотя бы в памяти процесса
+            stats.apply(record)
+            _invalidate_trees(theme_id)
+        stats = _refresh_stats(theme_id)
+        
+        if stats.records > STATS_COMPACT_RECORDS:
+            try:
+                stats.compact()
+            except OSError as e:
+                print(f"⚠️ Не удалось сжать историю баллов темы {theme_id}: {e}")
+            _invalidate_trees(theme_id)
\ No newline at end of file
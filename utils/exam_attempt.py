@@ -0,0 +1,122 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/exam_attempt.py
+"""
+Компактная запись попытки прохождения теста для st.session_state
+Вместо словарей user_answers/answers_checked/question_scores/question_times -
+массивы по позиции вопроса, битовая маска проверенных ответов и ответы
+в виде небольших целых чисел (индексов вариантов)
+"""
+from array import array
+from typing import List, Any, Optional, Tuple
+
+# Ответ "не выбран" в кодировке matching/double_dropdown
+NOT_SELECTED = -1
+
+# Типы вопросов, варианты которых показываются в перемешанном порядке
+SHUFFLED_TYPES = ("single_choice", "multiple_choice", "dropdown", "matching", "ordering")
+
+def layout_items(question) -> Optional[Tuple[Any, ...]]:
+    """Варианты, которые перемешиваются при показе: options, правый столбец matching, элементы ordering"""
+    if question['type'] not in SHUFFLED_TYPES:
+        return None
+    if question['type'] == "matching":
+        return tuple(question['right_column'])
+    if question['type'] == "ordering":
+        return tuple(question['items'])
+    return tuple(question['options'])
+
+class ExamAttempt:
+    """
+    Состояние одной попытки
+    
+    answers[i] - закодированный ответ на i-й вопрос (None - ответа еще нет):
+      single_choice, dropdown - индекс варианта в question.options
+      multiple_choice         - битовая маска выбранных вариантов
+      matching                - индекс в right_column для каждого элемента left_column
+      double_dropdown         - индекс варианта для каждого подвопроса
+      ordering                - номера, проставленные элементам в порядке показа
+    layouts[i] - порядок показа вариантов (перестановка индексов layout_items) из плана попытки
+    seed, theme_version - по ним план восстанавливается (см. exam_plan)
+    """
+    
+    __slots__ = ('question_ids', 'answers', 'layouts', 'scores', 'times', 'checked', 'seed', 'theme_version')
+    
+    def __init__(self, question_ids: List[Any], layouts: Optional[List[Optional[Tuple[int, ...]]]] = None,
+                 seed: Optional[int] = None, theme_version: Any = None):
+        count = len(question_ids)
+        self.question_ids = tuple(question_ids)
+        self.answers: List[Any] = [None] * count
+        self.layouts: Tuple[Optional[Tuple[int, ...]], ...] = tuple(layouts) if layouts is not None else (None,) * count
+        self.scores = array('d', [0.0]) * count
+        self.times = array('d', [0.0]) * count
+        self.checked = 0
+        self.seed = seed
+        self.theme_version = theme_version
+    
+    @classmethod
+    def from_plan(cls, plan) -> 'ExamAttempt':
+        """Попытка по плану (exam_plan.ExamPlan)"""
+        return cls(plan.question_ids, plan.layouts, plan.seed, plan.theme_version)
+    
+    def __len__(self) -> int:
+        return len(self.question_ids)
+    
+    def is_checked(self, position: int) -> bool:
+        return bool(self.checked >> position & 1)
+    
+    def mark_checked(self, position: int, score: float) -> None:
+        self.scores[position] = score
+        self.checked |= 1 << position
+    
+    @property
+    def total_score(self) -> float:
+        return sum(self.scores)
+    
+    def get_layout(self, position: int, size: int) -> Tuple[int, ...]:
+        """
+        Порядок показа вариантов из плана попытки
+        Если вопрос изменили во время теста и число вариантов не совпадает - исходный порядок
+        """
+        layout = self.layouts[position]
+        if layout is None or len(layout) != size:
+            return tuple(range(size))
+        return layout
+    
+    def get_shown(self, position: int, question) -> Optional[List[Any]]:
+        """Варианты вопроса в том порядке, в котором их видел тестируемый (для протоколов)"""
+        items = layout_items(question)
+        if items is None:
+            return None
+        return [items[i] for i in self.get_layout(position, len(items))]
+
+def decode_answer(question, encoded, layout: Optional[Tuple[int, ...]] = None) -> Any:
+    """Закодированный ответ -> исходный вид (для подсчета баллов и протоколов)"""
+    if encoded is None:
+        return None
+    
+    if question.type in ("single_choice", "dropdown"):
+        return question.options[encoded]
+    
+    if question.type == "multiple_choice":
+        return [option for i, option in enumerate(question.options) if encoded >> i & 1]
+    
+    if question.type == "matching":
+        right_column = question['right_column']
+        return {
+            left_item: right_column[index]
+            for left_item, index in zip(question['left_column'], encoded) if index != NOT_SELECTED
+        }
+    
+    if question.type == "double_dropdown":
+        return {
+            subq['key']: subq['options'][index] if index != NOT_SELECTED else None
+            for subq, index in zip(question['subquestions'], encoded)
+        }
+    
+    if question.type == "ordering":
+        items = question['items']
+        return {
+            "items": [items[i] for i in layout] if layout is not None else list(items),
+            "user_order": list(encoded)
+        }
+    
+    return None
\ No newline at end of file
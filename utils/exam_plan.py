@@ -0,0 +1,85 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/exam_plan.py
+"""
+План попытки: id вопросов и порядок показа вариантов, построенные один раз при старте теста
+Все случайные решения принимаются генератором с зерном (seed), поэтому план
+однозначно восстанавливается по (версия темы, seed) - для повтора теста и протоколов
+достаточно хранить seed, а отрисовка вопросов больше ничего не перемешивает
+"""
+import random
+import secrets
+from typing import Dict, List, Any, Optional, Tuple, NamedTuple
+
+from theme_loader import get_theme_version, get_question_ids, get_question_ids_by_category, get_questions_by_ids
+from exam_attempt import layout_items
+
+class ExamPlan(NamedTuple):
+    """Неизменяемый план попытки"""
+    theme_id: str
+    theme_version: Any
+    seed: int
+    question_ids: Tuple[Any, ...]
+    layouts: Tuple[Optional[Tuple[int, ...]], ...]
+
+def new_seed() -> int:
+    """Зерно нового плана"""
+    return secrets.randbits(32)
+
+def _permutation(rng: random.Random, size: int) -> Tuple[int, ...]:
+    layout = list(range(size))
+    rng.shuffle(layout)
+    return tuple(layout)
+
+def question_layout(question, seed: int) -> Optional[Tuple[int, ...]]:
+    """
+    Порядок показа вариантов вопроса: варианты ответа, правый столбец matching, элементы ordering
+    Свой генератор на (seed, id вопроса) - порядок не зависит от того, как вопрос попал в план
+    """
+    items = layout_items(question)
+    if items is None:
+        return None
+    return _permutation(random.Random(f"{seed}:{question.id}"), len(items))
+
+def sample_by_quotas(theme_id: str, quotas: Dict[str, int], rng: random.Random) -> List[Any]:
+    """
+    Выборка по квотам категорий за один проход по индексу категорий
+    Квота больше категории ограничивается ее размером; порядок вопросов перемешивается
+    """
+    by_category = get_question_ids_by_category(theme_id, sorted(quotas))
+    question_ids: List[Any] = []
+    for category in sorted(quotas):
+        candidates = by_category.get(category, [])
+        question_ids += rng.sample(candidates, min(quotas[category], len(candidates)))
+    rng.shuffle(question_ids)
+    return question_ids
+
+def build_exam_plan(theme_id: str, num_questions: int = 0, category: Optional[str] = None,
+                    seed: Optional[int] = None, question_ids: Optional[List[Any]] = None,
+                    shuffle_questions: bool = False, quotas: Optional[Dict[str, int]] = None) -> ExamPlan:
+    """
+    Построить план попытки
+    question_ids=None - вопросы выбираются случайно из темы/категории генератором плана,
+    а при заданных quotas ({категория: количество}) - из каждой категории своя квота;
+    заданные question_ids (адаптивный отбор, повтор теста) идут в своем порядке,
+    если не задан shuffle_questions, - перемешиваются только варианты
+    """
+    seed = new_seed() if seed is None else seed
+    rng = random.Random(seed)
+    theme_version = get_theme_version(theme_id)
+    
+    if question_ids is None and quotas:
+        question_ids = sample_by_quotas(theme_id, quotas, rng)
+    elif question_ids is None:
+        candidates = get_question_ids(theme_id, category)
+        question_ids = rng.sample(candidates, min(num_questions, len(candidates)))
+    elif shuffle_questions:
+        question_ids = list(question_ids)
+        rng.shuffle(question_ids)
+    
+    questions = get_questions_by_ids(theme_id, list(question_ids))
+    return ExamPlan(
+        theme_id=theme_id,
+        theme_version=theme_version,
+        seed=seed,
+        question_ids=tuple(question.id for question in questions),
+        layouts=tuple(question_layout(question, seed) for question in questions)
+    )
\ No newline at end of file
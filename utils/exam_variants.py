@@ -0,0 +1,163 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/exam_variants.py
+"""
+Пул заранее построенных вариантов теста - для экзаменов группой, когда все
+нажимают "Начать тест" в одну минуту: вместо выборки при старте выдается готовый
+вариант (seed + id вопросов, см. exam_plan)
+Пул строится скриптом generate_variants.py и лежит в themes/.<theme_id>.variants.json
+"""
+import os
+import json
+import random
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from file_utils import atomic_write
+from theme_loader import get_themes_dir, get_theme_content_hash, get_question_ids, get_questions_by_ids
+
+# Пулы на уровне процесса: theme_id -> {"mtime", "pool", "next"}
+_pools: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+def get_pool_path(theme_id: str) -> str:
+    return os.path.join(get_themes_dir(), f".{theme_id}.variants.json")
+
+def split_quota(total: int, sizes: Dict[str, int]) -> Dict[str, int]:
+    """
+    Разделить total вопросов между группами пропорционально их размеру
+    (метод наибольшего остатка, не больше размера группы)
+    """
+    available = sum(sizes.values())
+    total = min(total, available)
+    if total <= 0:
+        return {group: 0 for group in sizes}
+    
+    exact = {group: total * size / available for group, size in sizes.items()}
+    quota = {group: min(int(share), sizes[group]) for group, share in exact.items()}
+    by_remainder = sorted(sizes, key=lambda group: exact[group] - int(exact[group]), reverse=True)
+    while sum(quota.values()) < total:
+        for group in by_remainder:
+            if sum(quota.values()) < total and quota[group] < sizes[group]:
+                quota[group] += 1
+    return quota
+
+def _pick_balanced(questions: List, count: int, usage: Counter, rng: random.Random) -> List[Any]:
+    """
+    count вопросов группы: по очереди из каждого типа вопросов, внутри типа -
+    реже всего попадавшие в уже построенные варианты
+    """
+    by_type: Dict[str, List] = {}
+    for question in questions:
+        by_type.setdefault(question.type, []).append(question.id)
+    for ids in by_type.values():
+        rng.shuffle(ids)
+        ids.sort(key=lambda question_id: usage[question_id])
+    
+    types = list(by_type)
+    rng.shuffle(types)
+    chosen: List[Any] = []
+    while len(chosen) < count:
+        for question_type in types:
+            if len(chosen) < count and by_type[question_type]:
+                chosen.append(by_type[question_type].pop(0))
+    return chosen
+
+def generate_variants(theme_id: str, num_variants: int, num_questions: int,
+                      category: Optional[str] = None, seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Построить пул вариантов
+    Вопросы делятся между категориями пропорционально их размеру, внутри категории -
+    поровну между типами; вопросы, реже попадавшие в варианты, выбираются первыми
+    """
+    rng = random.Random(seed)
+    questions = get_questions_by_ids(theme_id, get_question_ids(theme_id, category))
+    
+    groups: Dict[str, List] = {}
+    for question in questions:
+        groups.setdefault(question.get('category') or "", []).append(question)
+    quota = split_quota(num_questions, {group: len(items) for group, items in groups.items()})
+    
+    usage: Counter = Counter()
+    variants = []
+    for _ in range(num_variants):
+        question_ids: List[Any] = []
+        for group, items in groups.items():
+            question_ids += _pick_balanced(items, quota[group], usage, rng)
+        usage.update(question_ids)
+        rng.shuffle(question_ids)
+        variants.append({'seed': rng.getrandbits(32), 'question_ids': question_ids})
+    
+    return {
+        'theme_id': theme_id,
+        'theme_hash': get_theme_content_hash(theme_id),
+        'category': category,
+        'num_questions': min(num_questions, len(questions)),
+        'generated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'variants': variants
+    }
+
+def save_pool(pool: Dict[str, Any]) -> str:
+    """Записать пул атомарно (приложение может читать его в этот момент)"""
+    path = get_pool_path(pool['theme_id'])
+    atomic_write(path, json.dumps(pool, ensure_ascii=False).encode('utf-8'))
+    return path
+
+def _load_pool(theme_id: str) -> Optional[Dict[str, Any]]:
+    """Пул из кэша процесса; файл перечитывается, только если изменился"""
+    path = get_pool_path(theme_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        _pools.pop(theme_id, None)
+        return None
+    
+    cached = _pools.get(theme_id)
+    if cached is None or cached['mtime'] != mtime:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                pool = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"❌ Ошибка чтения пула вариантов {path}: {e}")
+            return None
+        cached = {'mtime': mtime, 'pool': pool, 'next': 0}
+        _pools[theme_id] = cached
+    return cached
+
+def next_variant(theme_id: str, num_questions: int,
+                 category: Optional[str] = None) -> Optional[Tuple[int, List[Any]]]:
+    """
+    Следующий готовый вариант (seed, id вопросов) по кругу
+    None - пула нет, он построен для других настроек или тема с тех пор изменилась
+    """
+    with _lock:
+        cached = _load_pool(theme_id)
+        if cached is None:
+            return None
+        
+        pool = cached['pool']
+        if (pool['category'] != category or pool['num_questions'] != num_questions
+                or not pool['variants']):
+            return None
+        # Пул привязан к содержимому темы, а не к mtime: checkout или развертывание его не сбрасывают
+        if pool.get('theme_hash') != get_theme_content_hash(theme_id):
+            print(f"⚠️ Пул вариантов темы {theme_id} устарел - тема изменилась, нужен generate_variants.py")
+            return None
+        
+        variant = pool['variants'][cached['next'] % len(pool['variants'])]
+        cached['next'] += 1
+        return variant['seed'], variant['question_ids']
+
+def get_pool_info(theme_id: str) -> Optional[Dict[str, Any]]:
+    """Настройки пула темы (для страницы выбора теста) без самих вариантов"""
+    with _lock:
+        cached = _load_pool(theme_id)
+    if cached is None:
+        return None
+    pool = cached['pool']
+    return {
+        'category': pool['category'],
+        'num_questions': pool['num_questions'],
+        'generated_at': pool['generated_at'],
+        'variants': len(pool['variants'])
+    }
\ No newline at end of file
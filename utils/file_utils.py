@@ -0,0 +1,43 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/file_utils.py
+"""
+Общие файловые операции для процессов, пишущих в одни и те же файлы:
+атомарная запись через временный файл и рекомендательная блокировка
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+# Рекомендательные блокировки файлов (на Windows модуля нет - блокировка не берется)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+def atomic_write(path: str, raw: bytes) -> None:
+    """
+    Запись через временный файл и rename - читатели не увидят файл наполовину
+    Имя временного файла уникально для процесса и потока, поэтому одновременные
+    писатели одного файла не пишут в общий временный файл
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+@contextmanager
+def file_lock(lock_path: str):
+    """Эксклюзивная блокировка между процессами на время блока with (файл блокировки создается при необходимости)"""
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
\ No newline at end of file
@@ -0,0 +1,208 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/near_duplicates.py
+"""
+Поиск почти одинаковых вопросов во всех темах (MinHash + LSH)
+Вопрос -> множество "шинглов" (основы слов и пары соседних основ текста вопроса и вариантов)
+-> MinHash-подпись; подписи разбиты на полосы, и кандидаты в дубликаты - только
+вопросы с совпадающей полосой, поэтому поиск не перебирает весь банк попарно
+"""
+import os
+import re
+import random
+import hashlib
+import threading
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from theme_loader import scan_theme_manifest, load_theme, get_theme_version
+
+# Подпись из BANDS полос по ROWS значений: вероятность попасть в кандидаты
+# резко растет около сходства (1 / BANDS) ** (1 / ROWS) ~ 0.5
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+
+# Минимальное сходство (доля общих шинглов), начиная с которого вопрос считается дубликатом
+SIMILARITY_THRESHOLD = float(os.environ.get("FAP_DUPLICATE_THRESHOLD", "0.6"))
+
+# Длина основы слова - грубая замена стемминга (окончания при перефразировании меняются)
+STEM_LENGTH = 5
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+def question_text_parts(question: Dict) -> List[str]:
+    """Тексты вопроса, по которым сравниваются вопросы: формулировка и варианты ответа"""
+    parts = [question.get('question', '')]
+    parts += question.get('options', [])
+    parts += question.get('left_column', [])
+    parts += question.get('right_column', [])
+    parts += question.get('items', [])
+    for subq in question.get('subquestions', []):
+        parts.append(subq.get('text', ''))
+        parts += subq.get('options', [])
+    return [str(part) for part in parts]
+
+def question_shingles(question: Dict) -> Set[str]:
+    """Основы слов и пары соседних основ"""
+    shingles: Set[str] = set()
+    for part in question_text_parts(question):
+        stems = [word[:STEM_LENGTH] for word in re.findall(r'\w+', part.lower().replace('ё', 'е'))]
+        shingles.update(stems)
+        shingles.update(f"{first} {second}" for first, second in zip(stems, stems[1:]))
+    return shingles
+
+def _stable_hash(shingle: str) -> int:
+    """Хэш, одинаковый во всех процессах (встроенный hash() солится при запуске)"""
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def minhash(shingles: Set[str]) -> Tuple[int, ...]:
+    """MinHash-подпись множества шинглов"""
+    if not shingles:
+        return (_PRIME,) * NUM_PERM
+    hashes = [_stable_hash(shingle) for shingle in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+def jaccard(first: Set[str], second: Set[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+class LSHIndex:
+    """Индекс подписей: полоса подписи -> вопросы с такой же полосой"""
+    
+    def __init__(self):
+        self.signatures: Dict[Any, Tuple[int, ...]] = {}
+        self.buckets: List[Dict[Tuple[int, ...], Set[Any]]] = [{} for _ in range(BANDS)]
+    
+    def _bands(self, signature: Tuple[int, ...]):
+        for band in range(BANDS):
+            yield band, signature[band * ROWS:(band + 1) * ROWS]
+    
+    def add(self, key: Any, signature: Tuple[int, ...]) -> None:
+        self.remove(key)
+        self.signatures[key] = signature
+        for band, band_key in self._bands(signature):
+            self.buckets[band].setdefault(band_key, set()).add(key)
+    
+    def remove(self, key: Any) -> None:
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in self._bands(signature):
+            bucket = self.buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band][band_key]
+    
+    def candidates(self, signature: Tuple[int, ...]) -> Set[Any]:
+        """Вопросы, совпавшие с подписью хотя бы в одной полосе"""
+        found: Set[Any] = set()
+        for band, band_key in self._bands(signature):
+            found.update(self.buckets[band].get(band_key, ()))
+        return found
+
+# Индекс всех тем на уровне процесса; ключ вопроса - (theme_id, id вопроса)
+# Тема переиндексируется, только когда меняется ее версия, и подпись
+# пересчитывается только у вопросов, тексты которых изменились
+_index = LSHIndex()
+_shingles: Dict[Tuple[str, Any], Set[str]] = {}
+_texts: Dict[Tuple[str, Any], str] = {}
+_parts: Dict[Tuple[str, Any], List[str]] = {}
+_theme_versions: Dict[str, Any] = {}
+_theme_names: Dict[str, str] = {}
+_lock = threading.Lock()
+
+def _drop_question(key: Tuple[str, Any]) -> None:
+    _index.remove(key)
+    del _shingles[key]
+    del _texts[key]
+    del _parts[key]
+
+def _drop_theme(theme_id: str) -> None:
+    for key in [key for key in _shingles if key[0] == theme_id]:
+        _drop_question(key)
+    _theme_versions.pop(theme_id, None)
+
+def _index_theme(theme_id: str, questions: List[Dict]) -> None:
+    """Переиндексировать тему: новые и измененные вопросы - заново, удаленные - из индекса"""
+    keys = set()
+    for question in questions:
+        key = (theme_id, question.get('id'))
+        keys.add(key)
+        parts = question_text_parts(question)
+        _texts[key] = question.get('question', '')
+        if _parts.get(key) == parts:
+            continue
+        
+        _parts[key] = parts
+        _shingles[key] = question_shingles(question)
+        _index.add(key, minhash(_shingles[key]))
+    
+    for key in [key for key in _shingles if key[0] == theme_id and key not in keys]:
+        _drop_question(key)
+
+def _sync_index() -> None:
+    """Привести индекс к текущим версиям тем (вызывать под _lock)"""
+    manifest = scan_theme_manifest()
+    for theme_id in [theme_id for theme_id in _theme_versions if theme_id not in manifest]:
+        _drop_theme(theme_id)
+    
+    for theme_id, info in manifest.items():
+        version = get_theme_version(theme_id)
+        if theme_id in _theme_versions and _theme_versions[theme_id] == version:
+            continue
+        
+        theme_data = load_theme(theme_id)
+        if theme_data is None:
+            _drop_theme(theme_id)
+            continue
+        _index_theme(theme_id, theme_data.get('questions', []))
+        _theme_versions[theme_id] = version
+        _theme_names[theme_id] = info.get('name', theme_id)
+
+def _describe(key: Tuple[str, Any], similarity: float) -> Dict[str, Any]:
+    return {
+        'theme_id': key[0],
+        'theme_name': _theme_names.get(key[0], key[0]),
+        'question_id': key[1],
+        'question': _texts[key],
+        'similarity': round(similarity, 2)
+    }
+
+def find_near_duplicates(question: Dict, exclude: Optional[Tuple[str, Any]] = None,
+                         threshold: float = SIMILARITY_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Похожие на question вопросы во всех темах, от самого похожего
+    Кандидаты берутся из полос LSH, сходство уточняется по самим шинглам
+    """
+    shingles = question_shingles(question)
+    signature = minhash(shingles)
+    
+    with _lock:
+        _sync_index()
+        found = []
+        for key in _index.candidates(signature):
+            if key == exclude:
+                continue
+            similarity = jaccard(shingles, _shingles[key])
+            if similarity >= threshold:
+                found.append(_describe(key, similarity))
+    
+    return sorted(found, key=lambda item: item['similarity'], reverse=True)
+
+def find_all_duplicates(threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Все пары похожих вопросов во всех темах (для скрипта find_duplicates.py)"""
+    with _lock:
+        _sync_index()
+        pairs = []
+        for key, signature in _index.signatures.items():
+            for other in _index.candidates(signature):
+                # Каждая пара - один раз (id вопросов могут быть разных типов, сравниваем строки)
+                if repr(other) <= repr(key):
+                    continue
+                similarity = jaccard(_shingles[key], _shingles[other])
+                if similarity >= threshold:
+                    pairs.append((_describe(key, similarity), _describe(other, similarity)))
+    
+    return sorted(pairs, key=lambda pair: pair[0]['similarity'], reverse=True)
\ No newline at end of file
@@ -0,0 +1,107 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/offset_index.py
+"""
+Индекс смещений вопросов в файле темы
+Позволяет читать отдельные вопросы срезом через mmap, не загружая всю тему
+"""
+import os
+import json
+import mmap
+from typing import Dict, List, Any, Optional
+
+from file_utils import atomic_write
+
+# Версия формата индекса - увеличить при изменении структуры
+INDEX_VERSION = 2
+
+_decoder = json.JSONDecoder()
+
+def _skip_ws(text: str, idx: int) -> int:
+    while idx < len(text) and text[idx] in ' \t\r\n':
+        idx += 1
+    return idx
+
+def build_offsets(raw: bytes) -> Optional[List[Dict[str, Any]]]:
+    """
+    Найти байтовые границы каждого вопроса в файле темы
+    Возвращает [{"id", "category", "type", "start", "end"}, ...] в порядке вопросов
+    или None, если у файла нет массива questions
+    
+    Разбор идет по тексту файла, поэтому работает при любом форматировании JSON.
+    """
+    text = raw.decode('utf-8')
+    idx = _skip_ws(text, 0)
+    if text[idx:idx + 1] != '{':
+        return None
+    idx += 1
+    
+    # Смещение в байтах считаем инкрементально: символы -> байты UTF-8
+    char_pos, byte_pos = 0, 0
+    
+    def to_bytes(pos: int) -> int:
+        nonlocal char_pos, byte_pos
+        byte_pos += len(text[char_pos:pos].encode('utf-8'))
+        char_pos = pos
+        return byte_pos
+    
+    while True:
+        idx = _skip_ws(text, idx)
+        if text[idx:idx + 1] == '}':
+            return None
+        key, idx = _decoder.raw_decode(text, idx)
+        idx = _skip_ws(text, idx)
+        idx = _skip_ws(text, idx + 1)  # пропускаем ':'
+        
+        if key != 'questions':
+            _, idx = _decoder.raw_decode(text, idx)
+            idx = _skip_ws(text, idx)
+            if text[idx:idx + 1] == ',':
+                idx += 1
+            continue
+        
+        offsets = []
+        idx = _skip_ws(text, idx + 1)  # пропускаем '['
+        while text[idx:idx + 1] != ']':
+            question, end = _decoder.raw_decode(text, idx)
+            offsets.append({
+                'id': question.get('id'),
+                'category': question.get('category'),
+                'type': question.get('type'),
+                'start': to_bytes(idx),
+                'end': to_bytes(end)
+            })
+            idx = _skip_ws(text, end)
+            if text[idx:idx + 1] == ',':
+                idx = _skip_ws(text, idx + 1)
+        return offsets
+
+def read_index(index_path: str) -> Optional[Dict[str, Any]]:
+    """Загрузить индекс: {"mtime", "size", "offsets"}. При любой ошибке - None"""
+    if not os.path.exists(index_path):
+        return None
+    
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION:
+            return None
+        return index
+    except Exception as e:
+        print(f"⚠️ Индекс смещений {index_path} поврежден и будет пересоздан: {e}")
+        return None
+
+def write_index(index_path: str, mtime: int, size: int, offsets: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сохранить индекс рядом со снимками тем"""
+    index = {'version': INDEX_VERSION, 'mtime': mtime, 'size': size, 'offsets': offsets}
+    try:
+        atomic_write(index_path, json.dumps(index, ensure_ascii=False).encode('utf-8'))
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить индекс смещений {index_path}: {e}")
+    return index
+
+def read_questions(theme_file: str, entries: List[Dict[str, Any]]) -> List[Dict]:
+    """Прочитать только указанные вопросы срезами memory-mapped файла"""
+    if not entries:
+        return []
+    
+    with open(theme_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return [json.loads(mm[entry['start']:entry['end']]) for entry in entries]
\ No newline at end of file
@@ -0,0 +1,276 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/protocols.py
+"""
+Протоколы тестирования
+Данные протокола, тексты основного протокола и детальной статистики и запись
+попытки (attempt.json) в папку пользователя - без Streamlit, поэтому те же функции
+использует и пересчет сохраненных попыток (regrade_attempts.py)
+"""
+import os
+import json
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from file_utils import atomic_write
+from question_model import compile_question
+
+# Запись попытки рядом с протоколами: ответы в исходном виде и баллы по вопросам
+ATTEMPT_FILE = "attempt.json"
+ATTEMPT_RECORD_VERSION = 1
+
+def format_time(seconds):
+    """Форматирование времени в читаемый вид (минуты:секунды)"""
+    seconds_rounded = round(seconds)
+    minutes = seconds_rounded // 60
+    seconds_display = seconds_rounded % 60
+    return f"{minutes:02d}:{seconds_display:02d}"
+
+def build_protocol_data(user_info: Dict, theme: Dict, category: str, questions: List,
+                        scores: List[float], times: List[float],
+                        generated_at: Optional[str] = None, plan: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    Генерация данных для протокола
+    plan - seed и версия темы плана попытки (см. exam_plan): по ним вариант восстанавливается
+    """
+    total_questions = len(questions)
+    total_score = sum(scores)
+    max_possible_score = total_questions
+    total_time = sum(times)
+    percentage = (total_score / max_possible_score) * 100 if max_possible_score else 0
+    
+    protocol = {
+        "protocol_info": {
+            "title": "Протокол тестирования",
+            "generated_at": generated_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        },
+        "user_info": user_info,
+        "test_info": {
+            "theme": theme['name'],
+            "theme_id": theme['id'],
+            "total_questions": total_questions,
+            "category": category,
+            "plan": plan
+        },
+        "results": {
+            "total_score": round(total_score, 2),
+            "max_score": max_possible_score,
+            "percentage": round(percentage, 1),
+            "total_time_seconds": round(total_time),
+            "total_time_formatted": format_time(total_time),
+            "average_time_seconds": round(total_time / total_questions) if total_questions > 0 else 0,
+            "average_time_formatted": format_time(total_time / total_questions) if total_questions > 0 else "00:00"
+        },
+        "detailed_results": []
+    }
+    
+    # Добавляем детальную информацию по каждому вопросу
+    for i, question in enumerate(questions):
+        question_time = times[i]
+        question_score = scores[i]
+        
+        protocol["detailed_results"].append({
+            "question_number": i + 1,
+            "question_text": question['question'],
+            "score": round(question_score, 2),
+            "time_seconds": round(question_time),
+            "time_formatted": format_time(question_time),
+            "category": question.get('category', 'Не указана')
+        })
+    
+    return protocol
+
+def write_main_protocol(protocol_data: Dict, user_folder: str) -> str:
+    """Основной протокол тестирования -> файл в папке пользователя"""
+    user = protocol_data['user_info']
+    results = protocol_data['results']
+    regraded_at = protocol_data['protocol_info'].get('regraded_at')
+    regraded = f"\nБаллы пересчитаны: {regraded_at}" if regraded_at else ""
+    plan = protocol_data['test_info'].get('plan')
+    variant = f"\nВариант (seed): {plan['seed']}" if plan and plan.get('seed') is not None else ""
+    
+    text = f"""
+ПРОТОКОЛ ТЕСТИРОВАНИЯ
+=====================
+
+Дата генерации: {protocol_data['protocol_info']['generated_at']}{regraded}
+
+ДАННЫЕ ТЕСТИРУЕМОГО:
+-------------------
+ФИО: {user['last_name']} {user['first_name']} {user['middle_name']}
+Должность: {user['position']}
+Дата тестирования: {user['login_time']}
+
+ИНФОРМАЦИЯ О ТЕСТЕ:
+------------------
+Тема: {protocol_data['test_info']['theme']}
+Категория: {protocol_data['test_info']['category']}
+Количество вопросов: {protocol_data['test_info']['total_questions']}{variant}
+
+РЕЗУЛЬТАТЫ ТЕСТИРОВАНИЯ:
+-----------------------
+Набрано баллов: {results['total_score']} из {results['max_score']}
+Процент выполнения: {results['percentage']}%
+Общее время: {results['total_time_formatted']}
+Среднее время на вопрос: {results['average_time_formatted']}
+
+ОЦЕНКА:
+------
+{"ОТЛИЧНО - Тест пройден успешно!" if results['percentage'] >= 80 else 
+ "ХОРОШО - Тест пройден, рекомендуется повторение материала." if results['percentage'] >= 60 else 
+ "НЕУДОВЛЕТВОРИТЕЛЬНО - Требуется дополнительное обучение."}
+
+=====================
+Детальная статистика по вопросам сохранена в отдельном файле.
+"""
+
+    # Сохраняем основной протокол
+    filename = f"Протокол_тестирования_{user['last_name']}_{user['first_name']}.txt"
+    filepath = os.path.join(user_folder, filename)
+    
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(text)
+    
+    return filepath
+
+def write_detailed_statistics(protocol_data: Dict, questions: List, user_answers: List[Any],
+                              user_folder: str, shown: Optional[List[Any]] = None) -> str:
+    """
+    Детальная статистика по вопросам с полной информацией -> файл в папке пользователя
+    shown - варианты каждого вопроса в порядке показа (ExamAttempt.get_shown); без него - порядок темы
+    """
+    user = protocol_data['user_info']
+    shown = shown or [None] * len(questions)
+    
+    text = f"""
+ДЕТАЛЬНАЯ СТАТИСТИКА ПО ВОПРОСАМ
+================================
+
+ФИО: {user['last_name']} {user['first_name']} {user['middle_name']}
+Тема тестирования: {protocol_data['test_info']['theme']}
+Дата тестирования: {user['login_time']}
+
+СТАТИСТИКА ПО ВОПРОСАМ:
+======================
+"""
+
+    for detail, question, user_answer, shown_items in zip(protocol_data['detailed_results'], questions,
+                                                          user_answers, shown):
+        options = shown_items or question.get('options', [])
+        
+        text += f"""
+Вопрос {detail['question_number']}:
+╔═══════════════════════════════════════════════════════════════════
+║ Баллы: {detail['score']:.2f}/1.00
+║ Время: {detail['time_formatted']}
+╟───────────────────────────────────────────────────────────────────
+║ ВОПРОС: {question['question']}
+╟───────────────────────────────────────────────────────────────────
+"""
+
+        # Обработка разных типов вопросов
+        if question['type'] == 'single_choice':
+            text += f"║ ВАРИАНТЫ: {', '.join(options)}\n"
+            text += f"║ ВАШ ОТВЕТ: {user_answer}\n"
+            text += f"║ ПРАВИЛЬНЫЙ ОТВЕТ: {question['correct']}\n"
+            text += f"║ СТАТУС: {'✅ ВЕРНО' if user_answer == question['correct'] else '❌ НЕВЕРНО'}\n"
+        
+        elif question['type'] == 'multiple_choice':
+            text += f"║ ВАРИАНТЫ: {', '.join(options)}\n"
+            text += f"║ ВАШИ ОТВЕТЫ: {', '.join(user_answer) if user_answer else 'Нет ответа'}\n"
+            text += f"║ ПРАВИЛЬНЫЕ ОТВЕТЫ: {', '.join(question['correct'])}\n"
+            user_set = set(user_answer or [])
+            if user_set == compile_question(question).correct_set:
+                text += "║ СТАТУС: ✅ ВСЕ ОТВЕТЫ ВЕРНЫ\n"
+            else:
+                text += "║ СТАТУС: ⚠️ ЧАСТИЧНО ВЕРНО\n"
+        
+        elif question['type'] == 'matching':
+            text += f"║ ВАРИАНТЫ: {', '.join(shown_items or question['right_column'])}\n"
+            text += "║ СООТВЕТСТВИЯ:\n"
+            for left_item in question['left_column']:
+                user_ans = user_answer.get(left_item, 'Не ответил')
+                correct_ans = question['correct_mapping'][left_item]
+                is_correct = user_ans == correct_ans
+                status = '✅ ВЕРНО' if is_correct else '❌ НЕВЕРНО'
+                text += f"║   • {left_item}: {user_ans} → {correct_ans} ({status})\n"
+        
+        elif question['type'] == 'dropdown':
+            text += f"║ ВАРИАНТЫ: {', '.join(options)}\n"
+            text += f"║ ВАШ ОТВЕТ: {user_answer}\n"
+            text += f"║ ПРАВИЛЬНЫЙ ОТВЕТ: {question['correct']}\n"
+            text += f"║ СТАТУС: {'✅ ВЕРНО' if user_answer == question['correct'] else '❌ НЕВЕРНО'}\n"
+        
+        elif question['type'] == 'double_dropdown':
+            text += "║ ПОДВОПРОСЫ:\n"
+            for subq in question['subquestions']:
+                user_ans = user_answer.get(subq['key'], 'Не ответил')
+                is_correct = user_ans == subq['correct']
+                status = '✅ ВЕРНО' if is_correct else '❌ НЕВЕРНО'
+                text += f"║   • {subq['text']}: {user_ans} → {subq['correct']} ({status})\n"
+        
+        elif question['type'] == 'ordering':
+            # Восстанавливаем порядок пользователя
+            data = user_answer
+            user_sequence = []
+            for idx, item in enumerate(data["items"]):
+                user_sequence.append((data["user_order"][idx], item))
+            user_sequence.sort()
+            user_order = [item for _, item in user_sequence]
+            
+            text += f"║ ЭЛЕМЕНТЫ: {', '.join(data['items'])}\n"
+            text += f"║ ВАШ ПОРЯДОК: {', '.join(user_order)}\n"
+            text += f"║ ПРАВИЛЬНЫЙ ПОРЯДОК: {', '.join(question['correct_order'])}\n"
+            text += f"║ СТАТУС: {'✅ ВЕРНО' if user_order == question['correct_order'] else '❌ НЕВЕРНО'}\n"
+        
+        text += "╚═══════════════════════════════════════════════════════════════════\n"
+    
+    text += "\n" + "="*70
+    text += "\nСтатистика сгенерирована автоматически системой тестирования ФАП"
+    
+    # Сохраняем детальную статистику
+    filename = f"Детальная_статистика_{user['last_name']}_{user['first_name']}.txt"
+    filepath = os.path.join(user_folder, filename)
+    
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(text)
+    
+    return filepath
+
+def save_attempt_record(user_folder: str, protocol_data: Dict, question_ids: List[Any],
+                        user_answers: List[Any], checked: List[bool],
+                        scores: List[float], times: List[float],
+                        shown: Optional[List[Any]] = None) -> str:
+    """
+    Сохранить попытку для последующего пересчета баллов
+    Ответы хранятся в исходном виде (строки вариантов), а не индексами:
+    индексы зависят от порядка вариантов, который может измениться при правке темы
+    shown - варианты каждого вопроса в том порядке, в котором их видел тестируемый
+    """
+    record = {
+        "version": ATTEMPT_RECORD_VERSION,
+        "theme_id": protocol_data['test_info']['theme_id'],
+        "protocol_data": protocol_data,
+        "question_ids": list(question_ids),
+        "answers": list(user_answers),
+        "checked": list(checked),
+        "scores": list(scores),
+        "times": list(times),
+        "shown": list(shown) if shown is not None else [None] * len(question_ids)
+    }
+    
+    filepath = os.path.join(user_folder, ATTEMPT_FILE)
+    atomic_write(filepath, json.dumps(record, ensure_ascii=False, indent=2).encode('utf-8'))
+    return filepath
+
+def load_attempt_record(filepath: str) -> Optional[Dict[str, Any]]:
+    """Прочитать attempt.json; None - файл поврежден или другого формата"""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"❌ Ошибка чтения попытки {filepath}: {e}")
+        return None
+    
+    if record.get('version') != ATTEMPT_RECORD_VERSION:
+        print(f"⚠️ Неизвестная версия записи попытки: {filepath}")
+        return None
+    return record
\ No newline at end of file
@@ -0,0 +1,96 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/question_model.py
+"""
+Скомпилированные вопросы: неизменяемые объекты с заранее посчитанными ключами ответов
+Создаются один раз при чтении вопроса из темы, поэтому на каждый rerun Streamlit
+не пересобираются множества правильных ответов и не ищутся индексы вариантов
+"""
+from types import MappingProxyType
+from collections.abc import Mapping
+from typing import Dict, Any, Tuple
+
+def _index_map(items) -> Dict[Any, int]:
+    """Вариант -> позиция первого вхождения (как list.index)"""
+    index = {}
+    for position, item in enumerate(items):
+        index.setdefault(item, position)
+    return index
+
+def _correct_set(correct) -> frozenset:
+    """Правильные ответы множеством: список для multiple_choice, строка для single_choice/dropdown"""
+    if correct is None:
+        return frozenset()
+    if isinstance(correct, list):
+        return frozenset(correct)
+    return frozenset([correct])
+
+class CompiledQuestion(Mapping):
+    """
+    Вопрос темы только для чтения
+    
+    Доступ question['type'] / question.get('category') работает как у словаря,
+    а для проверки ответов и отрисовки есть готовые атрибуты:
+    correct_set, option_index, correct_mapping, order_position, subquestion_correct
+    """
+    
+    __slots__ = (
+        '_data', 'id', 'type', 'options', 'option_index',
+        'correct', 'correct_set', 'correct_mapping', 'correct_order', 'order_position',
+        'subquestion_correct'
+    )
+    
+    def __init__(self, question: Dict[str, Any]):
+        question_type = question['type']
+        options = tuple(question.get('options', ()))
+        correct = question.get('correct')
+        correct_order = tuple(question.get('correct_order', ()))
+        
+        # Позиции каждого элемента в правильном порядке (кортеж - элементы могут повторяться)
+        order_position: Dict[Any, Tuple[int, ...]] = {}
+        for position, item in enumerate(correct_order):
+            order_position[item] = order_position.get(item, ()) + (position,)
+        
+        subquestions = question.get('subquestions', ())
+        
+        values = {
+            '_data': MappingProxyType(dict(question)),
+            'id': question.get('id'),
+            'type': question_type,
+            'options': options,
+            'option_index': MappingProxyType(_index_map(options)),
+            'correct': correct,
+            'correct_set': _correct_set(correct),
+            'correct_mapping': MappingProxyType(dict(question.get('correct_mapping', {}))),
+            'correct_order': correct_order,
+            'order_position': MappingProxyType(order_position),
+            'subquestion_correct': tuple((subq['key'], subq['correct']) for subq in subquestions)
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledQuestion доступен только для чтения")
+    
+    def __delattr__(self, name):
+        raise AttributeError("CompiledQuestion доступен только для чтения")
+    
+    def __getitem__(self, key):
+        return self._data[key]
+    
+    def __iter__(self):
+        return iter(self._data)
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __repr__(self):
+        return f"CompiledQuestion(id={self.id!r}, type={self.type!r})"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Исходный вопрос в виде обычного словаря (для записи в JSON)"""
+        return dict(self._data)
+
+def compile_question(question) -> CompiledQuestion:
+    """Скомпилировать вопрос; уже скомпилированный возвращается как есть"""
+    if isinstance(question, CompiledQuestion):
+        return question
+    return CompiledQuestion(question)
\ No newline at end of file
@@ -0,0 +1,210 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/run_metrics.py
+"""
+Замеры времени выполнения скрипта Streamlit: на каждый прогон (rerun) - время
+в отмеченных функциях (загрузка тем, отрисовка вопросов, проверка ответа, протоколы)
+и примерный размер st.session_state
+Прогон -> строка JSON в файле метрик с ротацией; суммы по процессу можно
+забирать в формате Prometheus с http://<FAP_METRICS_HOST>:<FAP_METRICS_PORT>/metrics
+Включается переменной FAP_METRICS=1
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from collections import defaultdict
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Callable
+
+ENABLED = os.environ.get("FAP_METRICS", "0") == "1"
+
+# Файл метрик и его ротация: при превышении MAX_BYTES файл переименовывается в .1, .2, ...
+MAX_BYTES = int(os.environ.get("FAP_METRICS_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUP_COUNT = int(os.environ.get("FAP_METRICS_BACKUPS", "5"))
+
+# Порт страницы /metrics для Prometheus (пусто - не запускать)
+METRICS_PORT = os.environ.get("FAP_METRICS_PORT", "")
+METRICS_HOST = os.environ.get("FAP_METRICS_HOST", "127.0.0.1")
+
+# Текущий прогон скрипта: Streamlit выполняет каждую сессию в своем потоке
+_current = threading.local()
+
+# Суммы по процессу для Prometheus
+_totals: Dict[str, Any] = {
+    'runs': defaultdict(int),
+    'run_seconds': defaultdict(float),
+    'calls': defaultdict(int),
+    'seconds': defaultdict(float),
+    'session_state_bytes': 0,
+    'session_state_max_bytes': 0
+}
+_logger: Optional[logging.Logger] = None
+_server: Optional[ThreadingHTTPServer] = None
+_server_attempted = False
+_lock = threading.Lock()
+
+def get_metrics_path() -> str:
+    """Путь к файлу метрик (FAP_METRICS_FILE или metrics.jsonl в корне проекта)"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    return os.environ.get("FAP_METRICS_FILE", os.path.join(project_root, "metrics.jsonl"))
+
+def _get_logger() -> logging.Logger:
+    """Логгер с ротацией файла (вызывать под _lock); RotatingFileHandler сам потокобезопасен"""
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("fap_run_metrics")
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+        handler = RotatingFileHandler(get_metrics_path(), maxBytes=MAX_BYTES,
+                                      backupCount=BACKUP_COUNT, encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _logger.addHandler(handler)
+    return _logger
+
+def approx_size(session_state) -> int:
+    """Примерный размер состояния сессии в байтах - по длине pickle каждого значения"""
+    total = 0
+    for key in list(session_state.keys()):
+        try:
+            value = session_state[key]
+        except KeyError:
+            continue
+        try:
+            total += len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            total += sys.getsizeof(value)
+    return total
+
+def timed(name: Optional[str] = None) -> Callable:
+    """Декоратор: время вызова функции добавляется к текущему прогону (вне прогона - не считается)"""
+    def decorator(func):
+        section = name or func.__name__
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = getattr(_current, 'run', None)
+            if run is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                run['seconds'][section] += time.perf_counter() - start
+                run['calls'][section] += 1
+        return wrapper
+    return decorator
+
+@contextmanager
+def script_run(kind: str, session_state=None):
+    """
+    Один прогон скрипта (kind: "app" - вся страница, "fragment" - перезапуск фрагмента)
+    Вложенный прогон (фрагмент при отрисовке всей страницы) не записывается отдельно
+    """
+    if not ENABLED or getattr(_current, 'run', None) is not None:
+        yield
+        return
+    
+    run = {'seconds': defaultdict(float), 'calls': defaultdict(int)}
+    _current.run = run
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.run = None
+        _record_run(kind, time.perf_counter() - start, run, session_state)
+
+def _record_run(kind: str, elapsed: float, run: Dict[str, Any], session_state) -> None:
+    state_bytes = approx_size(session_state) if session_state is not None else None
+    entry = {
+        'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'kind': kind,
+        'total_ms': round(elapsed * 1000, 2),
+        'sections_ms': {section: round(seconds * 1000, 2) for section, seconds in run['seconds'].items()},
+        'calls': dict(run['calls']),
+        'session_state_bytes': state_bytes
+    }
+    
+    with _lock:
+        _totals['runs'][kind] += 1
+        _totals['run_seconds'][kind] += elapsed
+        for section, seconds in run['seconds'].items():
+            _totals['seconds'][section] += seconds
+            _totals['calls'][section] += run['calls'][section]
+        if state_bytes is not None:
+            _totals['session_state_bytes'] = state_bytes
+            _totals['session_state_max_bytes'] = max(_totals['session_state_max_bytes'], state_bytes)
+        
+        try:
+            _get_logger().info(json.dumps(entry, ensure_ascii=False))
+        except OSError as e:
+            print(f"⚠️ Не удалось записать метрики в {get_metrics_path()}: {e}")
+
+def render_prometheus() -> str:
+    """Суммы по процессу в текстовом формате Prometheus"""
+    lines = []
+    
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+    
+    with _lock:
+        metric("fap_script_runs_total", "counter", "Script runs by kind (app or fragment)",
+               [(f'{{kind="{kind}"}}', count) for kind, count in sorted(_totals['runs'].items())])
+        metric("fap_script_run_seconds_total", "counter", "Wall time of script runs",
+               [(f'{{kind="{kind}"}}', round(seconds, 6)) for kind, seconds in sorted(_totals['run_seconds'].items())])
+        metric("fap_section_calls_total", "counter", "Calls of instrumented functions",
+               [(f'{{section="{section}"}}', count) for section, count in sorted(_totals['calls'].items())])
+        metric("fap_section_seconds_total", "counter", "Wall time spent in instrumented functions",
+               [(f'{{section="{section}"}}', round(seconds, 6)) for section, seconds in sorted(_totals['seconds'].items())])
+        metric("fap_session_state_bytes", "gauge", "Approximate st.session_state size of the last run",
+               [("", _totals['session_state_bytes'])])
+        metric("fap_session_state_max_bytes", "gauge", "Largest approximate st.session_state size seen",
+               [("", _totals['session_state_max_bytes'])])
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server() -> bool:
+    """Запустить страницу /metrics в фоновом потоке (один раз на процесс, если задан FAP_METRICS_PORT)"""
+    global _server, _server_attempted
+    
+    if not ENABLED or not METRICS_PORT:
+        return False
+    
+    with _lock:
+        # Порт мог быть занят (например, вторым процессом Streamlit) - не пытаемся на каждом прогоне
+        if _server_attempted:
+            return _server is not None
+        _server_attempted = True
+        try:
+            _server = ThreadingHTTPServer((METRICS_HOST, int(METRICS_PORT)), _MetricsHandler)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Не удалось запустить страницу метрик на порту {METRICS_PORT}: {e}")
+            return False
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="fap-metrics", daemon=True).start()
+    
+    print(f"📊 Метрики Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return True
\ No newline at end of file
@@ -0,0 +1,257 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/scoring.py
+"""
+Подсчет баллов за ответы
+calculate_partial_score - один ответ в исходном виде;
+score_batch - один вопрос сразу для множества попыток (пересчет сохраненных попыток),
+с NumPy - векторно по типу вопроса над массивами индексов вариантов
+"""
+from typing import List, Any
+
+from question_model import compile_question
+from exam_attempt import NOT_SELECTED
+
+# NumPy необязателен: без него пакетный подсчет идет по одному ответу
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def calculate_partial_score(question, user_answer):
+    """
+    Расчет частичных баллов для разных типов вопросов
+    Множества и карты правильных ответов берутся из скомпилированного вопроса (question_model)
+    """
+    question = compile_question(question)
+    
+    if question.type == "single_choice":
+        return 1.0 if user_answer == question.correct else 0.0
+    
+    elif question.type == "multiple_choice":
+        user_set = set(user_answer or [])
+        correct_set = question.correct_set
+        
+        if not user_set:
+            return 0.0
+        
+        correct_answers = len(user_set & correct_set)
+        wrong_answers = len(user_set - correct_set)
+        total_possible = len(correct_set)
+        
+        score = max(0, (correct_answers - wrong_answers)) / total_possible
+        return round(score, 2)
+    
+    elif question.type == "matching":
+        if not user_answer:
+            return 0.0
+        
+        correct_count = 0
+        total_pairs = len(question.correct_mapping)
+        
+        for left_item, correct_right in question.correct_mapping.items():
+            if user_answer.get(left_item) == correct_right:
+                correct_count += 1
+        
+        return round(correct_count / total_pairs, 2)
+    
+    elif question.type == "dropdown":
+        return 1.0 if user_answer == question.correct else 0.0
+    
+    elif question.type == "double_dropdown":
+        if not user_answer:
+            return 0.0
+        
+        correct_count = 0
+        total_subquestions = len(question.subquestion_correct)
+        
+        for subq_key, subq_correct in question.subquestion_correct:
+            if user_answer.get(subq_key) == subq_correct:
+                correct_count += 1
+        
+        return round(correct_count / total_subquestions, 2)
+    
+    elif question.type == "ordering":
+        if not user_answer:
+            return 0.0
+        
+        data = user_answer
+        user_sequence = []
+        for idx, item in enumerate(data["items"]):
+            user_sequence.append((data["user_order"][idx], item))
+        
+        user_sequence.sort()
+        user_order = [item for _, item in user_sequence]
+        correct_order = question.correct_order
+        
+        if len(user_order) != len(correct_order):
+            return 0.0
+        
+        correct_positions = 0
+        for i, item in enumerate(user_order):
+            if i in question.order_position.get(item, ()):
+                correct_positions += 1
+        
+        return round(correct_positions / len(correct_order), 2)
+    
+    return 0.0
+
+
+def _score_table(total: int):
+    """Баллы за k верных из total - с тем же округлением, что в calculate_partial_score"""
+    return np.array([round(k / total, 2) for k in range(total + 1)])
+
+def _batch_choice(question, answers, scores, rest):
+    """single_choice/dropdown: ответ -> индекс варианта, балл - по таблице верных индексов"""
+    ok = np.array([1.0 if option == question.correct else 0.0 for option in question.options] + [0.0])
+    rows, encoded = [], []
+    for row, answer in enumerate(answers):
+        if answer is None:
+            scores[row] = 1.0 if answer == question.correct else 0.0
+        elif answer in question.option_index:
+            rows.append(row)
+            encoded.append(question.option_index[answer])
+        else:
+            rest.append(row)
+    if rows:
+        scores[rows] = ok[np.array(encoded, dtype=np.int64)]
+
+def _batch_multiple(question, answers, scores, rest):
+    """multiple_choice: ответ -> битовая маска, верные/неверные - подсчетом битов"""
+    options = question.options
+    total = len(question.correct_set)
+    # Маска хранится в int64
+    if total == 0 or len(options) > 62 or len(set(options)) != len(options):
+        rest.extend(range(len(answers)))
+        return
+    
+    correct_mask = sum(1 << i for i, option in enumerate(options) if option in question.correct_set)
+    rows, masks = [], []
+    for row, answer in enumerate(answers):
+        if not answer:
+            scores[row] = 0.0
+        elif all(option in question.option_index for option in answer):
+            rows.append(row)
+            masks.append(sum(1 << question.option_index[option] for option in set(answer)))
+        else:
+            rest.append(row)
+    if not rows:
+        return
+    
+    masks = np.array(masks, dtype=np.int64)
+    hits = masks & correct_mask
+    misses = masks & ~correct_mask
+    correct_answers = sum((hits >> i) & 1 for i in range(len(options)))
+    wrong_answers = sum((misses >> i) & 1 for i in range(len(options)))
+    scores[rows] = _score_table(total)[np.maximum(0, correct_answers - wrong_answers)]
+
+def _batch_pairs(answers, scores, rest, columns):
+    """
+    matching/double_dropdown: columns - [(ключ, варианты, правильный ответ), ...]
+    Ответ -> матрица индексов вариантов, верные - выборкой из таблицы ok[столбец, индекс]
+    Индекс NOT_SELECTED (-1) попадает в последний столбец таблицы - "ответ не выбран"
+    """
+    width = max((len(options) for _, options, _ in columns), default=0) + 1
+    ok = np.zeros((len(columns), width), dtype=np.int64)
+    index_maps = []
+    for j, (_, options, correct) in enumerate(columns):
+        for i, option in enumerate(options):
+            ok[j, i] = option == correct
+        ok[j, -1] = correct is None
+        index_maps.append({option: i for i, option in reversed(list(enumerate(options)))})
+    
+    rows, encoded = [], []
+    for row, answer in enumerate(answers):
+        if not answer:
+            scores[row] = 0.0
+            continue
+        
+        encoded_row = []
+        for (key, _, _), index_map in zip(columns, index_maps):
+            value = answer.get(key)
+            if value is None:
+                encoded_row.append(NOT_SELECTED)
+            elif value in index_map:
+                encoded_row.append(index_map[value])
+            else:
+                break
+        else:
+            rows.append(row)
+            encoded.append(encoded_row)
+            continue
+        rest.append(row)
+    
+    if rows:
+        encoded = np.array(encoded, dtype=np.int64).reshape(len(rows), len(columns))
+        correct_count = ok[np.arange(len(columns)), encoded].sum(axis=1)
+        scores[rows] = _score_table(len(columns))[correct_count]
+
+def _batch_ordering(question, answers, scores, rest):
+    """
+    ordering: сортировка пар (номер, элемент) - через np.lexsort по строкам,
+    элементы заменены их рангом среди строк (порядок сравнения тот же)
+    """
+    correct_order = question.correct_order
+    length = len(correct_order)
+    if length == 0:
+        rest.extend(range(len(answers)))
+        return
+    
+    candidates = []
+    for row, answer in enumerate(answers):
+        if not answer:
+            scores[row] = 0.0
+        elif (len(answer["items"]) == length and len(answer["user_order"]) == length
+              and all(isinstance(order, int) for order in answer["user_order"])):
+            candidates.append(row)
+        else:
+            rest.append(row)
+    if not candidates:
+        return
+    
+    rank = {item: r for r, item in enumerate(sorted({item for row in candidates for item in answers[row]["items"]}))}
+    item_ranks = np.array([[rank[item] for item in answers[row]["items"]] for row in candidates], dtype=np.int64)
+    user_orders = np.array([answers[row]["user_order"] for row in candidates], dtype=np.int64)
+    correct_ranks = np.array([rank.get(item, -1) for item in correct_order], dtype=np.int64)
+    
+    permutation = np.lexsort((item_ranks, user_orders), axis=-1)
+    sorted_ranks = np.take_along_axis(item_ranks, permutation, axis=-1)
+    correct_positions = (sorted_ranks == correct_ranks).sum(axis=1)
+    scores[candidates] = _score_table(length)[correct_positions]
+
+def score_batch(question, answers: List[Any]) -> List[float]:
+    """
+    Баллы за один вопрос для многих ответов сразу (ответы - в исходном виде, как у calculate_partial_score)
+    С NumPy ответы кодируются в массивы индексов и считаются векторно; ответы, которые
+    нельзя закодировать без потерь (вариант удален из вопроса и т.п.), считаются по одному
+    """
+    question = compile_question(question)
+    if np is None:
+        return [calculate_partial_score(question, answer) for answer in answers]
+    
+    scores = np.zeros(len(answers))
+    rest: List[int] = []
+    
+    if question.type in ("single_choice", "dropdown"):
+        _batch_choice(question, answers, scores, rest)
+    elif question.type == "multiple_choice":
+        _batch_multiple(question, answers, scores, rest)
+    elif question.type == "matching":
+        mapping = question.correct_mapping
+        if mapping:
+            right_column = question['right_column']
+            _batch_pairs(answers, scores, rest, [(left, right_column, right) for left, right in mapping.items()])
+        else:
+            rest.extend(range(len(answers)))
+    elif question.type == "double_dropdown":
+        subquestions = question['subquestions']
+        keys = [subq['key'] for subq in subquestions]
+        if subquestions and len(set(keys)) == len(keys):
+            _batch_pairs(answers, scores, rest, [(subq['key'], subq['options'], subq['correct']) for subq in subquestions])
+        else:
+            rest.extend(range(len(answers)))
+    elif question.type == "ordering":
+        _batch_ordering(question, answers, scores, rest)
+    
+    for row in rest:
+        scores[row] = calculate_partial_score(question, answers[row])
+    
+    return scores.tolist()
@@ -0,0 +1,178 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/search_index.py
+"""
+Полнотекстовый поиск вопросов во всех темах для редактора
+Инвертированный индекс по триграммам: триграмма -> вопросы, в тексте которых она есть
+Триграммы находят и части слов, и слова с другим окончанием или опечаткой
+Индекс строится при первом поиске и дальше обновляется по одному вопросу
+при каждом сохранении темы (theme_loader.add_change_listener)
+"""
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Tuple
+
+from theme_loader import scan_theme_manifest, load_theme, get_theme_version, add_change_listener
+
+# Вес совпадения по полю: формулировка вопроса важнее вариантов и объяснения
+FIELD_WEIGHTS = {
+    'question': 1.0,
+    'category': 0.8,
+    'options': 0.6,
+    'explanation': 0.4
+}
+
+# Доля триграмм запроса, которую должен покрыть вопрос, чтобы попасть в выдачу
+MIN_SCORE = 0.4
+
+# Прибавка к баллу, если запрос целиком входит в формулировку вопроса
+EXACT_MATCH_BONUS = 0.5
+
+def normalize(text: str) -> str:
+    return " ".join(re.findall(r'\w+', str(text).lower().replace('ё', 'е')))
+
+def trigrams(text: str) -> set:
+    """Триграммы слов текста; слова дополняются пробелами, чтобы короткие слова тоже искались"""
+    found = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        found.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return found
+
+def question_fields(question: Dict) -> Dict[str, List[str]]:
+    """Тексты вопроса по полям индекса (None в JSON - пустое поле, а не слово "none")"""
+    options = list(question.get('options') or [])
+    options += (question.get('left_column') or []) + (question.get('right_column') or []) + (question.get('items') or [])
+    for subq in question.get('subquestions') or []:
+        options += [subq.get('text') or ''] + list(subq.get('options') or [])
+    return {
+        'question': [question.get('question') or ''],
+        'category': [question.get('category') or ''],
+        'options': [option for option in options if option is not None],
+        'explanation': [question.get('explanation') or '']
+    }
+
+class SearchIndex:
+    """Триграммный индекс; ключ вопроса - (theme_id, id вопроса)"""
+    
+    def __init__(self):
+        self.postings: Dict[str, Dict[Tuple[str, Any], float]] = defaultdict(dict)
+        self.documents: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+    
+    def add(self, key: Tuple[str, Any], question: Dict) -> None:
+        self.remove(key)
+        weights: Dict[str, float] = {}
+        for field, texts in question_fields(question).items():
+            for text in texts:
+                for trigram in trigrams(text):
+                    weights[trigram] = max(weights.get(trigram, 0.0), FIELD_WEIGHTS[field])
+        
+        for trigram, weight in weights.items():
+            self.postings[trigram][key] = weight
+        self.documents[key] = {
+            'trigrams': tuple(weights),
+            'question': question.get('question') or '',
+            'normalized': normalize(question.get('question') or ''),
+            'category': question.get('category') or '',
+            'type': question.get('type') or ''
+        }
+    
+    def remove(self, key: Tuple[str, Any]) -> None:
+        document = self.documents.pop(key, None)
+        if document is None:
+            return
+        for trigram in document['trigrams']:
+            posting = self.postings.get(trigram)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[trigram]
+    
+    def search(self, query: str, limit: int) -> List[Tuple[float, Tuple[str, Any]]]:
+        """(балл, ключ) лучших вопросов: доля триграмм запроса с весом поля + бонус за точное вхождение"""
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        
+        scores: Dict[Tuple[str, Any], float] = defaultdict(float)
+        for trigram in query_trigrams:
+            for key, weight in self.postings.get(trigram, {}).items():
+                scores[key] += weight
+        
+        normalized_query = normalize(query)
+        ranked = []
+        for key, score in scores.items():
+            score /= len(query_trigrams)
+            if score < MIN_SCORE:
+                continue
+            if normalized_query in self.documents[key]['normalized']:
+                score += EXACT_MATCH_BONUS
+            ranked.append((score, key))
+        
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return ranked[:limit]
+
+# Индекс на уровне процесса и версии проиндексированных тем
+_index = SearchIndex()
+_theme_versions: Dict[str, Any] = {}
+_theme_names: Dict[str, str] = {}
+_lock = threading.Lock()
+
+def _index_theme(theme_id: str) -> None:
+    """Проиндексировать тему целиком (вызывать под _lock)"""
+    for key in [key for key in _index.documents if key[0] == theme_id]:
+        _index.remove(key)
+    _theme_versions.pop(theme_id, None)
+    
+    theme_data = load_theme(theme_id)
+    if theme_data is None:
+        return
+    for question in theme_data.get('questions', []):
+        _index.add((theme_id, question.get('id')), question)
+    _theme_versions[theme_id] = get_theme_version(theme_id)
+
+def _sync_index() -> None:
+    """Переиндексировать темы, измененные в обход этого процесса (вызывать под _lock)"""
+    manifest = scan_theme_manifest()
+    for theme_id in [theme_id for theme_id in _theme_versions if theme_id not in manifest]:
+        for key in [key for key in _index.documents if key[0] == theme_id]:
+            _index.remove(key)
+        _theme_versions.pop(theme_id, None)
+    
+    for theme_id, info in manifest.items():
+        _theme_names[theme_id] = info.get('name', theme_id)
+        if _theme_versions.get(theme_id) != get_theme_version(theme_id):
+            _index_theme(theme_id)
+
+def _on_theme_changed(theme_id: str, record: Optional[Dict[str, Any]]) -> None:
+    """Правка темы в этом процессе: обновить один вопрос вместо переиндексации темы"""
+    with _lock:
+        if theme_id not in _theme_versions:
+            return
+        if record is None:
+            _index_theme(theme_id)
+            return
+        
+        if record['op'] == 'delete':
+            _index.remove((theme_id, record['id']))
+        else:
+            _index.add((theme_id, record['question'].get('id')), record['question'])
+        _theme_versions[theme_id] = get_theme_version(theme_id)
+
+add_change_listener(_on_theme_changed)
+
+def search_questions(query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Поиск вопросов во всех темах, от лучшего совпадения"""
+    with _lock:
+        _sync_index()
+        return [
+            {
+                'theme_id': key[0],
+                'theme_name': _theme_names.get(key[0], key[0]),
+                'question_id': key[1],
+                'question': _index.documents[key]['question'],
+                'category': _index.documents[key]['category'],
+                'type': _index.documents[key]['type'],
+                'score': round(score, 2)
+            }
+            for score, key in _index.search(query, limit)
+        ]
\ No newline at end of file
@@ -0,0 +1,309 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/theme_db.py
+"""
+Хранилище тем в SQLite - альтернатива папке themes/ с JSON-файлами
+Включается переменной окружения FAP_THEME_STORAGE=sqlite (см. theme_loader)
+"""
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from collections import Counter
+from typing import Dict, List, Any, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS themes (
+    id TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS questions (
+    pk INTEGER PRIMARY KEY AUTOINCREMENT,
+    theme_id TEXT NOT NULL REFERENCES themes(id) ON DELETE CASCADE,
+    question_id INTEGER,
+    type TEXT NOT NULL,
+    category TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_theme ON questions(theme_id);
+CREATE INDEX IF NOT EXISTS idx_questions_category ON questions(theme_id, category);
+CREATE INDEX IF NOT EXISTS idx_questions_type ON questions(theme_id, type);
+CREATE INDEX IF NOT EXISTS idx_questions_qid ON questions(theme_id, question_id);
+"""
+
+# Базы, для которых схема уже создана в этом процессе
+_initialized_paths = set()
+_init_lock = threading.Lock()
+
+# Манифест на уровне процесса: путь к базе -> {"versions", "data"}
+# Любая запись темы увеличивает ее версию, поэтому по версиям всех тем видно,
+# что агрегаты по вопросам нужно пересчитать
+_manifest_cache: Dict[str, Dict[str, Any]] = {}
+_manifest_lock = threading.Lock()
+
+class ThemeConflictError(Exception):
+    """Тему успели изменить после того, как ее загрузил сохраняющий"""
+
+def get_db_path() -> str:
+    """Путь к файлу базы (FAP_THEME_DB или themes.db в корне проекта)"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    return os.environ.get("FAP_THEME_DB", os.path.join(project_root, "themes.db"))
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Открыть соединение и при необходимости создать схему"""
+    db_path = db_path or get_db_path()
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.execute("PRAGMA foreign_keys = ON")
+    
+    with _init_lock:
+        if db_path not in _initialized_paths:
+            conn.executescript(SCHEMA)
+            _initialized_paths.add(db_path)
+    
+    return conn
+
+def _dump_question(question: Dict) -> str:
+    """Каноническая сериализация вопроса - по ней же ищем изменения при сохранении"""
+    return json.dumps(question, ensure_ascii=False, sort_keys=True)
+
+def _insert_questions(conn: sqlite3.Connection, theme_id: str, dumped: List[str]) -> None:
+    """Добавить вопросы в конец темы"""
+    rows = []
+    for data in dumped:
+        question = json.loads(data)
+        rows.append((theme_id, question.get('id'), question['type'], question.get('category'), data))
+    
+    conn.executemany(
+        "INSERT INTO questions (theme_id, question_id, type, category, data) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+
+def get_theme_versions() -> Dict[str, int]:
+    """Версии всех тем - дешевая проверка, что тему нужно перечитать"""
+    with closing(connect()) as conn:
+        return dict(conn.execute("SELECT id, version FROM themes"))
+
+def get_theme_version(theme_id: str) -> Optional[int]:
+    """Версия одной темы; None - темы нет"""
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT version FROM themes WHERE id = ?", (theme_id,)).fetchone()
+    return row[0] if row else None
+
+def load_theme(theme_id: str) -> Optional[Dict[str, Any]]:
+    """Загрузить тему целиком в том же виде, что и JSON-файл"""
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT meta FROM themes WHERE id = ?", (theme_id,)).fetchone()
+        if row is None:
+            return None
+        
+        theme_data = json.loads(row[0])
+        theme_data['questions'] = [
+            json.loads(data) for (data,) in conn.execute(
+                "SELECT data FROM questions WHERE theme_id = ? ORDER BY pk", (theme_id,)
+            )
+        ]
+    
+    return theme_data
+
+def save_theme(theme_id: str, theme_data: Dict, expected_version: Optional[int] = None) -> None:
+    """
+    Сохранить тему, записывая только изменившиеся вопросы
+    
+    Редактор добавляет вопросы в конец и удаляет по одному, поэтому обычно
+    это одна вставка или одно удаление. Если порядок оставшихся вопросов
+    изменился - вопросы темы перезаписываются целиком.
+    
+    При expected_version версия темы сверяется внутри транзакции (BEGIN IMMEDIATE),
+    при расхождении - ThemeConflictError
+    """
+    meta = {key: value for key, value in theme_data.items() if key != 'questions'}
+    new_dumped = [_dump_question(q) for q in theme_data.get('questions', [])]
+    
+    with closing(connect()) as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if expected_version is not None:
+            row = conn.execute("SELECT version FROM themes WHERE id = ?", (theme_id,)).fetchone()
+            if row is None or row[0] != expected_version:
+                raise ThemeConflictError(f"версия темы {row[0] if row else None}, ожидалась {expected_version}")
+        
+        conn.execute(
+            "INSERT INTO themes (id, meta, version) VALUES (?, ?, 1) "
+            "ON CONFLICT(id) DO UPDATE SET meta = excluded.meta, version = version + 1",
+            (theme_id, json.dumps(meta, ensure_ascii=False))
+        )
+        
+        existing = conn.execute(
+            "SELECT pk, data FROM questions WHERE theme_id = ? ORDER BY pk", (theme_id,)
+        ).fetchall()
+        
+        # Сопоставляем старые строки с новыми вопросами по содержимому
+        remaining = Counter(new_dumped)
+        kept, to_delete = [], []
+        for pk, data in existing:
+            if remaining[data] > 0:
+                remaining[data] -= 1
+                kept.append(data)
+            else:
+                to_delete.append((pk,))
+        
+        if kept == new_dumped[:len(kept)]:
+            conn.executemany("DELETE FROM questions WHERE pk = ?", to_delete)
+            _insert_questions(conn, theme_id, new_dumped[len(kept):])
+        else:
+            conn.execute("DELETE FROM questions WHERE theme_id = ?", (theme_id,))
+            _insert_questions(conn, theme_id, new_dumped)
+
+def apply_edit(theme_id: str, record: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Применить правку одного вопроса (см. theme_journal.apply_record) в одной транзакции
+    Возвращает (версия до правки, версия после) - по ним обновляется кэш в памяти
+    
+    Параллельные правки разных редакторов не затирают друг друга: каждая
+    меняет только свою строку. Если id добавляемого вопроса уже занят,
+    вопрос получает следующий свободный id.
+    """
+    with closing(connect()) as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT version FROM themes WHERE id = ?", (theme_id,)).fetchone()
+        if row is None:
+            raise KeyError(theme_id)
+        version = row[0]
+        
+        if record['op'] == 'delete':
+            conn.execute(
+                "DELETE FROM questions WHERE pk = (SELECT pk FROM questions "
+                "WHERE theme_id = ? AND question_id = ? ORDER BY pk LIMIT 1)",
+                (theme_id, record['id'])
+            )
+        else:
+            question = record['question']
+            taken = conn.execute(
+                "SELECT 1 FROM questions WHERE theme_id = ? AND question_id = ?", (theme_id, question.get('id'))
+            ).fetchone()
+            
+            if taken and record['op'] == 'update':
+                conn.execute(
+                    "UPDATE questions SET type = ?, category = ?, data = ? WHERE theme_id = ? AND question_id = ?",
+                    (question['type'], question.get('category'), _dump_question(question), theme_id, question.get('id'))
+                )
+            else:
+                if taken:
+                    (max_id,) = conn.execute(
+                        "SELECT MAX(question_id) FROM questions WHERE theme_id = ?", (theme_id,)
+                    ).fetchone()
+                    question['id'] = (max_id or 0) + 1
+                _insert_questions(conn, theme_id, [_dump_question(question)])
+        
+        conn.execute("UPDATE themes SET version = version + 1 WHERE id = ?", (theme_id,))
+    
+    return version, version + 1
+
+def import_themes(themes: Dict[str, Any]) -> None:
+    """Полностью перезаписать указанные темы (используется при миграции)"""
+    with closing(connect()) as conn, conn:
+        for theme_id, theme_data in themes.items():
+            meta = {key: value for key, value in theme_data.items() if key != 'questions'}
+            conn.execute("DELETE FROM questions WHERE theme_id = ?", (theme_id,))
+            conn.execute(
+                "INSERT INTO themes (id, meta, version) VALUES (?, ?, 1) "
+                "ON CONFLICT(id) DO UPDATE SET meta = excluded.meta, version = version + 1",
+                (theme_id, json.dumps(meta, ensure_ascii=False))
+            )
+            _insert_questions(conn, theme_id, [_dump_question(q) for q in theme_data.get('questions', [])])
+
+def get_manifest() -> Dict[str, Dict[str, Any]]:
+    """
+    Метаданные всех тем без загрузки вопросов (аналог themes/.manifest.json)
+    Агрегаты пересчитываются, только если с прошлого вызова изменилась версия какой-нибудь темы
+    """
+    db_path = get_db_path()
+    with closing(connect(db_path)) as conn:
+        versions = dict(conn.execute("SELECT id, version FROM themes"))
+        with _manifest_lock:
+            cached = _manifest_cache.get(db_path)
+            if cached is not None and cached['versions'] == versions:
+                return dict(cached['data'])
+        
+        manifest = {}
+        for theme_id, meta in conn.execute("SELECT id, meta FROM themes ORDER BY id"):
+            meta = json.loads(meta)
+            manifest[theme_id] = {
+                'name': meta.get('name', ''),
+                'description': meta.get('description', ''),
+                'question_count': 0,
+                'categories': {},
+                'types': {}
+            }
+        
+        for theme_id, category, count in conn.execute(
+            "SELECT theme_id, category, COUNT(*) FROM questions GROUP BY theme_id, category"
+        ):
+            if theme_id not in manifest:
+                continue
+            manifest[theme_id]['question_count'] += count
+            if category:
+                manifest[theme_id]['categories'][category] = count
+        
+        for theme_id, question_type, count in conn.execute(
+            "SELECT theme_id, type, COUNT(*) FROM questions GROUP BY theme_id, type"
+        ):
+            if theme_id in manifest:
+                manifest[theme_id]['types'][question_type] = count
+    
+    with _manifest_lock:
+        _manifest_cache[db_path] = {'versions': versions, 'data': manifest}
+    return dict(manifest)
+
+def get_categories(theme_id: str) -> List[str]:
+    """Категории темы - запрос по индексу (theme_id, category)"""
+    with closing(connect()) as conn:
+        return [category for (category,) in conn.execute(
+            "SELECT DISTINCT category FROM questions "
+            "WHERE theme_id = ? AND category IS NOT NULL AND category != '' ORDER BY category",
+            (theme_id,)
+        )]
+
+def get_questions(theme_id: str, question_ids: List[Any]) -> List[Dict]:
+    """Вопросы темы по id (в порядке question_ids) - запрос по индексу (theme_id, question_id)"""
+    if not question_ids:
+        return []
+    
+    placeholders = ", ".join("?" for _ in question_ids)
+    with closing(connect()) as conn:
+        by_id: Dict[Any, Dict] = {}
+        for question_id, data in conn.execute(
+            f"SELECT question_id, data FROM questions WHERE theme_id = ? AND question_id IN ({placeholders}) "
+            "ORDER BY pk",
+            [theme_id, *question_ids]
+        ):
+            by_id.setdefault(question_id, json.loads(data))
+    
+    return [by_id[qid] for qid in question_ids if qid in by_id]
+
+def get_question_ids(theme_id: str, category: Optional[str] = None) -> List[Any]:
+    """id вопросов темы (опционально - только одной категории) без чтения самих вопросов"""
+    query = "SELECT DISTINCT question_id FROM questions WHERE theme_id = ?"
+    params: List[Any] = [theme_id]
+    if category is not None:
+        query += " AND category = ?"
+        params.append(category)
+    
+    with closing(connect()) as conn:
+        return [question_id for (question_id,) in conn.execute(query + " ORDER BY question_id", params)]
+
+def get_question_ids_by_category(theme_id: str, categories: List[str]) -> Dict[str, List[Any]]:
+    """id вопросов нескольких категорий одним запросом по индексу (theme_id, category)"""
+    result: Dict[str, List[Any]] = {category: [] for category in categories}
+    if not categories:
+        return result
+    
+    placeholders = ", ".join("?" for _ in categories)
+    with closing(connect()) as conn:
+        for category, question_id in conn.execute(
+            f"SELECT DISTINCT category, question_id FROM questions "
+            f"WHERE theme_id = ? AND category IN ({placeholders}) ORDER BY question_id",
+            [theme_id, *categories]
+        ):
+            result[category].append(question_id)
+    return result
\ No newline at end of file
@@ -0,0 +1,99 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/theme_journal.py
+"""
+Журнал правок темы: themes/<theme_id>.journal, по одной JSON-записи на строку
+Добавление, изменение и удаление вопроса дописывают короткую запись вместо
+перезаписи всего файла темы; при загрузке журнал применяется поверх JSON
+"""
+import os
+import json
+from datetime import datetime
+from typing import Dict, List, Any
+
+def get_journal_path(theme_file: str) -> str:
+    """Журнал лежит рядом с файлом темы: fap297.json -> fap297.journal"""
+    return os.path.splitext(theme_file)[0] + ".journal"
+
+def read_journal(journal_path: str) -> List[Dict[str, Any]]:
+    """
+    Прочитать записи журнала
+    Оборванная последняя строка (процесс упал во время записи) пропускается
+    """
+    if not os.path.exists(journal_path):
+        return []
+    
+    records = []
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"⚠️ Пропущена поврежденная запись журнала {journal_path}:{line_number}")
+    return records
+
+def read_new_records(f) -> List[Dict[str, Any]]:
+    """
+    Дочитать записи из журнала, открытого в двоичном режиме, с текущей позиции
+    Недописанная последняя строка не читается - позиция остается перед ней
+    """
+    records = []
+    while True:
+        start = f.tell()
+        line = f.readline()
+        if not line:
+            break
+        if not line.endswith(b"\n"):
+            f.seek(start)
+            break
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            print(f"⚠️ Пропущена поврежденная запись журнала {f.name} (смещение {start})")
+    return records
+
+def append_record(journal_path: str, record: Dict[str, Any], sync: bool = True) -> None:
+    """
+    Дописать запись одной операцией write в конец журнала
+    sync=False - без fsync (для данных, потеря последних записей которых не страшна)
+    """
+    record = dict(record, ts=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+    
+    fd = os.open(journal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def apply_record(theme_data: Dict, record: Dict[str, Any]) -> None:
+    """
+    Применить запись к теме на месте
+    Операции идемпотентны: повторное применение после сжатия журнала ничего не ломает
+    """
+    questions = theme_data.setdefault('questions', [])
+    
+    if record['op'] in ('add', 'update'):
+        question = record['question']
+        for i, existing in enumerate(questions):
+            if existing.get('id') == question.get('id'):
+                questions[i] = question
+                return
+        questions.append(question)
+    
+    elif record['op'] == 'delete':
+        for i, existing in enumerate(questions):
+            if existing.get('id') == record['id']:
+                questions.pop(i)
+                return
+
+def count_records(journal_path: str) -> int:
+    """Количество записей в журнале (для решения о сжатии)"""
+    if not os.path.exists(journal_path):
+        return 0
+    with open(journal_path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
\ No newline at end of file
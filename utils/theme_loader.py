@@ -5,73 +5,1103 @@
 import os
 import json
 import glob
-from typing import Dict, List, Any
+import pickle
+import hashlib
+import time
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Set, Callable, Tuple
+
+import theme_db
+import offset_index
+import theme_journal
+from file_utils import atomic_write, file_lock
+from theme_watcher import ThemeWatcher
+from question_model import CompiledQuestion, compile_question
+
+# Быстрый JSON-декодер, если установлен
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Хранилище тем: "json" (папка themes/) или "sqlite" (см. theme_db)
+STORAGE_BACKEND = os.environ.get("FAP_THEME_STORAGE", "json")
+
+# Параллельная загрузка файлов тем: число воркеров (0 или 1 - последовательно)
+# и тип пула: "thread" или "process"
+LOAD_WORKERS = int(os.environ.get("FAP_THEME_WORKERS", "0"))
+LOAD_POOL = os.environ.get("FAP_THEME_POOL", "thread")
+
+# Наблюдение за папкой themes/ (см. start_theme_watcher): пока оно работает,
+# кэш считается актуальным без os.stat - изменения приходят событиями
+WATCH_THEMES = os.environ.get("FAP_THEME_WATCH", "0") == "1"
+_watcher: Optional[ThemeWatcher] = None
+_watched_files: Set[str] = set()
+
+# Журнал правок (см. theme_journal): add/update/delete_question дописывают запись
+# в themes/<theme_id>.journal вместо перезаписи файла темы; после
+# JOURNAL_COMPACT_RECORDS записей журнал сжимается обратно в JSON
+JOURNAL_MODE = os.environ.get("FAP_THEME_JOURNAL", "0") == "1"
+JOURNAL_COMPACT_RECORDS = int(os.environ.get("FAP_THEME_JOURNAL_COMPACT", "50"))
+
+# Сигнатура темы вместе с журналом - совместима по полям с os.stat_result
+_ThemeStat = namedtuple('_ThemeStat', ['st_mtime_ns', 'st_size'])
+
+# Кэш тем на уровне процесса: путь к файлу -> {"mtime", "size", "hash", "theme_id", "data", "index"}
+# index - инвертированные индексы по категориям и типам (см. build_question_index)
+# Общий для всех сессий Streamlit, поэтому доступ защищен блокировкой
+_theme_cache: Dict[str, Dict[str, Any]] = {}
+_cache_lock = threading.Lock()
+
+# Версия формата снимка - увеличить при изменении структуры данных
+SNAPSHOT_VERSION = 1
+
+# Кэш тем из SQLite: theme_id -> {"version", "data", "index"}
+_db_cache: Dict[str, Dict[str, Any]] = {}
+
+# Индексы смещений вопросов: theme_id -> {"mtime", "size", "offsets", "question_index"}
+_offset_cache: Dict[str, Dict[str, Any]] = {}
+
+# Скомпилированные вопросы (см. question_model): theme_id -> {"version", "questions": {id -> CompiledQuestion}}
+# Вопрос компилируется при первом чтении и живет, пока не изменится версия темы
+_compiled_cache: Dict[str, Dict[str, Any]] = {}
+
+# Хэши содержимого тем (см. get_theme_content_hash): путь к файлу -> (версия, хэш)
+_content_hashes: Dict[str, Tuple[str, str]] = {}
+
+# Подписчики на правки тем в этом процессе (поисковый индекс и т.п.): callback(theme_id, record)
+# record - правка вопроса (add/update/delete) или None, если тема сохранена целиком
+_change_listeners: List[Callable[[str, Optional[Dict[str, Any]]], None]] = []
+
+# Манифест: theme_id -> {"name", "description", "question_count", "categories", "mtime", "size"}
+# Хранится в themes/.manifest.json, в памяти - вместе с mtime самого файла манифеста
+_manifest_cache: Dict[str, Any] = {'mtime': None, 'data': {}}
+
+def get_themes_dir() -> str:
+    """Получить абсолютный путь к папке themes"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    return os.path.join(project_root, "themes")
+
+def get_snapshot_path(theme_id: str) -> str:
+    """Путь к бинарному снимку темы (.cache/snapshots/<theme_id>.pickle)"""
+    project_root = os.path.dirname(get_themes_dir())
+    return os.path.join(project_root, ".cache", "snapshots", f"{theme_id}.pickle")
+
+def get_offset_index_path(theme_id: str) -> str:
+    """Путь к индексу смещений вопросов темы (.cache/offsets/<theme_id>.json)"""
+    project_root = os.path.dirname(get_themes_dir())
+    return os.path.join(project_root, ".cache", "offsets", f"{theme_id}.json")
+
+def get_manifest_path() -> str:
+    """Путь к манифесту тем (скрытый файл, чтобы не попадать в glob *.json)"""
+    return os.path.join(get_themes_dir(), ".manifest.json")
+
+def _theme_id_from_path(theme_file: str) -> str:
+    """Извлекаем ID темы из имени файла (fap297.json -> fap297)"""
+    return os.path.basename(theme_file).replace('.json', '')
+
+def _content_hash(raw: bytes) -> str:
+    """Хэш содержимого файла темы для сверки со снимком"""
+    return hashlib.sha1(raw).hexdigest()
+
+def _theme_stat(theme_file: str):
+    """os.stat файла темы с учетом журнала: дописанная запись меняет сигнатуру"""
+    stat = os.stat(theme_file)
+    try:
+        journal_stat = os.stat(theme_journal.get_journal_path(theme_file))
+    except OSError:
+        return stat
+    return _ThemeStat(max(stat.st_mtime_ns, journal_stat.st_mtime_ns), stat.st_size + journal_stat.st_size)
+
+def _read_snapshot(theme_id: str) -> Optional[Dict[str, Any]]:
+    """Загрузить снимок темы: {"hash", "data"}. При любой ошибке - None"""
+    snapshot_path = get_snapshot_path(theme_id)
+    if not os.path.exists(snapshot_path):
+        return None
+    
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return None
+        return snapshot
+    except Exception as e:
+        print(f"⚠️ Снимок темы {theme_id} поврежден и будет пересоздан: {e}")
+        return None
+
+def _write_snapshot(theme_id: str, content_hash: str, theme_data: Dict) -> None:
+    """Записать снимок темы"""
+    snapshot = {'version': SNAPSHOT_VERSION, 'hash': content_hash, 'data': theme_data}
+    try:
+        atomic_write(get_snapshot_path(theme_id), pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить снимок темы {theme_id}: {e}")
+
+def _load_theme_file(theme_file: str) -> Dict[str, Any]:
+    """
+    Прочитать один файл темы
+    Если хэш содержимого совпадает со снимком - берем готовые данные без json.load,
+    затем поверх применяются записи журнала правок
+    
+    Функция уровня модуля без обращения к кэшу - ее можно запускать в пуле процессов
+    """
+    start_time = time.perf_counter()
+    stat = _theme_stat(theme_file)
+    with open(theme_file, 'rb') as f:
+        raw = f.read()
+    
+    content_hash = _content_hash(raw)
+    theme_id = _theme_id_from_path(theme_file)
+    
+    snapshot = _read_snapshot(theme_id)
+    from_snapshot = snapshot is not None and snapshot['hash'] == content_hash
+    if from_snapshot:
+        theme_data = snapshot['data']
+    else:
+        theme_data = _json_loads(raw)
+        _write_snapshot(theme_id, content_hash, theme_data)
+    
+    for record in theme_journal.read_journal(theme_journal.get_journal_path(theme_file)):
+        theme_journal.apply_record(theme_data, record)
+    
+    return {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'hash': content_hash,
+        'theme_id': theme_id,
+        'data': theme_data,
+        'index': build_question_index(theme_data.get('questions', [])),
+        'from_snapshot': from_snapshot,
+        'load_time': time.perf_counter() - start_time
+    }
+
+def build_question_index(questions: List[Dict]) -> Dict[str, Any]:
+    """
+    Инвертированные индексы темы: категория/тип -> позиции вопросов, плюс счетчики
+    и id вопроса на каждой позиции
+    Подходит и для полных вопросов, и для записей индекса смещений
+    """
+    by_category: Dict[str, List[int]] = {}
+    by_type: Dict[str, List[int]] = {}
+    by_id: Dict[Any, int] = {}
+    
+    for position, question in enumerate(questions):
+        if question.get('category'):
+            by_category.setdefault(question['category'], []).append(position)
+        by_type.setdefault(question.get('type'), []).append(position)
+        by_id.setdefault(question.get('id'), position)
+    
+    return {
+        'by_category': by_category,
+        'by_type': by_type,
+        'by_id': by_id,
+        'ids': [question.get('id') for question in questions],
+        'category_counts': {category: len(positions) for category, positions in by_category.items()},
+        'type_counts': {question_type: len(positions) for question_type, positions in by_type.items()},
+        'total': len(questions)
+    }
+
+def _report_loaded(theme_file: str, entry: Dict[str, Any]) -> None:
+    """Сообщить в лог о загрузке файла и ее времени"""
+    source = "снимок" if entry['from_snapshot'] else "JSON"
+    print(f"✅ Загружена тема: {entry['data'].get('name', entry['theme_id'])} "
+          f"({source}, {entry['load_time'] * 1000:.1f} мс)")
+
+def _load_theme_files(theme_files: List[str]) -> Dict[str, Any]:
+    """
+    Загрузить несколько файлов тем, при LOAD_WORKERS > 1 - параллельно
+    Возвращает путь -> запись кэша или исключение (битый файл не прерывает загрузку остальных)
+    """
+    results: Dict[str, Any] = {}
+    
+    if LOAD_WORKERS <= 1 or len(theme_files) <= 1:
+        for theme_file in theme_files:
+            try:
+                results[theme_file] = _load_theme_file(theme_file)
+            except Exception as e:
+                results[theme_file] = e
+        return results
+    
+    pool_class = ProcessPoolExecutor if LOAD_POOL == "process" else ThreadPoolExecutor
+    with pool_class(max_workers=LOAD_WORKERS) as pool:
+        futures = {theme_file: pool.submit(_load_theme_file, theme_file) for theme_file in theme_files}
+        for theme_file, future in futures.items():
+            try:
+                results[theme_file] = future.result()
+            except Exception as e:
+                results[theme_file] = e
+    
+    return results
+
+def _is_fresh(entry: Optional[Dict[str, Any]], stat) -> bool:
+    """Запись кэша/манифеста соответствует текущему файлу"""
+    return (entry is not None and entry.get('mtime') == stat.st_mtime_ns
+            and entry.get('size') == stat.st_size)
+
+def _watching() -> bool:
+    return _watcher is not None and _watcher.is_alive()
+
+def _list_theme_files() -> List[str]:
+    """Файлы тем (вызывать под _cache_lock): под наблюдением - без обращения к диску"""
+    if _watching():
+        return sorted(_watched_files)
+    return sorted(glob.glob(os.path.join(get_themes_dir(), "*.json")))
+
+def _is_current(entry: Optional[Dict[str, Any]], theme_file: str) -> bool:
+    """Запись актуальна: под наблюдением - просто есть в кэше, иначе сверка с os.stat"""
+    if _watching():
+        return entry is not None
+    return _is_fresh(entry, _theme_stat(theme_file))
+
+def _get_cached_theme(theme_file: str) -> Dict[str, Any]:
+    """
+    Запись кэша для файла темы (вызывать под _cache_lock)
+    Файл перечитывается, только если изменились его mtime или размер
+    """
+    cached = _theme_cache.get(theme_file)
+    
+    if not _is_current(cached, theme_file):
+        cached = _load_theme_file(theme_file)
+        _report_loaded(theme_file, cached)
+        _theme_cache[theme_file] = cached
+    
+    return cached
+
+def _use_sqlite() -> bool:
+    return STORAGE_BACKEND == "sqlite"
 
 def scan_themes() -> Dict[str, Any]:
+    """
+    Загружает все темы из текущего хранилища
+    Возвращает словарь с темами
+    """
+    if _use_sqlite():
+        return _scan_sqlite_themes()
+    return _scan_json_themes()
+
+def _get_cached_db_theme(theme_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """Тема из SQLite с кэшированием по версии (вызывать под _cache_lock)"""
+    cached = _db_cache.get(theme_id)
+    if cached is None or cached['version'] != version:
+        theme_data = theme_db.load_theme(theme_id)
+        if theme_data is None:
+            return None
+        cached = {
+            'version': version,
+            'data': theme_data,
+            'index': build_question_index(theme_data.get('questions', []))
+        }
+        _db_cache[theme_id] = cached
+        print(f"✅ Загружена тема: {theme_data.get('name', theme_id)}")
+    
+    return cached['data']
+
+def _scan_sqlite_themes() -> Dict[str, Any]:
+    """Загрузка тем из SQLite: перечитываются только темы с изменившейся версией"""
+    themes = {}
+    
+    with _cache_lock:
+        versions = theme_db.get_theme_versions()
+        
+        for theme_id in list(_db_cache):
+            if theme_id not in versions:
+                del _db_cache[theme_id]
+        
+        for theme_id, version in versions.items():
+            theme_data = _get_cached_db_theme(theme_id, version)
+            if theme_data is not None:
+                themes[theme_id] = theme_data
+    
+    return themes
+
+def _scan_json_themes() -> Dict[str, Any]:
     """
     Сканирует папку themes/ и загружает все .json файлы как темы
     Возвращает словарь с темами
+    
+    Результат кэшируется на уровне процесса: при повторном вызове для каждого
+    файла выполняется только os.stat, а заново читаются лишь файлы,
+    у которых изменились mtime или размер.
+    
+    На холодном старте используются снимки .cache/snapshots/*.pickle:
+    файлы, чей хэш содержимого совпал со снимком, не парсятся вовсе.
+    Изменившиеся файлы загружаются пулом при FAP_THEME_WORKERS > 1.
     """
     themes = {}
     
-    # Получаем абсолютный путь к папке themes
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(current_dir)
-    themes_dir = os.path.join(project_root, "themes")
+    with _cache_lock:
+        theme_files = _list_theme_files()
+        
+        # Удаляем из кэша темы, файлы которых исчезли
+        for cached_path in list(_theme_cache):
+            if cached_path not in theme_files:
+                del _theme_cache[cached_path]
+        
+        stale_files = []
+        for theme_file in theme_files:
+            try:
+                if not _is_current(_theme_cache.get(theme_file), theme_file):
+                    stale_files.append(theme_file)
+            except OSError:
+                stale_files.append(theme_file)
+        
+        for theme_file, result in _load_theme_files(stale_files).items():
+            if isinstance(result, Exception):
+                # Битый файл не должен оставаться в кэше со старым содержимым
+                _theme_cache.pop(theme_file, None)
+                print(f"❌ Ошибка загрузки темы {theme_file}: {result}")
+            else:
+                _report_loaded(theme_file, result)
+                _theme_cache[theme_file] = result
+        
+        for theme_file in theme_files:
+            cached = _theme_cache.get(theme_file)
+            if cached is not None:
+                # Добавляем тему в словарь
+                themes[cached['theme_id']] = cached['data']
     
-    print(f"🔍 Ищем темы в папке: {themes_dir}")
+    return themes
+
+def load_theme(theme_id: str) -> Optional[Dict[str, Any]]:
+    """Загрузить одну тему целиком (через тот же кэш, что и scan_themes)"""
+    if _use_sqlite():
+        version = theme_db.get_theme_versions().get(theme_id)
+        if version is None:
+            return None
+        with _cache_lock:
+            return _get_cached_db_theme(theme_id, version)
     
-    theme_files = glob.glob(os.path.join(themes_dir, "*.json"))
-    print(f"📁 Найдено файлов: {theme_files}")
+    theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+    if not os.path.exists(theme_file):
+        return None
     
-    for theme_file in theme_files:
+    with _cache_lock:
         try:
-            with open(theme_file, 'r', encoding='utf-8') as f:
-                theme_data = json.load(f)
-            
-            # Извлекаем ID темы из имени файла (fap297.json -> fap297)
-            theme_id = os.path.basename(theme_file).replace('.json', '')
-            
-            # Добавляем тему в словарь
-            themes[theme_id] = theme_data
-            print(f"✅ Загружена тема: {theme_data.get('name', theme_id)}")
-            
+            return _get_cached_theme(theme_file)['data']
         except Exception as e:
+            _theme_cache.pop(theme_file, None)
             print(f"❌ Ошибка загрузки темы {theme_file}: {e}")
+            return None
+
+def _get_offset_index(theme_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Индекс смещений вопросов темы (вызывать под _cache_lock)
+    Пересобирается, если файл темы изменился в обход save_theme
+    Пока у темы есть журнал правок, индекса нет - часть вопросов живет только в журнале
+    """
+    theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+    index = _offset_cache.get(theme_id)
+    if index is not None and _watching():
+        return index
     
-    return themes
+    if os.path.exists(theme_journal.get_journal_path(theme_file)):
+        return None
+    
+    stat = os.stat(theme_file)
+    if not _is_fresh(index, stat):
+        index = offset_index.read_index(get_offset_index_path(theme_id))
+        if not _is_fresh(index, stat):
+            with open(theme_file, 'rb') as f:
+                offsets = offset_index.build_offsets(f.read())
+            if offsets is None:
+                return None
+            index = offset_index.write_index(
+                get_offset_index_path(theme_id), stat.st_mtime_ns, stat.st_size, offsets
+            )
+        index['question_index'] = build_question_index(index['offsets'])
+        _offset_cache[theme_id] = index
+    
+    return index
+
+def _get_offset_index_safe(theme_id: str) -> Optional[Dict[str, Any]]:
+    """Индекс смещений или None, если его не удалось построить"""
+    with _cache_lock:
+        try:
+            return _get_offset_index(theme_id)
+        except Exception as e:
+            print(f"⚠️ Не удалось построить индекс смещений темы {theme_id}: {e}")
+            return None
+
+def _read_indexed_questions(theme_id: str, entries: List[Dict[str, Any]]) -> Optional[List[Dict]]:
+    """Прочитать вопросы по записям индекса; None - если файл успел измениться"""
+    theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+    try:
+        return offset_index.read_questions(theme_file, entries)
+    except Exception as e:
+        print(f"⚠️ Индекс смещений темы {theme_id} устарел, читаем тему целиком: {e}")
+        with _cache_lock:
+            _offset_cache.pop(theme_id, None)
+        return None
+
+def _compile_questions(theme_id: str, version: Any, questions: List[Dict]) -> List[CompiledQuestion]:
+    """Скомпилировать вопросы темы, переиспользуя уже скомпилированные для этой версии"""
+    with _cache_lock:
+        bank = _compiled_cache.get(theme_id)
+        if bank is None or bank['version'] != version:
+            bank = {'version': version, 'questions': {}}
+            _compiled_cache[theme_id] = bank
+        
+        compiled = []
+        for question in questions:
+            compiled_question = bank['questions'].get(question.get('id'))
+            if compiled_question is None:
+                compiled_question = compile_question(question)
+                bank['questions'][compiled_question.id] = compiled_question
+            compiled.append(compiled_question)
+    
+    return compiled
+
+def _get_compiled_by_ids(theme_id: str, version: Any, question_ids: List[Any]) -> Optional[List[CompiledQuestion]]:
+    """Вопросы из уже скомпилированных без чтения темы; None - если каких-то еще нет"""
+    with _cache_lock:
+        bank = _compiled_cache.get(theme_id)
+        if bank is None or bank['version'] != version:
+            return None
+        if not all(qid in bank['questions'] for qid in question_ids):
+            return None
+        return [bank['questions'][qid] for qid in question_ids]
+
+def get_questions_by_ids(theme_id: str, question_ids: List[Any]) -> List[CompiledQuestion]:
+    """
+    Получить скомпилированные вопросы темы по их id (в порядке question_ids)
+    Читаются только нужные вопросы - через индекс смещений или запрос к SQLite,
+    а уже скомпилированные для текущей версии темы не читаются вовсе
+    """
+    if _use_sqlite():
+        version = theme_db.get_theme_versions().get(theme_id)
+        compiled = _get_compiled_by_ids(theme_id, version, question_ids)
+        if compiled is not None:
+            return compiled
+        return _compile_questions(theme_id, version, theme_db.get_questions(theme_id, question_ids))
+    
+    index = _get_offset_index_safe(theme_id)
+    if index is not None:
+        version = _version_of(index)
+        compiled = _get_compiled_by_ids(theme_id, version, question_ids)
+        if compiled is not None:
+            return compiled
+        
+        by_id = index['question_index']['by_id']
+        questions = _read_indexed_questions(
+            theme_id, [index['offsets'][by_id[qid]] for qid in question_ids if qid in by_id]
+        )
+        if questions is not None:
+            return _compile_questions(theme_id, version, questions)
+    
+    theme_data = load_theme(theme_id)
+    if theme_data is None:
+        return []
+    by_id = get_theme_index(theme_id)['by_id']
+    return _compile_questions(
+        theme_id, get_theme_version(theme_id),
+        [theme_data['questions'][by_id[qid]] for qid in question_ids if qid in by_id]
+    )
+
+def _build_manifest_entry(theme_data: Dict, question_index: Dict[str, Any]) -> Dict[str, Any]:
+    """Метаданные темы для страницы выбора - без самих вопросов"""
+    return {
+        'name': theme_data.get('name', ''),
+        'description': theme_data.get('description', ''),
+        'question_count': question_index['total'],
+        'categories': question_index['category_counts'],
+        'types': question_index['type_counts']
+    }
+
+def _read_manifest() -> Dict[str, Dict[str, Any]]:
+    """Манифест из файла (перечитывается, только если файл изменился)"""
+    if _watching() and _manifest_cache['mtime'] is not None:
+        return _manifest_cache['data']
+    
+    manifest_path = get_manifest_path()
+    try:
+        mtime = os.stat(manifest_path).st_mtime_ns
+    except OSError:
+        return {}
+    
+    if _manifest_cache['mtime'] != mtime:
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                _manifest_cache['data'] = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Манифест тем поврежден и будет пересоздан: {e}")
+            _manifest_cache['data'] = {}
+        _manifest_cache['mtime'] = mtime
+    
+    return _manifest_cache['data']
+
+def _write_manifest(manifest: Dict[str, Dict[str, Any]]) -> None:
+    """Сохранить манифест и запомнить его mtime, чтобы не перечитывать свою же запись"""
+    manifest_path = get_manifest_path()
+    try:
+        atomic_write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        _manifest_cache['data'] = manifest
+        _manifest_cache['mtime'] = os.stat(manifest_path).st_mtime_ns
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить манифест тем: {e}")
+
+def scan_theme_manifest() -> Dict[str, Dict[str, Any]]:
+    """
+    Метаданные всех тем: название, описание, количество вопросов и категории
+    Вопросы не загружаются - полную тему отдает load_theme
+    
+    Запись манифеста сверяется с mtime/размером файла темы, поэтому правки,
+    сделанные в обход save_theme, подхватываются автоматически.
+    """
+    if _use_sqlite():
+        return theme_db.get_manifest()
+    
+    result = {}
+    
+    with _cache_lock:
+        theme_files = _list_theme_files()
+        manifest = dict(_read_manifest())
+        changed = False
+        
+        stale_files = []
+        for theme_file in theme_files:
+            try:
+                if not _is_current(manifest.get(_theme_id_from_path(theme_file)), theme_file):
+                    stale_files.append(theme_file)
+            except OSError:
+                stale_files.append(theme_file)
+        
+        loaded = _load_theme_files(stale_files)
+        
+        for theme_file in theme_files:
+            theme_id = _theme_id_from_path(theme_file)
+            if theme_file not in loaded:
+                result[theme_id] = manifest[theme_id]
+                continue
+            
+            loaded_entry = loaded[theme_file]
+            if isinstance(loaded_entry, Exception):
+                print(f"❌ Ошибка загрузки темы {theme_file}: {loaded_entry}")
+                continue
+            
+            _report_loaded(theme_file, loaded_entry)
+            entry = _build_manifest_entry(loaded_entry['data'], loaded_entry['index'])
+            entry['mtime'] = loaded_entry['mtime']
+            entry['size'] = loaded_entry['size']
+            manifest[theme_id] = entry
+            result[theme_id] = entry
+            changed = True
+        
+        # Удаляем записи о темах, файлов которых больше нет
+        for theme_id in list(manifest):
+            if theme_id not in result:
+                del manifest[theme_id]
+                changed = True
+        
+        if changed:
+            _write_manifest(manifest)
+    
+    return result
+
+def _on_theme_file_changed(theme_file: str) -> None:
+    """
+    Обработчик событий наблюдателя: сбрасывает кэш только изменившейся темы
+    Собственные записи save_theme узнаются по совпадению mtime/размера и не сбрасываются
+    Событие о журнале (<theme_id>.journal) относится к файлу темы рядом с ним
+    """
+    theme_file = os.path.splitext(theme_file)[0] + ".json"
+    theme_id = _theme_id_from_path(theme_file)
+    
+    with _cache_lock:
+        try:
+            stat = _theme_stat(theme_file)
+            _watched_files.add(theme_file)
+        except OSError:
+            stat = None
+            _watched_files.discard(theme_file)
+        
+        def is_stale(entry):
+            return entry is not None and (stat is None or not _is_fresh(entry, stat))
+        
+        manifest = _manifest_cache['data']
+        stale = False
+        if is_stale(_theme_cache.get(theme_file)):
+            del _theme_cache[theme_file]
+            stale = True
+        if is_stale(_offset_cache.get(theme_id)):
+            del _offset_cache[theme_id]
+            stale = True
+        if is_stale(manifest.get(theme_id)):
+            _manifest_cache['data'] = {key: value for key, value in manifest.items() if key != theme_id}
+            stale = True
+    
+    if stale:
+        print(f"🔄 Тема '{theme_id}' изменена на диске - кэш сброшен")
+
+def start_theme_watcher(force: bool = False) -> bool:
+    """
+    Запустить фоновое наблюдение за папкой themes/ (один раз на процесс)
+    Включается переменной FAP_THEME_WATCH=1 или force=True; для SQLite не нужно
+    """
+    global _watcher
+    
+    if _use_sqlite() or not (WATCH_THEMES or force):
+        return False
+    
+    with _cache_lock:
+        if _watching():
+            return True
+        
+        # Сначала подписываемся на события, потом фиксируем состояние -
+        # так изменения между этими шагами не потеряются
+        _watcher = ThemeWatcher(get_themes_dir(), _on_theme_file_changed)
+        _watcher.start()
+        
+        _watched_files.clear()
+        _watched_files.update(glob.glob(os.path.join(get_themes_dir(), "*.json")))
+        
+        # Кэш мог устареть до запуска наблюдения - сверяем его один раз
+        for theme_file in list(_theme_cache):
+            try:
+                if not _is_fresh(_theme_cache[theme_file], _theme_stat(theme_file)):
+                    del _theme_cache[theme_file]
+            except OSError:
+                del _theme_cache[theme_file]
+        _offset_cache.clear()
+        
+        # Манифест тоже: дальше он читается из памяти, а события до этого момента уже пропущены
+        _manifest_cache['mtime'] = None
+        manifest = _read_manifest()
+        fresh_manifest = {}
+        for theme_id, entry in manifest.items():
+            try:
+                if _is_fresh(entry, _theme_stat(os.path.join(get_themes_dir(), f"{theme_id}.json"))):
+                    fresh_manifest[theme_id] = entry
+            except OSError:
+                pass
+        _manifest_cache['data'] = fresh_manifest
+    
+    print(f"👀 Наблюдение за темами запущено ({_watcher.mode})")
+    return True
+
+def stop_theme_watcher() -> None:
+    """Остановить наблюдение - кэш снова сверяется с os.stat при каждом обращении"""
+    global _watcher
+    
+    with _cache_lock:
+        if _watcher is not None:
+            _watcher.stop()
+            _watcher = None
+
+def invalidate_theme_cache(theme_id: Optional[str] = None) -> None:
+    """Сбросить кэш одной темы или всех тем сразу"""
+    with _cache_lock:
+        if theme_id is None:
+            _theme_cache.clear()
+            _db_cache.clear()
+            _offset_cache.clear()
+            _compiled_cache.clear()
+            return
+        for cached_path in list(_theme_cache):
+            if _theme_cache[cached_path]['theme_id'] == theme_id:
+                del _theme_cache[cached_path]
+        _db_cache.pop(theme_id, None)
+        _offset_cache.pop(theme_id, None)
+        _compiled_cache.pop(theme_id, None)
+
+def get_theme_index(theme_id: str) -> Dict[str, Any]:
+    """
+    Предвычисленные индексы загруженной темы (см. build_question_index)
+    Строятся один раз при загрузке темы, а не на каждый rerun
+    """
+    if load_theme(theme_id) is None:
+        return build_question_index([])
+    
+    with _cache_lock:
+        if _use_sqlite():
+            cached = _db_cache.get(theme_id)
+        else:
+            theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+            cached = _theme_cache.get(theme_file)
+    
+    return cached['index'] if cached else build_question_index([])
 
 def get_categories_for_theme(themes: Dict, theme_id: str) -> List[str]:
     """Получить категории вопросов для указанной темы"""
     if theme_id not in themes:
         return []
     
-    categories = set()
-    for question in themes[theme_id].get('questions', []):
-        if question.get('category'):
-            categories.add(question['category'])
+    if _use_sqlite():
+        return theme_db.get_categories(theme_id)
+    
+    return sorted(get_theme_index(theme_id)['by_category'])
+
+def _candidate_positions(question_index: Dict[str, Any], category: Optional[str]) -> List[int]:
+    """Позиции вопросов для выборки: вся тема или одна категория"""
+    if category is None:
+        return list(range(question_index['total']))
+    return question_index['by_category'].get(category, [])
+
+def get_question_ids(theme_id: str, category: Optional[str] = None) -> List[Any]:
+    """id вопросов темы (category=None - всех категорий) по индексу, без компиляции вопросов"""
+    if _use_sqlite():
+        return theme_db.get_question_ids(theme_id, category)
+    
+    question_index = _get_question_index(theme_id)
+    return [question_index['ids'][position] for position in _candidate_positions(question_index, category)]
+
+def get_question_ids_by_category(theme_id: str, categories: List[str]) -> Dict[str, List[Any]]:
+    """
+    id вопросов нескольких категорий сразу - один проход по индексу категорий
+    (для выборки по квотам), без фильтрации всех вопросов темы
+    """
+    if _use_sqlite():
+        return theme_db.get_question_ids_by_category(theme_id, categories)
+    
+    question_index = _get_question_index(theme_id)
+    ids = question_index['ids']
+    return {
+        category: [ids[position] for position in question_index['by_category'].get(category, [])]
+        for category in categories
+    }
+
+def _get_question_index(theme_id: str) -> Dict[str, Any]:
+    """Индекс вопросов темы - по индексу смещений, а без него по загруженной теме"""
+    index = _get_offset_index_safe(theme_id)
+    return index['question_index'] if index is not None else get_theme_index(theme_id)
+
+@contextmanager
+def _theme_file_lock(theme_id: str):
+    """
+    Рекомендательная блокировка темы между процессами (themes/.<theme_id>.lock)
+    Берется до _cache_lock и держится на время сверки версии и записи
+    """
+    with file_lock(os.path.join(get_themes_dir(), f".{theme_id}.lock")):
+        yield
+
+def _version_of(entry_or_stat) -> str:
+    """Версия JSON-темы - сигнатура файла темы вместе с журналом"""
+    if isinstance(entry_or_stat, dict):
+        return f"{entry_or_stat['mtime']}:{entry_or_stat['size']}"
+    return f"{entry_or_stat.st_mtime_ns}:{entry_or_stat.st_size}"
+
+def get_theme_version(theme_id: str) -> Optional[Any]:
+    """
+    Текущая версия темы без загрузки вопросов: сигнатура файла темы с журналом
+    (для SQLite - счетчик версии в базе). None - темы нет
+    Передается в save_theme(expected_version=...), чтобы не затереть чужие правки
+    """
+    if _use_sqlite():
+        return theme_db.get_theme_version(theme_id)
+    
+    try:
+        return _version_of(_theme_stat(os.path.join(get_themes_dir(), f"{theme_id}.json")))
+    except OSError:
+        return None
+
+def get_theme_content_hash(theme_id: str) -> Optional[str]:
+    """
+    Хэш содержимого темы (файл темы вместе с журналом) - в отличие от get_theme_version
+    не меняется, если файл перезаписан тем же содержимым (checkout, развертывание)
+    Без журнала совпадает с хэшем снимка; пересчитывается только при смене версии темы
+    Для SQLite - счетчик версии в базе, он и так меняется только от правок. None - темы нет
+    """
+    if _use_sqlite():
+        version = theme_db.get_theme_version(theme_id)
+        return None if version is None else str(version)
+    
+    theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+    try:
+        version = _version_of(_theme_stat(theme_file))
+    except OSError:
+        return None
     
-    return sorted(list(categories))
+    with _cache_lock:
+        known = _content_hashes.get(theme_file)
+        cached = _theme_cache.get(theme_file)
+    if known is not None and known[0] == version:
+        return known[1]
+    
+    try:
+        # Хэш файла темы уже посчитан при загрузке, если кэш той же версии
+        if cached is not None and _version_of(cached) == version:
+            content_hash = cached['hash']
+        else:
+            with open(theme_file, 'rb') as f:
+                content_hash = _content_hash(f.read())
+        journal_path = theme_journal.get_journal_path(theme_file)
+        if os.path.exists(journal_path):
+            with open(journal_path, 'rb') as f:
+                content_hash = _content_hash(content_hash.encode('ascii') + f.read())
+    except OSError:
+        return None
+    
+    with _cache_lock:
+        _content_hashes[theme_file] = (version, content_hash)
+    return content_hash
+
+def _get_verified_theme(theme_file: str) -> Dict[str, Any]:
+    """
+    Запись кэша, сверенная с диском (вызывать под блокировкой темы и _cache_lock)
+    В отличие от _get_cached_theme не доверяет наблюдателю: чужая запись могла еще не дойти событием
+    """
+    cached = _theme_cache.get(theme_file)
+    if not _is_fresh(cached, _theme_stat(theme_file)):
+        cached = _load_theme_file(theme_file)
+        _report_loaded(theme_file, cached)
+        _theme_cache[theme_file] = cached
+    return cached
 
-def save_theme(theme_id: str, theme_data: Dict) -> bool:
-    """Сохранить тему в файл"""
+def _write_theme_json(theme_id: str, theme_data: Dict) -> str:
+    """
+    Записать тему в файл и обновить кэш, снимок, индекс смещений и манифест
+    (вызывать под блокировкой темы и _cache_lock). Возвращает путь к файлу
+    """
+    # Получаем путь к папке themes
+    themes_dir = get_themes_dir()
+    
+    # Создаем папку если её нет
+    os.makedirs(themes_dir, exist_ok=True)
+    
+    # Сохраняем файл
+    theme_path = os.path.join(themes_dir, f"{theme_id}.json")
+    raw = json.dumps(theme_data, ensure_ascii=False, indent=2).encode('utf-8')
+    atomic_write(theme_path, raw)
+    
+    # Все записи журнала уже вошли в theme_data. Если процесс упадет до удаления,
+    # повторное применение записей ничего не изменит (см. theme_journal.apply_record)
     try:
-        # Получаем путь к папке themes
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.dirname(current_dir)
-        themes_dir = os.path.join(project_root, "themes")
+        os.remove(theme_journal.get_journal_path(theme_path))
+    except FileNotFoundError:
+        pass
+    
+    # Обновляем кэш, снимок, индекс смещений и манифест сразу, чтобы не перечитывать только что записанный файл
+    stat = os.stat(theme_path)
+    content_hash = _content_hash(raw)
+    _write_snapshot(theme_id, content_hash, theme_data)
+    
+    _theme_cache[theme_path] = {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'hash': content_hash,
+        'theme_id': theme_id,
+        'data': theme_data,
+        'index': build_question_index(theme_data.get('questions', [])),
+        'from_snapshot': False,
+        'load_time': 0.0
+    }
+    
+    offsets = offset_index.build_offsets(raw)
+    if offsets is not None:
+        index = offset_index.write_index(
+            get_offset_index_path(theme_id), stat.st_mtime_ns, stat.st_size, offsets
+        )
+        index['question_index'] = build_question_index(offsets)
+        _offset_cache[theme_id] = index
+    
+    _update_manifest_entry(theme_id, _theme_cache[theme_path])
+    return theme_path
+
+def _update_manifest_entry(theme_id: str, cached: Dict[str, Any]) -> None:
+    """Обновить запись манифеста по записи кэша темы (вызывать под _cache_lock)"""
+    manifest = dict(_read_manifest())
+    entry = _build_manifest_entry(cached['data'], cached['index'])
+    entry['mtime'] = cached['mtime']
+    entry['size'] = cached['size']
+    manifest[theme_id] = entry
+    _write_manifest(manifest)
+
+def add_change_listener(callback: Callable[[str, Optional[Dict[str, Any]]], None]) -> None:
+    """Подписаться на сохранения тем (вызывается после записи, без блокировок кэша)"""
+    if callback not in _change_listeners:
+        _change_listeners.append(callback)
+
+def _notify_change(theme_id: str, record: Optional[Dict[str, Any]]) -> None:
+    for callback in list(_change_listeners):
+        try:
+            callback(theme_id, record)
+        except Exception as e:
+            print(f"⚠️ Ошибка обработчика изменения темы {theme_id}: {e}")
+
+def save_theme(theme_id: str, theme_data: Dict, expected_version: Optional[Any] = None) -> bool:
+    """
+    Сохранить тему в файл целиком (через временный файл и rename)
+    Журнал правок темы при этом больше не нужен и удаляется
+    
+    expected_version - версия, с которой начиналось редактирование (get_theme_version);
+    если тему за это время изменил другой редактор, сохранение отклоняется.
+    Отдельные вопросы безопаснее менять через add/update/delete_question - они сливаются
+    с чужими правками без конфликтов.
+    """
+    if _use_sqlite():
+        try:
+            theme_db.save_theme(theme_id, theme_data, expected_version)
+            print(f"✅ Тема '{theme_id}' сохранена в {theme_db.get_db_path()}")
+            _notify_change(theme_id, None)
+            return True
+        except theme_db.ThemeConflictError as e:
+            invalidate_theme_cache(theme_id)
+            print(f"❌ Тема '{theme_id}' изменена другим редактором - сохранение отклонено ({e})")
+            return False
+        except Exception as e:
+            invalidate_theme_cache(theme_id)
+            print(f"❌ Ошибка сохранения темы {theme_id}: {e}")
+            return False
+    
+    try:
+        os.makedirs(get_themes_dir(), exist_ok=True)
+        with _theme_file_lock(theme_id), _cache_lock:
+            if expected_version is not None:
+                theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+                current_version = _version_of(_theme_stat(theme_file)) if os.path.exists(theme_file) else None
+                if current_version != expected_version:
+                    _theme_cache.pop(theme_file, None)
+                    print(f"❌ Тема '{theme_id}' изменена другим редактором - сохранение отклонено")
+                    return False
+            
+            theme_path = _write_theme_json(theme_id, theme_data)
         
-        # Создаем папку если её нет
-        os.makedirs(themes_dir, exist_ok=True)
+        print(f"✅ Тема '{theme_id}' сохранена в {theme_path}")
+        _notify_change(theme_id, None)
+        return True
+    
+    except Exception as e:
+        # В кэше могла остаться измененная, но не сохраненная тема
+        invalidate_theme_cache(theme_id)
+        print(f"❌ Ошибка сохранения темы {theme_id}: {e}")
+        return False
+
+def migrate_json_to_sqlite() -> int:
+    """Одноразовый перенос всех тем из themes/*.json в SQLite. Возвращает число тем"""
+    themes = _scan_json_themes()
+    theme_db.import_themes(themes)
+    invalidate_theme_cache()
+    print(f"✅ Перенесено тем: {len(themes)} -> {theme_db.get_db_path()}")
+    return len(themes)
+
+def _assign_free_id(theme_data: Dict, record: Dict[str, Any]) -> None:
+    """Два редактора могли выдать новому вопросу один и тот же id - берем следующий свободный"""
+    if record['op'] != 'add':
+        return
+    
+    question = record['question']
+    ids = [q.get('id') for q in theme_data.get('questions', [])]
+    if question.get('id') in ids:
+        question['id'] = max((i for i in ids if isinstance(i, int)), default=0) + 1
+
+def _applied_copy(theme_data: Dict, record: Dict[str, Any]) -> Dict:
+    """
+    Тема с примененной правкой - новый объект (копирование при записи)
+    Тему из кэша load_theme уже отдал вызывающим (сессии редактора, индексы поиска),
+    поэтому ее нельзя менять на месте: они увидели бы правку наполовину
+    """
+    new_data = dict(theme_data)
+    new_data['questions'] = list(theme_data.get('questions', []))
+    theme_journal.apply_record(new_data, record)
+    return new_data
+
+def _edit_theme(theme_id: str, record: Dict[str, Any]) -> bool:
+    """
+    Применить одну правку вопроса: в режиме журнала - дописать запись,
+    иначе - изменить тему и сохранить ее целиком
+    
+    Правка применяется к актуальному состоянию темы под блокировкой, поэтому
+    параллельные редакторы сливаются на уровне отдельных вопросов
+    """
+    if _use_sqlite():
+        try:
+            version_before, version = theme_db.apply_edit(theme_id, record)
+        except Exception as e:
+            invalidate_theme_cache(theme_id)
+            print(f"❌ Ошибка сохранения темы {theme_id}: {e}")
+            return False
         
-        # Сохраняем файл
-        theme_path = os.path.join(themes_dir, f"{theme_id}.json")
-        with open(theme_path, 'w', encoding='utf-8') as f:
-            json.dump(theme_data, f, ensure_ascii=False, indent=2)
+        with _cache_lock:
+            # Кэш обновляем без перечитывания, только если между загрузкой и правкой никто не писал
+            cached = _db_cache.get(theme_id)
+            if cached is not None and cached['version'] == version_before:
+                data = _applied_copy(cached['data'], record)
+                _db_cache[theme_id] = {
+                    **cached,
+                    'data': data,
+                    'version': version,
+                    'index': build_question_index(data.get('questions', []))
+                }
+            else:
+                _db_cache.pop(theme_id, None)
         
-        print(f"✅ Тема '{theme_id}' сохранена в {theme_path}")
+        print(f"✅ Тема '{theme_id}' сохранена в {theme_db.get_db_path()}")
+        _notify_change(theme_id, record)
         return True
+    
+    theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+    if not os.path.exists(theme_file):
+        return False
+    
+    journal_path = theme_journal.get_journal_path(theme_file)
+    try:
+        with _theme_file_lock(theme_id), _cache_lock:
+            cached = _get_verified_theme(theme_file)
+            _assign_free_id(cached['data'], record)
+            
+            data = _applied_copy(cached['data'], record)
+            
+            if not JOURNAL_MODE:
+                _write_theme_json(theme_id, data)
+                print(f"✅ Тема '{theme_id}' сохранена в {theme_file}")
+            else:
+                theme_journal.append_record(journal_path, record)
+                
+                # Подменяем запись кэша темой с правкой и новой сигнатурой - без перечитывания файла
+                stat = _theme_stat(theme_file)
+                cached = {
+                    **cached,
+                    'data': data,
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'index': build_question_index(data.get('questions', []))
+                }
+                _theme_cache[theme_file] = cached
+                _offset_cache.pop(theme_id, None)
+                _update_manifest_entry(theme_id, cached)
+                print(f"✅ Правка темы '{theme_id}' записана в журнал {journal_path}")
+                
+                if theme_journal.count_records(journal_path) >= JOURNAL_COMPACT_RECORDS:
+                    _write_theme_json(theme_id, data)
+                    print(f"🔄 Журнал темы '{theme_id}' сжат в основной файл")
         
+        _notify_change(theme_id, record)
+        return True
+    
     except Exception as e:
+        invalidate_theme_cache(theme_id)
         print(f"❌ Ошибка сохранения темы {theme_id}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def add_question(theme_id: str, question: Dict) -> bool:
+    """Добавить вопрос в конец темы (при занятом id вопрос получит следующий свободный)"""
+    return _edit_theme(theme_id, {'op': 'add', 'question': question})
+
+def update_question(theme_id: str, question: Dict) -> bool:
+    """Заменить вопрос с тем же id"""
+    return _edit_theme(theme_id, {'op': 'update', 'question': question})
+
+def delete_question(theme_id: str, question_id: Any) -> bool:
+    """Удалить вопрос по id"""
+    return _edit_theme(theme_id, {'op': 'delete', 'id': question_id})
+
+def compact_theme(theme_id: str) -> bool:
+    """Сжать журнал правок: записать тему с примененным журналом в JSON и удалить журнал"""
+    theme_file = os.path.join(get_themes_dir(), f"{theme_id}.json")
+    if _use_sqlite() or not os.path.exists(theme_file):
+        return False
+    
+    try:
+        with _theme_file_lock(theme_id), _cache_lock:
+            _write_theme_json(theme_id, _get_verified_theme(theme_file)['data'])
+    except Exception as e:
+        invalidate_theme_cache(theme_id)
+        print(f"❌ Ошибка сжатия журнала темы {theme_id}: {e}")
+        return False
+    
+    print(f"🔄 Журнал темы '{theme_id}' сжат в основной файл")
+    return True
\ No newline at end of file
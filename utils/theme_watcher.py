@@ -0,0 +1,131 @@
+# /home/maksim/Документы/DMA/fap_test_system/utils/theme_watcher.py
+"""
+Наблюдение за папкой themes/: сообщает об изменении файлов тем
+На Linux используется inotify (через ctypes), в остальных случаях - опрос os.stat
+"""
+import os
+import glob
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from typing import Callable, Dict, Tuple
+
+# Маски событий inotify (см. man 7 inotify)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+def is_theme_file(name: str) -> bool:
+    """
+    Файл темы (*.json) или ее журнал правок (*.journal),
+    но не служебные скрытые файлы вроде .manifest.json
+    """
+    return name.endswith(('.json', '.journal')) and not name.startswith('.')
+
+class ThemeWatcher(threading.Thread):
+    """
+    Фоновый поток, вызывающий on_change(путь_к_файлу) при создании,
+    изменении или удалении файла темы
+    """
+    
+    def __init__(self, themes_dir: str, on_change: Callable[[str], None], poll_interval: float = 1.0):
+        super().__init__(name="theme-watcher", daemon=True)
+        self.themes_dir = themes_dir
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._inotify_fd = self._init_inotify()
+        self.mode = "inotify" if self._inotify_fd is not None else "polling"
+    
+    def _init_inotify(self):
+        """Открыть inotify; None - если платформа его не поддерживает"""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            wd = libc.inotify_add_watch(fd, os.fsencode(self.themes_dir), WATCH_MASK)
+            if wd < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+    
+    def stop(self) -> None:
+        self._stop_event.set()
+    
+    def run(self) -> None:
+        try:
+            if self._inotify_fd is not None:
+                self._run_inotify()
+            else:
+                self._run_polling()
+        except Exception as e:
+            print(f"❌ Наблюдение за темами остановлено: {e}")
+    
+    def _notify(self, name: str) -> None:
+        if is_theme_file(name):
+            try:
+                self.on_change(os.path.join(self.themes_dir, name))
+            except Exception as e:
+                print(f"⚠️ Ошибка обработки изменения темы {name}: {e}")
+    
+    def _run_inotify(self) -> None:
+        fd = self._inotify_fd
+        try:
+            while not self._stop_event.is_set():
+                ready, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        continue
+                    raise
+                
+                # Одна пачка событий может содержать несколько записей об одном файле
+                changed = []
+                offset = 0
+                while offset + _EVENT_HEADER.size <= len(data):
+                    _, _, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                    offset += _EVENT_HEADER.size
+                    name = data[offset:offset + name_len].rstrip(b'\0').decode('utf-8', 'replace')
+                    offset += name_len
+                    if name and name not in changed:
+                        changed.append(name)
+                
+                for name in changed:
+                    self._notify(name)
+        finally:
+            os.close(fd)
+    
+    def _stat_all(self) -> Dict[str, Tuple[int, int]]:
+        state = {}
+        theme_files = glob.glob(os.path.join(self.themes_dir, "*.json"))
+        theme_files += glob.glob(os.path.join(self.themes_dir, "*.journal"))
+        for theme_file in theme_files:
+            try:
+                stat = os.stat(theme_file)
+                state[os.path.basename(theme_file)] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+        return state
+    
+    def _run_polling(self) -> None:
+        previous = self._stat_all()
+        while not self._stop_event.wait(self.poll_interval):
+            current = self._stat_all()
+            for name in previous.keys() | current.keys():
+                if previous.get(name) != current.get(name):
+                    self._notify(name)
+            previous = current
\ No newline at end of file